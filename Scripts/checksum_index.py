@@ -0,0 +1,127 @@
+# checksum_index.py
+# Content-hash (Drive md5Checksum) → match result index, persisted in S3.
+#
+# Photographers upload the same image to several folders or under new
+# names; every copy gets a new file ID. With this index a byte-identical
+# duplicate skips download and Rekognition and goes straight to copying.
+
+import json
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from .config import S3_BUCKET, MP_CHECKSUM_INDEX_KEY
+from .clients import get_s3
+
+
+# Longest a duplicate waits for the first copy's search result,
+# checking every CLAIM_POLL_SECONDS whether the run is stopping
+CLAIM_WAIT_SECONDS = 120
+CLAIM_POLL_SECONDS = 0.5
+
+# claim() result when the wait ended without a result: retry next run
+CLAIM_BUSY = "busy"
+
+
+class ChecksumIndex:
+    """
+    md5 → {"faces_detected", "matches", "revision"}.
+
+    An entry is only trusted while the face map is at the revision it
+    was searched against (FaceMapStore.revision()); after an indexing
+    run new or re-indexed students may match old photos, so those
+    entries are searched again. load() drops entries of older
+    revisions, so the saved index only holds results still usable.
+
+    claim() also coalesces duplicates inside one run: the first task
+    with a checksum owns it, later ones wait for its record()/release().
+    """
+
+    def __init__(self, revision):
+        self.revision = revision
+        self.entries = {}
+        self._inflight = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            resp = get_s3().get_object(Bucket=S3_BUCKET, Key=MP_CHECKSUM_INDEX_KEY)
+            entries = json.loads(resp["Body"].read().decode("utf-8"))
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            entries = {}
+
+        self.entries = {
+            md5: entry for md5, entry in entries.items()
+            if entry.get("revision") == self.revision
+        }
+        # Outdated entries are left out of the next save
+        self._dirty = len(self.entries) != len(entries)
+        return self
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = json.dumps(self.entries, separators=(",", ":"))
+            self._dirty = False
+
+        get_s3().put_object(
+            Bucket=S3_BUCKET,
+            Key=MP_CHECKSUM_INDEX_KEY,
+            Body=payload.encode("utf-8")
+        )
+
+    def _valid_entry(self, md5):
+        entry = self.entries.get(md5)
+        if entry and entry.get("revision") == self.revision:
+            return entry
+        return None
+
+    def claim(self, md5, stop_event=None):
+        """
+        Returns the cached entry, or None once the caller owns md5 and
+        must search it (then call record() or release()). Blocks while
+        another task of this run is searching the same content; returns
+        CLAIM_BUSY if that takes over CLAIM_WAIT_SECONDS or stop_event
+        is set, without taking the claim over.
+        """
+        deadline = time.monotonic() + CLAIM_WAIT_SECONDS
+        while True:
+            with self._lock:
+                entry = self._valid_entry(md5)
+                if entry:
+                    return entry
+                event = self._inflight.get(md5)
+                if event is None:
+                    self._inflight[md5] = threading.Event()
+                    return None
+            while not event.wait(CLAIM_POLL_SECONDS):
+                if (stop_event is not None and stop_event.is_set()) or time.monotonic() >= deadline:
+                    # Run stopping, or the owner is stuck: searching it too
+                    # would deliver the same photo twice
+                    return CLAIM_BUSY
+
+    def record(self, md5, faces_detected, matches):
+        with self._lock:
+            self.entries[md5] = {
+                "faces_detected": faces_detected,
+                # Only what the copy stage reads
+                "matches": [
+                    {"Face": {"FaceId": m["Face"]["FaceId"]}, "Similarity": m["Similarity"]}
+                    for m in matches
+                ],
+                "revision": self.revision,
+            }
+            self._dirty = True
+        self.release(md5)
+
+    def release(self, md5):
+        """Wake tasks waiting on md5 (they re-check the index)."""
+        with self._lock:
+            event = self._inflight.pop(md5, None)
+        if event is not None:
+            event.set()
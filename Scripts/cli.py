@@ -4,6 +4,7 @@
 
 import argparse
 
+from . import metrics
 from .refs_manager import phase1_build_refs
 from .rekog_manager import index_faces_and_record
 from .folders_manager import create_output_structure
@@ -11,35 +12,39 @@ from .sorter import phase4_sort_uploads
 
 # ====== EXPORTABLE FUNCTIONS FOR APP.PY ======
 
-def run_full_indexing():
-    from .refs_manager import phase1_build_refs
-    from .rekog_manager import upload_refs_to_s3, index_faces_and_record
-    from .folders_manager import create_output_structure
-
-    phase1_build_refs()
-    upload_refs_to_s3()
-    index_faces_and_record(update_sheet=True)
-    create_output_structure()
-
-
-def download_and_process_uploads():
-    from .sorter import phase4_sort_uploads
-    from .reporting import append_uploaded_data
-
-    rows = phase4_sort_uploads()
-    append_uploaded_data(rows)
+def download_and_process_uploads(stop_event=None, progress=None):
+    """
+    Phase 4 + Phase 5 (the report is streamed to Uploaded Data
+    while sorting runs, see reporting.ReportSink, which records the
+    phase5_report time).
+    """
+    with metrics.phase_timer("phase4_sort"):
+        phase4_sort_uploads(stop_event=stop_event, progress=progress)
 
 
-def run_full_indexing():
+def run_full_indexing(stop_event=None, progress=None):
     """
     Phase 1 + Phase 2 + Phase 3
     - Build reference images (Drive → S3)
     - Index faces (S3 → Rekognition → Sheet)
     - Create Drive output folders
+
+    stop_event is checked between phases.
     """
-    phase1_build_refs()
-    index_faces_and_record(update_sheet=True)
-    create_output_structure()
+    phases = [
+        ("phase1_refs", phase1_build_refs),
+        ("phase2_index", lambda: index_faces_and_record(update_sheet=True)),
+        ("phase3_folders", create_output_structure),
+    ]
+
+    for name, phase in phases:
+        if stop_event is not None and stop_event.is_set():
+            print("🛑 Indexing cancelled before phase:", name)
+            return
+        if progress is not None:
+            progress.set("phase", name)
+        with metrics.phase_timer(name):
+            phase()
 
 
 def run_sorting():
@@ -48,9 +53,30 @@ def run_sorting():
     - Read upload folders from Validation sheet
     - Match faces
     - Copy images into student folders
-    - Append report to Uploaded Data sheet
+    - Append report to Uploaded Data sheet (buffered, as files finish)
     """
-    phase4_sort_uploads()
+    with metrics.phase_timer("phase4_sort"):
+        phase4_sort_uploads()
+
+
+def run_coordinator(local_workers=0, stop_event=None, progress=None):
+    """
+    Distributed Phase 4 + 5: plan the run, sort alongside any workers
+    (`--work` on other processes / containers, plus `local_workers`
+    started here), then merge their results.
+    """
+    from .cluster import coordinate
+
+    with metrics.phase_timer("phase4_sort"):
+        coordinate(stop_event=stop_event, progress=progress, local_workers=local_workers)
+
+
+def run_worker(stop_event=None, progress=None):
+    """Claim and sort units of the current distributed run until it is done."""
+    from .cluster import work
+
+    with metrics.phase_timer("phase4_sort_worker"):
+        work(stop_event=stop_event, progress=progress)
 
 
 def main():
@@ -70,6 +96,25 @@ def main():
         help="Run sorting (Phase 4–5): process uploads & report"
     )
 
+    parser.add_argument(
+        "--coordinate",
+        action="store_true",
+        help="Run sorting distributed: split new uploads into units for --work processes"
+    )
+
+    parser.add_argument(
+        "--work",
+        action="store_true",
+        help="Work on the current distributed sort run until it is done"
+    )
+
+    parser.add_argument(
+        "--local-workers",
+        type=int,
+        default=0,
+        help="With --coordinate: also start this many --work processes here"
+    )
+
     parser.add_argument(
         "--run-all-once",
         action="store_true",
@@ -78,15 +123,24 @@ def main():
 
     args = parser.parse_args()
 
-    if args.run_index:
-        run_full_indexing()
+    try:
+        if args.run_index:
+            run_full_indexing()
+
+        if args.run_sort:
+            run_sorting()
+
+        if args.coordinate:
+            run_coordinator(local_workers=args.local_workers)
 
-    if args.run_sort:
-        run_sorting()
+        if args.work:
+            run_worker()
 
-    if args.run_all_once:
-        run_full_indexing()
-        run_sorting()
+        if args.run_all_once:
+            run_full_indexing()
+            run_sorting()
+    finally:
+        print(metrics.summary())
 
 
 if __name__ == "__main__":
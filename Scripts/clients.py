@@ -0,0 +1,166 @@
+# clients.py
+# Lazy registry for every API client the pipeline uses.
+#
+# Nothing is created at import time. Google credentials are built once
+# per process (so token refreshes are shared), googleapiclient services
+# are built once per thread from the discovery documents bundled with
+# the library, and boto3 clients are created once per process with a
+# shared, larger connection pool. A forked child starts with an empty
+# registry, since sockets must not be shared with the parent.
+# Every client is instrumented for metrics.py.
+
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+from google.oauth2 import service_account
+from google.auth.transport.requests import AuthorizedSession
+from googleapiclient.discovery import build
+
+from .metrics import (
+    InstrumentedHttpRequest,
+    instrument_boto3_client,
+    instrument_requests_session,
+)
+from .config import (
+    GOOGLE_SERVICE_ACCOUNT_INFO,
+    AWS_REGION,
+    AWS_MAX_POOL_CONNECTIONS,
+)
+
+SCOPES = [
+    "https://www.googleapis.com/auth/drive",
+    "https://www.googleapis.com/auth/spreadsheets"
+]
+
+_lock = threading.Lock()
+_overrides = {}
+_credentials = None
+_boto3_session = None
+_boto3_clients = {}
+
+# googleapiclient services share one httplib2.Http, which is NOT
+# thread-safe, so each thread gets its own services and sessions.
+_thread_local = threading.local()
+
+
+# ------------------------------------------------------
+# GOOGLE
+# ------------------------------------------------------
+
+def get_credentials():
+    """Service account credentials, shared by every client in the process."""
+    global _credentials
+    with _lock:
+        if _credentials is None:
+            _credentials = service_account.Credentials.from_service_account_info(
+                GOOGLE_SERVICE_ACCOUNT_INFO,
+                scopes=SCOPES
+            )
+        return _credentials
+
+
+def _thread_google_service(name, version):
+    key = f"{name}_{version}"
+    service = getattr(_thread_local, key, None)
+    if service is None and name in _overrides:
+        service = _overrides[name]()
+        setattr(_thread_local, key, service)
+    elif service is None:
+        service = build(
+            name,
+            version,
+            credentials=get_credentials(),
+            static_discovery=True,
+            cache_discovery=False,
+            requestBuilder=InstrumentedHttpRequest
+        )
+        setattr(_thread_local, key, service)
+    return service
+
+
+def get_drive():
+    """Drive v3 service owned by the calling thread"""
+    return _thread_google_service("drive", "v3")
+
+
+def get_sheets():
+    """Sheets v4 service owned by the calling thread"""
+    return _thread_google_service("sheets", "v4")
+
+
+def get_authorized_session():
+    """requests session with Google auth, owned by the calling thread"""
+    session = getattr(_thread_local, "authorized_session", None)
+    if session is None:
+        session = AuthorizedSession(get_credentials())
+        instrument_requests_session(session, "google_http")
+        _thread_local.authorized_session = session
+    return session
+
+
+# ------------------------------------------------------
+# AWS
+# ------------------------------------------------------
+
+def get_boto3_client(service_name, **config):
+    """
+    boto3 client shared by all threads (boto3 clients are thread-safe).
+    Extra botocore Config options give a separate client, e.g.
+    retries={"total_max_attempts": 1}.
+    """
+    global _boto3_session
+    key = (service_name, repr(sorted(config.items())))
+
+    with _lock:
+        client = _boto3_clients.get(key)
+        if client is None and service_name in _overrides:
+            client = _boto3_clients[key] = _overrides[service_name]()
+        elif client is None:
+            if _boto3_session is None:
+                _boto3_session = boto3.session.Session(region_name=AWS_REGION)
+            client = _boto3_session.client(
+                service_name,
+                config=Config(max_pool_connections=AWS_MAX_POOL_CONNECTIONS, **config)
+            )
+            instrument_boto3_client(client)
+            _boto3_clients[key] = client
+        return client
+
+
+def get_s3():
+    return get_boto3_client("s3")
+
+
+# ------------------------------------------------------
+# OVERRIDES (offline benchmarks)
+# ------------------------------------------------------
+
+def override_clients(**factories):
+    """
+    Build clients with the given zero-argument factories instead of
+    the real libraries, e.g. override_clients(drive=FakeDrive, s3=...).
+    Keys are "drive", "sheets" or a boto3 service name. Clients built
+    before the call are dropped.
+    """
+    _overrides.update(factories)
+    reset_clients()
+
+
+# ------------------------------------------------------
+# FORK SAFETY
+# ------------------------------------------------------
+
+def reset_clients():
+    """Forget every client; the next call builds fresh ones."""
+    global _lock, _credentials, _boto3_session, _boto3_clients, _thread_local
+    _lock = threading.Lock()
+    _credentials = None
+    _boto3_session = None
+    _boto3_clients = {}
+    _thread_local = threading.local()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_clients)
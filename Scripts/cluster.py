@@ -0,0 +1,395 @@
+# cluster.py
+# Distributed sorting: one coordinator, any number of workers (processes
+# or containers) sharing a sort run through S3.
+#
+# Layout (<prefix> is MP_SORT_RUNS_PREFIX):
+#   <prefix>current.json                the run in progress
+#   <prefix><run>/units/<n>.json        [root_id, file] pairs, SORT_UNIT_FILES per unit
+#   <prefix><run>/manifest/<n>/         the unit's WorkManifest (per-file resume)
+#   <prefix><run>/leases/<n>.json       who works on the unit, until when (leases.py)
+#   <prefix><run>/done/<n>.json         the unit is finished, with the files it finished
+#
+# The coordinator lists new uploads once, writes the units and then
+# current.json with If-None-Match, so a second coordinator joins the
+# run in progress instead of planning another. It then works as a
+# worker itself until every unit is done. Workers claim units through
+# leases and heartbeat while they sort; the unit of a worker that died
+# is taken over once its lease expires and resumes from the unit's
+# manifest. All workers append to the same Uploaded Data sheet and
+# processed-ID and unmatched-file journals. Finally the coordinator
+# compacts those, appends rows workers had to spool, saves the Drive
+# changes token and removes the run.
+
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+from .config import (
+    S3_BUCKET,
+    MP_SORT_RUNS_PREFIX,
+    SORT_UNIT_FILES,
+    SORT_CLUSTER_POLL_SECONDS,
+    SORT_WORKER_WAIT_SECONDS,
+    SORT_DISCOVERY_MODE,
+)
+from .clients import get_s3
+from .drive_changes import UploadDiscovery
+from .leases import Lease, Heartbeat, worker_name, is_conflict
+from .pipeline import Progress
+from .reporting import ReportSink
+from .s3_face_map import FaceMapStore
+from .s3_tracker import ProcessedTracker
+from .sorter import plan_uploads, iter_new_files, sort_units
+from .unmatched_files import UnmatchedFiles
+from .work_manifest import WorkManifest, write_snapshot
+
+
+RUN_KEY = MP_SORT_RUNS_PREFIX + "current.json"
+
+
+def _run_prefix(run_id):
+    return f"{MP_SORT_RUNS_PREFIX}{run_id}/"
+
+
+def _unit_key(run_id, kind, n):
+    return f"{_run_prefix(run_id)}{kind}/{n:05d}.json"
+
+
+def _manifest_prefix(run_id, n):
+    return f"{_run_prefix(run_id)}manifest/{n:05d}/"
+
+
+def _read_json(key):
+    try:
+        resp = get_s3().get_object(Bucket=S3_BUCKET, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return json.loads(resp["Body"].read().decode("utf-8"))
+
+
+def _put_json(key, data, **condition):
+    body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return get_s3().put_object(Bucket=S3_BUCKET, Key=key, Body=body, **condition)
+
+
+def _list_keys(prefix):
+    paginator = get_s3().get_paginator("list_objects_v2")
+    keys = []
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix):
+        keys.extend(obj["Key"] for obj in page.get("Contents", []))
+    return keys
+
+
+def _delete_keys(keys):
+    for i in range(0, len(keys), 1000):
+        get_s3().delete_objects(
+            Bucket=S3_BUCKET,
+            Delete={"Objects": [{"Key": k} for k in keys[i:i + 1000]], "Quiet": True}
+        )
+
+
+def current_run():
+    """The run in progress ({"run_id", "units", ...}), or None."""
+    return _read_json(RUN_KEY)
+
+
+def _done_units(run_id):
+    prefix = _run_prefix(run_id) + "done/"
+    return {int(key[len(prefix):].split(".")[0]) for key in _list_keys(prefix)}
+
+
+class _EitherEvent:
+    """Set while any of the events is set (all run_pipeline asks is is_set())."""
+
+    def __init__(self, *events):
+        self.events = [e for e in events if e is not None]
+
+    def is_set(self):
+        return any(e.is_set() for e in self.events)
+
+
+# ------------------------------------------------------
+# COORDINATOR
+# ------------------------------------------------------
+
+def plan_run(owner):
+    """
+    List new uploads and publish them as units of a new run.
+    Returns (run, discovery): discovery is None when we joined a run
+    another coordinator started; run is None when there is nothing to do.
+    """
+    run = current_run()
+    if run:
+        print(f"🔗 Joining sort run {run['run_id']} ({run['units']} unit(s))")
+        return run, None
+
+    discovery, units = plan_uploads()
+
+    face_map = FaceMapStore().load()
+    revision = face_map.revision()
+    face_map.close()
+
+    tracker = ProcessedTracker().load()
+    unmatched = UnmatchedFiles(revision=revision).load()
+    manifest = WorkManifest(revision=revision).load()
+    seen, seen_lock = set(), threading.Lock()
+
+    files = []
+    for unit in units:
+        for root_id, file in iter_new_files(unit, tracker, unmatched, seen, seen_lock, discovery):
+            files.append([root_id, file])
+    # Unmatched files that turned out to be gone
+    unmatched.flush()
+
+    if not files:
+        return None, discovery
+
+    run_id = uuid.uuid4().hex[:12]
+    chunks = [files[i:i + SORT_UNIT_FILES] for i in range(0, len(files), SORT_UNIT_FILES)]
+    for n, chunk in enumerate(chunks):
+        _put_json(_unit_key(run_id, "units", n), chunk)
+        # Files an interrupted run got halfway through carry their progress over
+        carried = {f["id"]: manifest.entries[f["id"]] for _, f in chunk if f["id"] in manifest.entries}
+        if carried:
+            write_snapshot(_manifest_prefix(run_id, n), carried, run_id)
+
+    run = {
+        "run_id": run_id,
+        "units": len(chunks),
+        "files": len(files),
+        "face_map_revision": revision,
+        "coordinator": owner,
+        "planned_at": time.time(),
+    }
+    try:
+        _put_json(RUN_KEY, run, IfNoneMatch="*")
+    except ClientError as e:
+        if not is_conflict(e):
+            raise
+        # Another coordinator published first: drop our plan, join theirs
+        _delete_keys(_list_keys(_run_prefix(run_id)))
+        run = current_run()
+        print(f"🔗 Joining sort run {run['run_id']} ({run['units']} unit(s))")
+        return run, None
+
+    print(f"🗂️ Sort run {run_id}: {len(files)} file(s) in {len(chunks)} unit(s)")
+    return run, discovery
+
+
+def _finish_key(run_id):
+    return _run_prefix(run_id) + "finish.json"
+
+
+def _lost(heartbeat):
+    """True (and say so) once the finish lease was lost to another coordinator."""
+    if heartbeat is not None and heartbeat.lost:
+        print("⚠️ Finish lease lost; leaving the run to the coordinator that took it over")
+        return True
+    return False
+
+
+def finish_run(run, discovery=None, heartbeat=None):
+    """
+    Merge a finished run into the shared state and remove it.
+    discovery: the planning coordinator's UploadDiscovery (its changes
+    token is saved); a coordinator that joined leaves the token as is,
+    so the next run simply lists those changes again.
+    heartbeat: the Heartbeat of the finish lease; nothing more is
+    written once it reports the lease lost.
+    """
+    run_id = run["run_id"]
+    done_ids = []
+    for n in range(run["units"]):
+        done_ids.extend((_read_json(_unit_key(run_id, "done", n)) or {}).get("files", []))
+
+    if _lost(heartbeat):
+        return False
+    if discovery is not None:
+        for file_id in done_ids:
+            discovery.mark_done(file_id)
+        if SORT_DISCOVERY_MODE == "changes":
+            discovery.save()
+
+    # Single writer from here on: safe to compact, and to append spooled rows
+    if _lost(heartbeat):
+        return False
+    tracker = ProcessedTracker().load()
+    UnmatchedFiles(revision=run["face_map_revision"]).load().close(tracker)
+    tracker.close()
+
+    if _lost(heartbeat):
+        return False
+    ReportSink().load().close()
+
+    if _lost(heartbeat):
+        return False
+    manifest = WorkManifest(revision=run["face_map_revision"]).load()
+    for n in range(run["units"]):
+        unit_ids = [f["id"] for _, f in _read_json(_unit_key(run_id, "units", n)) or []]
+        snapshot = _read_json(_manifest_prefix(run_id, n) + "manifest.json") or {}
+        manifest.absorb(unit_ids, snapshot.get("entries", {}))
+    manifest.close(completed=True)
+
+    if _lost(heartbeat):
+        return False
+    # The finish lease goes last, released by the caller
+    _delete_keys([k for k in _list_keys(_run_prefix(run_id)) if k != _finish_key(run_id)])
+    get_s3().delete_object(Bucket=S3_BUCKET, Key=RUN_KEY)
+    print(f"✅ Sort run {run_id} finished: {len(done_ids)} file(s) done")
+    return True
+
+
+def coordinate(stop_event=None, progress=None, local_workers=0):
+    """
+    Plan (or join) a distributed sort run, work on it until every unit
+    is done, then merge it. local_workers: `cli --work` processes to
+    start here once the run is published. A cancelled coordinator
+    leaves the run in place; the next one joins it.
+    """
+    owner = worker_name()
+    run, discovery = plan_run(owner)
+
+    if run is None:
+        print("✅ Nothing new to sort")
+        if discovery is not None and SORT_DISCOVERY_MODE == "changes":
+            discovery.save()
+        return
+
+    workers = [
+        subprocess.Popen([sys.executable, "-m", "Scripts.cli", "--work"])
+        for _ in range(local_workers)
+    ]
+    try:
+        work(owner=owner, stop_event=stop_event, progress=progress, run=run)
+    finally:
+        for proc in workers:
+            proc.wait()
+
+    if stop_event is not None and stop_event.is_set():
+        print(f"🛑 Coordinator stopped; run {run['run_id']} stays for the next coordinator")
+        return
+
+    # Several coordinators may have joined; one merges the run
+    lease = Lease.acquire(_finish_key(run["run_id"]), owner)
+    if lease is None:
+        print(f"🔗 Sort run {run['run_id']} is being finished by another coordinator")
+        return
+    try:
+        with Heartbeat(lease, on_lost=lambda: None) as heartbeat:
+            finish_run(run, discovery, heartbeat=heartbeat)
+    finally:
+        lease.release()
+
+
+# ------------------------------------------------------
+# WORKER
+# ------------------------------------------------------
+
+def _wait_for_run(stop_event, timeout=SORT_WORKER_WAIT_SECONDS):
+    deadline = time.monotonic() + timeout
+    while True:
+        run = current_run()
+        if run or time.monotonic() >= deadline:
+            return run
+        if stop_event.wait(SORT_CLUSTER_POLL_SECONDS):
+            return None
+
+
+def _sort_unit(run, n, lease, stop_event, progress):
+    """Sort one leased unit. True once its done marker is written."""
+    run_id = run["run_id"]
+    files = _read_json(_unit_key(run_id, "units", n)) or []
+
+    lease_lost = threading.Event()
+    # Only the unit's files, nothing to save: the coordinator owns discovery
+    discovery = UploadDiscovery([])
+
+    try:
+        with Heartbeat(lease, on_lost=lease_lost.set) as heartbeat:
+            completed = sort_units(
+                [("files", files)],
+                discovery,
+                stop_event=_EitherEvent(stop_event, lease_lost),
+                progress=progress,
+                manifest_prefix=_manifest_prefix(run_id, n),
+                shared=True
+            )
+
+        if not completed or heartbeat.lost:
+            return False
+
+        try:
+            _put_json(_unit_key(run_id, "done", n), {
+                "owner": lease.owner,
+                "files": discovery.done_ids(),
+                "finished_at": time.time(),
+            }, IfNoneMatch="*")
+        except ClientError as e:
+            if not is_conflict(e):
+                raise
+            return False    # a worker we took over from finished it after all
+    finally:
+        # Done, stopped, failed or lost: free the unit now rather than
+        # after the lease expires (a no-op once it is no longer ours)
+        lease.release()
+    progress.incr("units")
+    return True
+
+
+def work(owner=None, stop_event=None, progress=None, run=None):
+    """
+    Claim and sort units of the current run until all of them are
+    done (or stop_event is set). Waits while the last units are leased
+    by others, so a unit whose worker died is still taken over.
+    Returns the run worked on, or None if there was none.
+    """
+    owner = owner or worker_name()
+    stop_event = stop_event or threading.Event()
+    progress = progress or Progress()
+
+    run = run or _wait_for_run(stop_event)
+    if run is None:
+        print("💤 No sort run to work on")
+        return None
+    run_id = run["run_id"]
+    print(f"👷 Worker {owner} on sort run {run_id}")
+
+    while not stop_event.is_set():
+        current = current_run()
+        if not current or current["run_id"] != run_id:
+            break   # finished and removed by the coordinator
+
+        done = _done_units(run_id)
+        todo = [n for n in range(run["units"]) if n not in done]
+        if not todo:
+            break
+
+        # Random order so workers starting together do not all race for unit 0
+        random.shuffle(todo)
+        claimed = False
+        for n in todo:
+            if stop_event.is_set():
+                break
+            lease = Lease.acquire(_unit_key(run_id, "leases", n), owner)
+            if lease and _read_json(_unit_key(run_id, "done", n)) is not None:
+                # Finished (and released) since we listed done/
+                lease.release()
+                continue
+            if lease:
+                print(f"📦 Unit {n + 1}/{run['units']} claimed by {owner}")
+                _sort_unit(run, n, lease, stop_event, progress)
+                claimed = True
+                break
+
+        if not claimed:
+            stop_event.wait(SORT_CLUSTER_POLL_SECONDS)
+
+    return run
@@ -3,6 +3,7 @@
 # Customize only via environment variables in the container/task definition.
 
 import os
+import tempfile
 
 # Google credentials: prefer JSON string in env var GOOGLE_CREDENTIALS_JSON_CONTENT
 GOOGLE_SERVICE_ACCOUNT_INFO = {
@@ -47,9 +48,28 @@ S3_BUCKET = os.environ.get("MP_S3_BUCKET", "media-portfolio-students")
 AWS_REGION = os.environ.get("MP_AWS_REGION", "ap-south-1")
 REKOG_COLLECTION = os.environ.get("MP_REKOG_COLLECTION", "StudentCollection")
 
+# HTTP connections each shared boto3 client may keep open (all worker threads share them)
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "64"))
+
 # Storage keys in S3 for persistent state
 MP_PROCESSED_TRACKER_KEY = os.environ.get("MP_PROCESSED_TRACKER_KEY", "state/processed_drive_files.json")
 MP_FACE_MAP_KEY = os.environ.get("MP_FACE_MAP_KEY", "state/faceid_map.csv")
+MP_FACE_MAP_DB_KEY = os.environ.get("MP_FACE_MAP_DB_KEY", "state/faceid_map.sqlite")
+MP_FOLDER_INDEX_KEY = os.environ.get("MP_FOLDER_INDEX_KEY", "state/student_folder_index.json")
+MP_CHANGES_STATE_KEY = os.environ.get("MP_CHANGES_STATE_KEY", "state/drive_changes.json")
+MP_CHECKSUM_INDEX_KEY = os.environ.get("MP_CHECKSUM_INDEX_KEY", "state/checksum_index.json")
+MP_MASTERSHEET_CACHE_KEY = os.environ.get("MP_MASTERSHEET_CACHE_KEY", "state/mastersheet_snapshot.json")
+MP_REPORT_LOG_PREFIX = os.environ.get("MP_REPORT_LOG_PREFIX", "reports/")
+MP_WORK_MANIFEST_PREFIX = os.environ.get("MP_WORK_MANIFEST_PREFIX", "state/sort_manifest/")
+MP_SORT_RUNS_PREFIX = os.environ.get("MP_SORT_RUNS_PREFIX", "state/sort_runs/")
+MP_UNMATCHED_PREFIX = os.environ.get("MP_UNMATCHED_PREFIX", "state/unmatched/")
+
+# Local copies of S3 state files (face map database), keyed by ETag
+STATE_CACHE_DIR = os.environ.get("MP_STATE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "mp_state_cache"))
+
+# Face map: upserts are journaled; the database is re-uploaded once
+# this many journal segments have piled up
+FACE_MAP_COMPACT_SEGMENTS = int(os.environ.get("FACE_MAP_COMPACT_SEGMENTS", "20"))
 
 # Rekognition threshold
 MIN_FACE_MATCH_CONFIDENCE = int(os.environ.get("MIN_FACE_MATCH_CONFIDENCE", "85"))
@@ -59,3 +79,107 @@ EXTERNAL_ID_FORMAT = "{srno}_{name}_{class_name}_{section}"
 
 # Controls
 SKIP_ALREADY_INDEXED = os.environ.get("SKIP_ALREADY_INDEXED", "true").lower() in ("1","true","yes")
+
+# Sorting pipeline (Phase 4): worker threads per stage + queue bound between stages
+# (listing concurrency is WALK_WORKERS below)
+SORT_DOWNLOAD_WORKERS = int(os.environ.get("SORT_DOWNLOAD_WORKERS", "8"))
+SORT_SEARCH_WORKERS = int(os.environ.get("SORT_SEARCH_WORKERS", "4"))
+SORT_COPY_WORKERS = int(os.environ.get("SORT_COPY_WORKERS", "4"))
+SORT_QUEUE_SIZE = int(os.environ.get("SORT_QUEUE_SIZE", "32"))
+
+# Downloads are kept in memory up to this size, larger files spill to a temp file
+DOWNLOAD_MAX_MEMORY_MB = int(os.environ.get("DOWNLOAD_MAX_MEMORY_MB", "64"))
+
+# Processed-ID journal: flush a segment every N files or T seconds,
+# compact segments into the snapshot once this many have piled up
+TRACKER_FLUSH_EVERY = int(os.environ.get("TRACKER_FLUSH_EVERY", "50"))
+TRACKER_FLUSH_SECONDS = float(os.environ.get("TRACKER_FLUSH_SECONDS", "30"))
+TRACKER_COMPACT_SEGMENTS = int(os.environ.get("TRACKER_COMPACT_SEGMENTS", "20"))
+
+# Processed-ID store: IDs are sharded by hash prefix (shards split once
+# they average more than TRACKER_SHARD_MAX_IDS), a Bloom filter answers
+# "never processed" without reading a shard, and shards read for exact
+# checks are cached up to TRACKER_SHARD_CACHE_IDS IDs in total
+TRACKER_SHARD_MAX_IDS = int(os.environ.get("TRACKER_SHARD_MAX_IDS", "50000"))
+TRACKER_SHARD_CACHE_IDS = int(os.environ.get("TRACKER_SHARD_CACHE_IDS", "1000000"))
+TRACKER_BLOOM_FP_RATE = float(os.environ.get("TRACKER_BLOOM_FP_RATE", "0.001"))
+
+# Multi-face matching: detect every face, search each crop on its own.
+# Off by default: one DetectFaces plus one search per face, instead of
+# one search per photo. Faces below the size / confidence / sharpness
+# floor are not searched; a photo with none above it gets the single
+# whole-image search instead.
+SORT_MULTI_FACE = os.environ.get("SORT_MULTI_FACE", "false").lower() in ("1","true","yes")
+MULTI_FACE_MIN_SIZE_PX = int(os.environ.get("MULTI_FACE_MIN_SIZE_PX", "40"))
+MULTI_FACE_MIN_CONFIDENCE = float(os.environ.get("MULTI_FACE_MIN_CONFIDENCE", "90"))
+MULTI_FACE_MIN_SHARPNESS = float(os.environ.get("MULTI_FACE_MIN_SHARPNESS", "0"))
+MULTI_FACE_MAX_FACES = int(os.environ.get("MULTI_FACE_MAX_FACES", "50"))
+MULTI_FACE_SEARCH_WORKERS = int(os.environ.get("MULTI_FACE_SEARCH_WORKERS", "8"))
+
+# Pre-Rekognition image preparation: EXIF orientation, downscale to
+# SORT_MAX_EDGE_PX, JPEG re-encode. CPU work runs in SORT_PREP_PROCESSES
+# processes (0 = in the pipeline thread). Drive's sized thumbnail can be
+# used as a cheaper source than the original file.
+SORT_MAX_EDGE_PX = int(os.environ.get("SORT_MAX_EDGE_PX", "1920"))
+SORT_JPEG_QUALITY = int(os.environ.get("SORT_JPEG_QUALITY", "85"))
+SORT_PREP_PROCESSES = int(os.environ.get("SORT_PREP_PROCESSES", str(os.cpu_count() or 1)))
+SORT_USE_DRIVE_THUMBNAIL = os.environ.get("SORT_USE_DRIVE_THUMBNAIL", "false").lower() in ("1","true","yes")
+
+# Upload discovery: "changes" = Drive Changes API since the last run
+# (full walk only on first run / expired token), "walk" = always full walk
+SORT_DISCOVERY_MODE = os.environ.get("SORT_DISCOVERY_MODE", "changes").lower()
+
+# How matched photos reach student folders: "copy" = full copy per
+# student, "shortcut" = Drive shortcut to the original (metadata only)
+SORT_DELIVERY_MODE = os.environ.get("SORT_DELIVERY_MODE", "copy").lower()
+
+# Uploaded Data report: rows are appended to the sheet every N rows or
+# T seconds; optionally every row is also kept as gzipped JSONL in S3
+# (MP_REPORT_LOG_PREFIX), which holds the history the sheet cannot
+REPORT_FLUSH_EVERY = int(os.environ.get("REPORT_FLUSH_EVERY", "200"))
+REPORT_FLUSH_SECONDS = float(os.environ.get("REPORT_FLUSH_SECONDS", "30"))
+REPORT_S3_MIRROR = os.environ.get("REPORT_S3_MIRROR", "false").lower() in ("1","true","yes")
+
+# Uploads that matched nobody are searched again after every face map
+# change, for at most this many days; then they count as processed
+UNMATCHED_RETRY_DAYS = int(os.environ.get("UNMATCHED_RETRY_DAYS", "90"))
+
+# Sort work manifest (per-file progress, for resuming interrupted runs):
+# transitions are written to S3 every N transitions or T seconds
+WORK_MANIFEST_FLUSH_EVERY = int(os.environ.get("WORK_MANIFEST_FLUSH_EVERY", "25"))
+WORK_MANIFEST_FLUSH_SECONDS = float(os.environ.get("WORK_MANIFEST_FLUSH_SECONDS", "10"))
+
+# Distributed sorting (cli --coordinate / --work): files per work unit,
+# how long a unit's lease lasts without a heartbeat, heartbeat interval,
+# how often idle workers / the coordinator look for work, and how long a
+# worker waits for a coordinator to publish a run
+SORT_UNIT_FILES = int(os.environ.get("SORT_UNIT_FILES", "250"))
+SORT_LEASE_SECONDS = float(os.environ.get("SORT_LEASE_SECONDS", "120"))
+SORT_HEARTBEAT_SECONDS = float(os.environ.get("SORT_HEARTBEAT_SECONDS", "30"))
+SORT_CLUSTER_POLL_SECONDS = float(os.environ.get("SORT_CLUSTER_POLL_SECONDS", "5"))
+SORT_WORKER_WAIT_SECONDS = float(os.environ.get("SORT_WORKER_WAIT_SECONDS", "600"))
+
+# Drive folder walker: concurrent list calls, parent folders per query
+WALK_WORKERS = int(os.environ.get("WALK_WORKERS", "8"))
+WALK_PARENTS_PER_QUERY = int(os.environ.get("WALK_PARENTS_PER_QUERY", "20"))
+
+# Rekognition rate limiting: calls per second per API operation (match the
+# account quota), floor the adaptive rate may drop to when throttled, and
+# jittered exponential retry for throttled / transient errors
+REKOG_TPS = float(os.environ.get("REKOG_TPS", "5"))
+REKOG_MIN_TPS = float(os.environ.get("REKOG_MIN_TPS", "0.5"))
+REKOG_MAX_RETRIES = int(os.environ.get("REKOG_MAX_RETRIES", "8"))
+REKOG_RETRY_BASE_SECONDS = float(os.environ.get("REKOG_RETRY_BASE_SECONDS", "0.5"))
+REKOG_RETRY_MAX_SECONDS = float(os.environ.get("REKOG_RETRY_MAX_SECONDS", "20"))
+
+# Face indexing (Phase 2): concurrent index_faces calls, and how many new
+# faces to index between face map checkpoints in S3
+INDEX_WORKERS = int(os.environ.get("INDEX_WORKERS", "8"))
+INDEX_CHECKPOINT_EVERY = int(os.environ.get("INDEX_CHECKPOINT_EVERY", "100"))
+
+# Reference sync (Phase 1): photos streamed Drive → S3 concurrently
+REFS_SYNC_WORKERS = int(os.environ.get("REFS_SYNC_WORKERS", "16"))
+
+# Web app job manager: runs waiting behind the current one, finished jobs kept for /jobs
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "4"))
+JOB_HISTORY = int(os.environ.get("JOB_HISTORY", "50"))
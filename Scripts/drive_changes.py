@@ -0,0 +1,277 @@
+# drive_changes.py
+# Incremental upload discovery via the Drive Changes API.
+#
+# A full walk of every Validation folder costs as much as all uploads
+# ever made. Instead we keep a changes page token in S3 and each run
+# only asks Drive what changed since then, keeping the files that sit
+# under a watched upload folder.
+#
+# State (MP_CHANGES_STATE_KEY):
+#   page_token  Drive changes token to resume from
+#   roots       upload folder IDs the token covers
+#   folders     every known sub-folder → its upload root
+#   pending     files discovered earlier but not yet processed (+ their root)
+
+import json
+import threading
+
+from botocore.exceptions import ClientError
+from googleapiclient.errors import HttpError
+
+from .config import S3_BUCKET, MP_CHANGES_STATE_KEY
+from .clients import get_s3
+from .gdrive_helpers import execute_drive_batch, execute_with_backoff, is_retryable_http_error
+
+
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+# How far up the parent chain we look for a watched root
+MAX_FOLDER_DEPTH = 20
+
+# changes().list answers these for an expired / unknown page token
+EXPIRED_TOKEN_STATUS = (400, 404, 410)
+
+
+class UploadDiscovery:
+    """
+    Decides, per run, which upload folders need a full walk and which
+    files the Changes API reports as new under the others.
+
+    plan() returns work units for the sorter's list stage:
+      ("walk", [folder_id...])          full walk of these upload folders
+      ("files", [(root_id, file)...])  files already known to be new
+    """
+
+    def __init__(self, root_ids, extra_fields=()):
+        self.root_ids = list(dict.fromkeys(root_ids))
+        self._root_set = set(self.root_ids)
+        self.extra_fields = tuple(extra_fields)
+        self.page_token = None
+        self.roots = set()
+        self.folders = {}
+        self.pending = {}
+        self._new_page_token = None
+        self._done = set()
+        self._outside = set()
+        self._lock = threading.Lock()
+
+    # ---------- persistence ----------
+
+    def load(self):
+        try:
+            resp = get_s3().get_object(Bucket=S3_BUCKET, Key=MP_CHANGES_STATE_KEY)
+            data = json.loads(resp["Body"].read().decode("utf-8"))
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            data = {}
+
+        self.page_token = data.get("page_token")
+        self.roots = set(data.get("roots", []))
+        self.folders = data.get("folders", {})
+        self.pending = data.get("pending", {})
+        return self
+
+    def save(self):
+        """
+        Persist the new token. Only call after a completed run, so an
+        interrupted run replays the same changes next time.
+        """
+        with self._lock:
+            pending = {
+                fid: item for fid, item in self.pending.items()
+                if fid not in self._done
+            }
+            payload = json.dumps({
+                "page_token": self._new_page_token,
+                "roots": sorted(self.root_ids),
+                "folders": self.folders,
+                "pending": pending,
+            }, ensure_ascii=False)
+
+        get_s3().put_object(
+            Bucket=S3_BUCKET,
+            Key=MP_CHANGES_STATE_KEY,
+            Body=payload.encode("utf-8")
+        )
+
+    # ---------- bookkeeping from the sorter ----------
+
+    def add_folder(self, folder_id, root_id):
+        with self._lock:
+            self.folders[folder_id] = root_id
+
+    def add_discovered(self, item, root_id):
+        """Remember a file until mark_done(); unfinished files are retried next run."""
+        with self._lock:
+            self.pending[item["id"]] = {"root": root_id, "file": item}
+
+    def mark_done(self, file_id):
+        with self._lock:
+            self._done.add(file_id)
+
+    def done_ids(self):
+        with self._lock:
+            return sorted(self._done)
+
+    # ---------- planning ----------
+
+    def plan(self, service):
+        # Grab the token BEFORE listing so nothing slips between the two
+        start_token = execute_with_backoff(lambda: service.changes().getStartPageToken(
+            supportsAllDrives=True
+        ))["startPageToken"]
+
+        known_roots = [r for r in self.root_ids if r in self.roots]
+        new_roots = [r for r in self.root_ids if r not in self.roots]
+
+        # Forget folders of roots no longer in the Validation sheet
+        watched = set(self.root_ids)
+        self.folders = {f: r for f, r in self.folders.items() if r in watched}
+
+        changed = []
+        if self.page_token and known_roots:
+            try:
+                changed, self._new_page_token = self._fetch_changes(service)
+            except HttpError as e:
+                if e.resp.status not in EXPIRED_TOKEN_STATUS:
+                    raise
+                print("⚠️ Drive changes token expired, doing a full walk")
+                new_roots = list(self.root_ids)
+                changed = []
+                self.folders = {}
+                self._new_page_token = start_token
+        else:
+            new_roots = list(self.root_ids)
+            self.folders = {}
+            self._new_page_token = start_token
+
+        units = [("walk", new_roots)] if new_roots else []
+
+        # Pending files under a walked root are found again by the walk
+        files = {
+            fid: (entry["root"], entry["file"])
+            for fid, entry in self.pending.items()
+            if entry["root"] in watched and entry["root"] not in new_roots
+        }
+        for root_id, item in changed:
+            files[item["id"]] = (root_id, item)
+
+        if files:
+            units.append(("files", list(files.values())))
+
+        # The list stage re-registers every file it hands out
+        self.pending = {}
+
+        print(f"🔎 Discovery: {len(new_roots)} folder(s) to walk, {len(files)} changed/pending file(s)")
+        return units
+
+    def revisit(self, service, items):
+        """
+        Current metadata of files listed by an earlier run.
+        items: [(file_id, root_id)]. Returns ([(root_id, file)...], gone):
+        gone holds the IDs Drive no longer has (or that are trashed).
+        """
+        file_fields = ", ".join(
+            ("id", "name", "mimeType", "parents", "trashed") + self.extra_fields
+        )
+        roots = dict(items)
+        results = execute_drive_batch(service, {
+            file_id: (lambda file_id=file_id: service.files().get(
+                fileId=file_id,
+                fields=file_fields,
+                supportsAllDrives=True
+            ))
+            for file_id in roots
+        })
+
+        found, gone = [], []
+        for file_id, (item, error) in results.items():
+            if error is not None:
+                if isinstance(error, HttpError) and error.resp.status == 404:
+                    gone.append(file_id)
+                # Anything else: still there as far as we know, try next run
+                continue
+            if item.get("trashed"):
+                gone.append(file_id)
+                continue
+            item.pop("trashed", None)
+            found.append((roots[file_id], item))
+        return found, gone
+
+    def _fetch_changes(self, service):
+        file_fields = ", ".join(
+            ("id", "name", "mimeType", "parents", "trashed") + self.extra_fields
+        )
+        page_token = self.page_token
+        changed_files = []
+        changed_folders = []
+
+        while True:
+            resp = execute_with_backoff(lambda: service.changes().list(
+                pageToken=page_token,
+                fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({file_fields}))",
+                pageSize=1000,
+                includeRemoved=False,
+                supportsAllDrives=True,
+                includeItemsFromAllDrives=True
+            ))
+
+            for change in resp.get("changes", []):
+                item = change.get("file")
+                if change.get("removed") or not item or item.get("trashed"):
+                    continue
+                if item["mimeType"] == FOLDER_MIME:
+                    changed_folders.append(item)
+                else:
+                    changed_files.append(item)
+
+            if "newStartPageToken" in resp:
+                new_token = resp["newStartPageToken"]
+                break
+            page_token = resp["nextPageToken"]
+
+        # Folders first, so files inside new sub-folders resolve cheaply
+        for item in changed_folders:
+            root_id = self._resolve_root(service, item)
+            if root_id:
+                self.add_folder(item["id"], root_id)
+
+        new_files = []
+        for item in changed_files:
+            root_id = self._resolve_root(service, item)
+            if root_id:
+                item.pop("trashed", None)
+                new_files.append((root_id, item))
+
+        return new_files, new_token
+
+    def _resolve_root(self, service, item, depth=0):
+        """Upload root the item lives under, or None."""
+        for parent_id in item.get("parents", []):
+            if parent_id in self._root_set:
+                return parent_id
+            if parent_id in self.folders:
+                return self.folders[parent_id]
+            if parent_id in self._outside or depth >= MAX_FOLDER_DEPTH:
+                continue
+
+            try:
+                parent = execute_with_backoff(lambda: service.files().get(
+                    fileId=parent_id,
+                    fields="id, parents",
+                    supportsAllDrives=True
+                ))
+            except HttpError as e:
+                if is_retryable_http_error(e):
+                    raise   # still failing after backoff: not proof it is outside
+                self._outside.add(parent_id)
+                continue
+
+            root_id = self._resolve_root(service, parent, depth + 1)
+            if root_id:
+                self.add_folder(parent_id, root_id)
+                return root_id
+            self._outside.add(parent_id)
+
+        return None
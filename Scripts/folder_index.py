@@ -0,0 +1,303 @@
+# folder_index.py
+# ExternalImageId → student folder ID index over Output_Folders,
+# persisted in S3 next to the face map so sort runs stop searching
+# all of Drive by folder name for every match.
+
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+
+from .config import (
+    S3_BUCKET,
+    OUTPUT_ROOT_FOLDER_ID,
+    EXTERNAL_ID_FORMAT,
+    MP_FOLDER_INDEX_KEY,
+)
+from .clients import get_s3
+from .gdrive_helpers import escape_query_value, execute_with_backoff
+
+
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+# Parents packed into one files().list query when walking the tree
+PARENTS_PER_QUERY = 20
+
+# Refresh window overlap, absorbs clock skew between us and Drive
+REFRESH_OVERLAP = timedelta(minutes=5)
+
+
+# ------------------------------------------------------
+# NAMING
+# ------------------------------------------------------
+
+def external_id_from_folder_name(folder_name):
+    """
+    'SrNo-Name-Class-Section' → ExternalImageId
+    (same split rekog_manager applies to refs/ file names)
+    """
+    parts = folder_name.split("-")
+    if len(parts) < 4:
+        return None
+
+    return EXTERNAL_ID_FORMAT.format(
+        srno=parts[0],
+        name=parts[1],
+        class_name=parts[2],
+        section=parts[3]
+    )
+
+
+def folder_names_for_external_id(external_id):
+    """
+    ExternalImageId → (class-section folder name, student folder name).
+    Names keep their inner underscores: 1_Aaradhya_Choudhary_5_A
+    → ('5-A', '1-Aaradhya_Choudhary-5-A').
+    """
+    try:
+        srno, rest = external_id.split("_", 1)
+        name, class_, section = rest.rsplit("_", 2)
+    except ValueError:
+        return None, None
+
+    return f"{class_}-{section}", f"{srno}-{name}-{class_}-{section}"
+
+
+# ------------------------------------------------------
+# DRIVE LISTING
+# ------------------------------------------------------
+
+def _list_folders(service, query):
+    folders = []
+    page_token = None
+
+    while True:
+        resp = execute_with_backoff(lambda: service.files().list(
+            q=f"({query}) and mimeType='{FOLDER_MIME}' and trashed=false",
+            fields="nextPageToken, files(id, name, parents)",
+            pageToken=page_token,
+            pageSize=1000,
+            orderBy="createdTime",
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True
+        ))
+
+        folders.extend(resp.get("files", []))
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            return folders
+
+
+def list_child_folders(service, parent_ids, modified_after=None):
+    """
+    List sub-folders of many parents, PARENTS_PER_QUERY per query
+    (only those modified after the given RFC 3339 time, if any).
+    """
+    parent_ids = list(parent_ids)
+    folders = []
+
+    for i in range(0, len(parent_ids), PARENTS_PER_QUERY):
+        batch = parent_ids[i:i + PARENTS_PER_QUERY]
+        query = " or ".join(f"'{pid}' in parents" for pid in batch)
+        if modified_after:
+            query = f"({query}) and modifiedTime > '{modified_after}'"
+        folders.extend(_list_folders(service, query))
+
+    return folders
+
+
+def class_folder_ids(classes):
+    """
+    Class-section name → folder ID. A name used by several folders maps
+    to the oldest (listings are ordered by createdTime); the others are
+    reported and left out, so students are created and looked up in
+    the same one.
+    """
+    ids = {}
+    for f in classes:
+        kept = ids.setdefault(f["name"], f["id"])
+        if kept != f["id"]:
+            print(f"⚠️ Duplicate class folder '{f['name']}' ({f['id']}), using {kept}")
+    return ids
+
+
+def find_folder_by_name(service, name, parent_id=None):
+    """
+    Targeted lookup; without parent_id it searches all of Drive.
+    """
+    query = f"name='{escape_query_value(name)}'"
+    if parent_id:
+        query += f" and '{parent_id}' in parents"
+
+    files = _list_folders(service, query)
+    return files[0]["id"] if files else None
+
+
+# ------------------------------------------------------
+# INDEX
+# ------------------------------------------------------
+
+def sync_timestamp():
+    """Drive modifiedTime to sync from, taken before listing the tree."""
+    return (datetime.now(timezone.utc) - REFRESH_OVERLAP).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class StudentFolderIndex:
+    """
+    Maps ExternalImageId → student folder ID under Output_Folders.
+
+    load() reads the saved index and applies Drive changes since the
+    last build (or walks Output_Folders once if there is none). get()
+    is a dict lookup and only queries Drive on a miss. Thread-safe.
+    """
+
+    def __init__(self, root_id=OUTPUT_ROOT_FOLDER_ID):
+        self.root_id = root_id
+        self.class_folders = {}     # class-section name → folder ID
+        self.students = {}          # ExternalImageId → folder ID
+        self.synced_at = None
+        self._missing = set()
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    # ---------- persistence ----------
+
+    def load(self, service):
+        try:
+            resp = get_s3().get_object(Bucket=S3_BUCKET, Key=MP_FOLDER_INDEX_KEY)
+            data = json.loads(resp["Body"].read().decode("utf-8"))
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            data = {}
+
+        if data.get("root_id") != self.root_id or not data.get("synced_at"):
+            self.build(service)
+            return self
+
+        self.class_folders = data.get("class_folders", {})
+        self.students = data.get("students", {})
+        self.synced_at = data.get("synced_at")
+        self.refresh(service)
+        return self
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = json.dumps({
+                "root_id": self.root_id,
+                "synced_at": self.synced_at,
+                "class_folders": self.class_folders,
+                "students": self.students,
+            }, ensure_ascii=False)
+            self._dirty = False
+
+        get_s3().put_object(
+            Bucket=S3_BUCKET,
+            Key=MP_FOLDER_INDEX_KEY,
+            Body=payload.encode("utf-8")
+        )
+
+    # ---------- sync with Drive ----------
+
+    def _add_students(self, folders):
+        for f in folders:
+            external_id = external_id_from_folder_name(f["name"])
+            if external_id:
+                self.students[external_id] = f["id"]
+
+    def build(self, service):
+        """Full walk: Output_Folders → Class-Section → student folders."""
+        synced_at = sync_timestamp()
+
+        classes = list_child_folders(service, [self.root_id])
+        students = list_child_folders(service, [f["id"] for f in classes])
+        self.set_tree(classes, students, synced_at)
+
+    def set_tree(self, classes, students, synced_at):
+        """
+        Replace the index with a listing of the whole tree taken by the
+        caller (e.g. folders_manager right after creating folders).
+        synced_at must be from before the listing started.
+        """
+        with self._lock:
+            self.class_folders = class_folder_ids(classes)
+            kept = set(self.class_folders.values())
+            self.students = {}
+            self._add_students(
+                f for f in students
+                if kept.intersection(f.get("parents", []))
+            )
+            self._missing = set()
+            self.synced_at = synced_at
+            self._dirty = True
+
+    def refresh(self, service):
+        """
+        Apply folders created, renamed or moved since the last sync.
+        Only Output_Folders and its class folders are queried, so the
+        cost follows the tree, not the rest of the Drive.
+        """
+        synced_at = sync_timestamp()
+        new_classes = list_child_folders(service, [self.root_id], self.synced_at)
+
+        with self._lock:
+            for f in new_classes:
+                kept = self.class_folders.setdefault(f["name"], f["id"])
+                if kept != f["id"]:
+                    print(f"⚠️ Duplicate class folder '{f['name']}' ({f['id']}), using {kept}")
+            new_classes = [f for f in new_classes if self.class_folders[f["name"]] == f["id"]]
+            class_ids = list(self.class_folders.values())
+
+        changed = list_child_folders(service, class_ids, self.synced_at)
+        with self._lock:
+            self._add_students(changed)
+
+        # Class folders created since the last sync may hold students
+        # whose own modifiedTime is older than the window
+        if new_classes:
+            students = list_child_folders(service, [f["id"] for f in new_classes])
+            with self._lock:
+                self._add_students(students)
+
+        with self._lock:
+            self.synced_at = synced_at
+            self._dirty = True
+
+    # ---------- lookups ----------
+
+    def get(self, service, external_id):
+        """
+        Folder ID for a student, or None. Misses fall back to a lookup
+        inside the student's class folder (or all of Drive if that
+        class folder is unknown); results are remembered.
+        """
+        with self._lock:
+            folder_id = self.students.get(external_id)
+            if folder_id or external_id in self._missing:
+                return folder_id
+            class_id = self.class_folders.get(
+                folder_names_for_external_id(external_id)[0]
+            )
+
+        _, folder_name = folder_names_for_external_id(external_id)
+        folder_id = None
+        if folder_name:
+            folder_id = find_folder_by_name(service, folder_name, class_id)
+
+        with self._lock:
+            if folder_id:
+                self.students[external_id] = folder_id
+                self._dirty = True
+            else:
+                self._missing.add(external_id)
+
+        return folder_id
+
+    def invalidate(self, external_id):
+        """Forget a stale entry (e.g. the folder was deleted)."""
+        with self._lock:
+            if self.students.pop(external_id, None):
+                self._dirty = True
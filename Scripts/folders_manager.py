@@ -1,14 +1,14 @@
-from .gdrive_helpers import get_drive_service
+from .gdrive_helpers import get_drive_service, escape_query_value, execute_drive_batch
 from .config import PROJECT_ROOT_FOLDER_ID
-from .refs_manager import get_mastersheet_rows
+from .mastersheet import get_mastersheet_snapshot
+from .folder_index import (
+    StudentFolderIndex,
+    class_folder_ids,
+    list_child_folders,
+    sync_timestamp,
+)
 
-
-def clean_name(name: str) -> str:
-    """
-    Normalize names to match refs / rekognition naming.
-    Example: 'Aaradhya Choudhary' -> 'Aaradhya_Choudhary'
-    """
-    return "_".join(name.strip().split())
+FOLDER_MIME = "application/vnd.google-apps.folder"
 
 
 def get_or_create_drive_folder(service, name, parent_id):
@@ -20,8 +20,8 @@ def get_or_create_drive_folder(service, name, parent_id):
     """
 
     query = (
-        f"name='{name}' and "
-        f"mimeType='application/vnd.google-apps.folder' and "
+        f"name='{escape_query_value(name)}' and "
+        f"mimeType='{FOLDER_MIME}' and "
         f"'{parent_id}' in parents and trashed=false"
     )
 
@@ -39,7 +39,7 @@ def get_or_create_drive_folder(service, name, parent_id):
 
     metadata = {
         "name": name,
-        "mimeType": "application/vnd.google-apps.folder",
+        "mimeType": FOLDER_MIME,
         "parents": [parent_id]
     }
 
@@ -53,7 +53,50 @@ def get_or_create_drive_folder(service, name, parent_id):
     return folder["id"]
 
 
-def create_output_structure():
+def create_drive_folders_batch(service, folders):
+    """
+    Create many folders with Drive batch requests.
+
+    folders: {key: (name, parent_id)}
+    Returns {key: {"id", "name", "parents"}} for the folders created;
+    failures are reported and left out.
+    """
+    def factory(name, parent_id):
+        return lambda: service.files().create(
+            body={"name": name, "mimeType": FOLDER_MIME, "parents": [parent_id]},
+            fields="id, name, parents",
+            supportsAllDrives=True
+        )
+
+    results = execute_drive_batch(
+        service,
+        {key: factory(name, parent_id) for key, (name, parent_id) in folders.items()}
+    )
+
+    created = {}
+    for key, (resp, error) in results.items():
+        if error:
+            print("❌ Folder creation failed:", folders[key][0], error)
+        else:
+            created[key] = resp
+    return created
+
+
+def desired_output_tree(students):
+    """
+    StudentRecords → {class-section folder: {student folder names}}
+    """
+    tree = {}
+
+    for rec in students:
+        if not (rec.srno and rec.name and rec.class_name and rec.section):
+            continue
+        tree.setdefault(rec.class_section, set()).add(rec.folder_name)
+
+    return tree
+
+
+def create_output_structure(update_folder_index=True):
     """
     Creates Google Drive folder structure:
 
@@ -61,12 +104,16 @@ def create_output_structure():
       └── Output_Folders
             └── Class-Section
                   └── SrNo-Name-Class-Section
+
+    The existing tree is listed once and only missing folders are
+    created (batched), so a run with no new students costs a few list
+    calls. The listing also refreshes the sorter's StudentFolderIndex.
     """
 
     service = get_drive_service()
-    rows = get_mastersheet_rows()
+    tree = desired_output_tree(get_mastersheet_snapshot().students)
 
-    if not rows:
+    if not tree:
         return
 
     # 🔹 Always ensure Output_Folders exists under Project Root
@@ -76,31 +123,46 @@ def create_output_structure():
         PROJECT_ROOT_FOLDER_ID
     )
 
-    for row in rows:
-        if len(row) < 4:
-            continue
+    synced_at = sync_timestamp()
 
-        srno = row[0].strip()
-        name = row[1].strip()
-        class_ = row[2].strip()
-        section = row[3].strip()
+    # 🔹 Existing Class-Section folders and their student folders
+    # Duplicate names resolve to one folder, for creating and indexing alike
+    classes = list_child_folders(service, [output_root_id])
+    class_ids = class_folder_ids(classes)
+    classes = [f for f in classes if class_ids[f["name"]] == f["id"]]
 
-        if not (srno and name and class_ and section):
-            continue
+    students = list_child_folders(service, class_ids.values())
+    existing = {(p, f["name"]) for f in students for p in f.get("parents", [])}
 
-        class_section = f"{class_}-{section}"
-        student_folder = f"{srno}-{clean_name(name)}-{class_}-{section}"
+    # 🔹 Create missing Class-Section folders
+    missing_classes = {
+        class_section: (class_section, output_root_id)
+        for class_section in tree
+        if class_section not in class_ids
+    }
+    new_classes = create_drive_folders_batch(service, missing_classes)
+    for class_section, folder in new_classes.items():
+        class_ids[class_section] = folder["id"]
+    classes.extend(new_classes.values())
+
+    # 🔹 Create missing Student folders inside Class-Section
+    missing_students = {
+        (class_section, student_folder): (student_folder, class_ids[class_section])
+        for class_section, names in tree.items()
+        if class_section in class_ids
+        for student_folder in names
+        if (class_ids[class_section], student_folder) not in existing
+    }
+    new_students = create_drive_folders_batch(service, missing_students)
+    students.extend(new_students.values())
 
-        # 🔹 Create Class-Section folder
-        class_folder_id = get_or_create_drive_folder(
-            service,
-            class_section,
-            output_root_id
-        )
+    print(
+        f"📁 Output folders: {len(new_classes)} class folder(s) and "
+        f"{len(new_students)} student folder(s) created, "
+        f"{len(missing_classes) + len(missing_students) - len(new_classes) - len(new_students)} failed"
+    )
 
-        # 🔹 Create Student folder inside Class-Section
-        get_or_create_drive_folder(
-            service,
-            student_folder,
-            class_folder_id
-        )
+    if update_folder_index:
+        index = StudentFolderIndex(root_id=output_root_id)
+        index.set_tree(classes, students, synced_at)
+        index.save()
@@ -15,50 +15,60 @@ Move credentials to env vars / secrets manager before real deployment
 import os
 import io
 import re
-from googleapiclient.discovery import build
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import httplib2
+import google.auth.exceptions
 from googleapiclient.http import MediaIoBaseDownload
-from google.oauth2 import service_account
 from googleapiclient.errors import HttpError
 
+from . import metrics
+from .clients import (
+    SCOPES,
+    get_credentials,
+    get_drive,
+    get_sheets,
+    get_authorized_session,
+)
 from .config import (
-    GOOGLE_SERVICE_ACCOUNT_INFO,
-    GOOGLE_CREDENTIALS_JSON_FILE,
+    DOWNLOAD_MAX_MEMORY_MB,
+    WALK_WORKERS,
+    WALK_PARENTS_PER_QUERY,
 )
 
 
 # ------------------------------------------------------
-# GOOGLE API SCOPES
-# ------------------------------------------------------
-
-SCOPES = [
-    "https://www.googleapis.com/auth/drive",
-    "https://www.googleapis.com/auth/spreadsheets"
-]
-
-# ------------------------------------------------------
-# AUTHENTICATION
+# AUTHENTICATION (clients come from the shared registry)
 # ------------------------------------------------------
 
 def build_creds():
     """
-    Build Google credentials from service account JSON
-    stored in config.py
+    Google credentials from the service account JSON in config.py,
+    shared by the whole process.
     """
-    creds = service_account.Credentials.from_service_account_info(
-        GOOGLE_SERVICE_ACCOUNT_INFO,
-        scopes=SCOPES
-    )
-    return creds
+    return get_credentials()
 
 
 def get_drive_service():
-    """Return authenticated Google Drive service"""
-    return build("drive", "v3", credentials=build_creds())
+    """Return authenticated Google Drive service (owned by the calling thread)"""
+    return get_drive()
 
 
 def get_sheets_service():
-    """Return authenticated Google Sheets service"""
-    return build("sheets", "v4", credentials=build_creds())
+    """Return authenticated Google Sheets service (owned by the calling thread)"""
+    return get_sheets()
+
+
+def get_thread_drive_service():
+    """Return a Drive service owned by the calling thread"""
+    return get_drive()
+
+
+# Per-thread scratch state (download buffers)
+_thread_local = threading.local()
 
 
 # ------------------------------------------------------
@@ -125,6 +135,14 @@ def parse_drive_folder_link(link):
 
 
 
+def escape_query_value(value):
+    """
+    Escape a string for use inside '...' in a Drive `q` query
+    (names with apostrophes otherwise break the query).
+    """
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+
 # ------------------------------------------------------
 # DRIVE DOWNLOAD UTILITIES
 # ------------------------------------------------------
@@ -145,6 +163,105 @@ def download_file_from_drive(service, file_id, dest_path):
     return dest_path
 
 
+# ------------------------------------------------------
+# IN-MEMORY DOWNLOADS (no temp file round-trip)
+# ------------------------------------------------------
+
+class DownloadBuffer:
+    """
+    Reusable write target for downloads.
+
+    Bytes stay in memory up to max_memory_bytes; a larger file
+    spills to an anonymous temp file so one oversized upload
+    cannot blow up memory. Call reset() before reusing it.
+    """
+
+    def __init__(self, max_memory_bytes=DOWNLOAD_MAX_MEMORY_MB * 1024 * 1024):
+        self.max_memory_bytes = max_memory_bytes
+        self.size = 0
+        self._mem = io.BytesIO()
+        self._disk = None
+
+    @property
+    def spilled(self):
+        return self._disk is not None
+
+    def reset(self):
+        self._mem.seek(0)
+        self._mem.truncate()
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+        self.size = 0
+
+    def write(self, data):
+        if self._disk is None and self.size + len(data) > self.max_memory_bytes:
+            self._disk = tempfile.TemporaryFile(prefix="mp_dl_")
+            self._disk.write(self._mem.getbuffer())
+            self._mem.seek(0)
+            self._mem.truncate()
+
+        (self._disk or self._mem).write(data)
+        self.size += len(data)
+        return len(data)
+
+    def fileobj(self):
+        """Readable file object rewound to the start (for upload_fileobj)"""
+        fh = self._disk or self._mem
+        fh.seek(0)
+        return fh
+
+    def getvalue(self):
+        """Whole content as bytes"""
+        if self._disk is not None:
+            self._disk.seek(0)
+            return self._disk.read()
+        return self._mem.getvalue()
+
+
+def get_thread_download_buffer():
+    """Return a DownloadBuffer owned by the calling thread"""
+    buffer = getattr(_thread_local, "download_buffer", None)
+    if buffer is None:
+        buffer = DownloadBuffer()
+        _thread_local.download_buffer = buffer
+    return buffer
+
+
+def download_file_to_buffer(service, file_id, buffer=None, retries=5, base_delay=1.0):
+    """
+    Stream a Drive file into a DownloadBuffer and return it.
+    A passed-in buffer is reset and reused.
+
+    Rate limits, server errors and dropped connections restart the
+    download with jittered exponential backoff (as execute_with_backoff);
+    the last error is raised once retries run out.
+    """
+    if buffer is None:
+        buffer = DownloadBuffer()
+
+    for attempt in range(retries + 1):
+        buffer.reset()
+        request = service.files().get_media(fileId=file_id)
+        downloader = MediaIoBaseDownload(buffer, request)
+
+        try:
+            # MediaIoBaseDownload bypasses execute(), so time it here
+            with metrics.track_call("drive", "files.get_media") as sizes:
+                done = False
+                while not done:
+                    _, done = downloader.next_chunk()
+                sizes["bytes_in"] = buffer.size
+            return buffer
+        except HttpError as e:
+            if attempt == retries or not is_retryable_http_error(e):
+                raise
+        except TRANSPORT_ERRORS:
+            if attempt == retries:
+                raise
+        time.sleep(base_delay * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
 def list_files_in_folder(service, folder_id):
     """
     List all files in a Drive folder (non-recursive).
@@ -174,17 +291,20 @@ def list_files_in_folder(service, folder_id):
 
 def download_folder_recursive(service, folder_id, processed_ids=None):
     """
-    Recursively download a Drive folder into a TEMP directory.
+    Recursively download a Drive folder into a TEMP directory,
+    mirroring its sub-folder layout.
     """
-    import tempfile
-
     local_dest = tempfile.mkdtemp(prefix="mp_drive_")
+    local_dirs = {folder_id: local_dest}
     downloaded = []
 
+    items = walk_drive_folders(
+        [folder_id],
+        extra_fields=("modifiedTime",),
+        include_folders=True
+    )
 
-    items = list_files_in_folder(service, folder_id)
-
-    for item in items:
+    for _, item in items:
         file_id = item["id"]
         name = item["name"]
         mime = item["mimeType"]
@@ -192,39 +312,123 @@ def download_folder_recursive(service, folder_id, processed_ids=None):
         if processed_ids and file_id in processed_ids:
             continue
 
-        if mime == "application/vnd.google-apps.folder":
-            subfolder = os.path.join(local_dest, name)
-            downloaded.extend(
-                download_folder_recursive(
-                    service,
-                    file_id,
-                    subfolder,
-                    processed_ids
-                )
-            )
-        else:
-            local_path = os.path.join(local_dest, name)
-            base, ext = os.path.splitext(local_path)
-            i = 1
-            while os.path.exists(local_path):
-                local_path = f"{base}_{i}{ext}"
-                i += 1
-
-            try:
-                download_file_from_drive(service, file_id, local_path)
-                downloaded.append({
-                    "id": file_id,
-                    "name": name,
-                    "local_path": local_path,
-                    "mimeType": mime,
-                    "modifiedTime": item.get("modifiedTime")
-                })
-            except HttpError as e:
-                print("❌ Failed to download:", name, e)
+        parent_dir = next(
+            (local_dirs[p] for p in item.get("parents", []) if p in local_dirs),
+            local_dest
+        )
+
+        if mime == FOLDER_MIME:
+            local_dirs[file_id] = os.path.join(parent_dir, name)
+            os.makedirs(local_dirs[file_id], exist_ok=True)
+            continue
+
+        local_path = os.path.join(parent_dir, name)
+        base, ext = os.path.splitext(local_path)
+        i = 1
+        while os.path.exists(local_path):
+            local_path = f"{base}_{i}{ext}"
+            i += 1
+
+        try:
+            download_file_from_drive(service, file_id, local_path)
+            downloaded.append({
+                "id": file_id,
+                "name": name,
+                "local_path": local_path,
+                "mimeType": mime,
+                "modifiedTime": item.get("modifiedTime")
+            })
+        except HttpError as e:
+            print("❌ Failed to download:", name, e)
 
     return downloaded
 
 
+# ------------------------------------------------------
+# RETRIES & BATCH REQUESTS
+# ------------------------------------------------------
+
+DRIVE_BATCH_LIMIT = 100          # Drive rejects batches above 100 calls
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+# Connection-level failures (reset, timeout, TLS, token refresh), as
+# raised by httplib2 / google-auth / requests; worth another attempt
+TRANSPORT_ERRORS = (OSError, httplib2.HttpLib2Error, google.auth.exceptions.TransportError)
+
+
+def is_retryable_http_error(error):
+    """Rate limits and server-side errors are worth retrying."""
+    status = error.resp.status
+    if status in RETRYABLE_STATUS:
+        return True
+    if status == 403:
+        content = error.content.decode("utf-8", "ignore") if error.content else ""
+        return any(reason in content for reason in RATE_LIMIT_REASONS)
+    return False
+
+
+def execute_with_backoff(request_factory, retries=5, base_delay=1.0):
+    """
+    Execute request_factory() with jittered exponential backoff on
+    retryable HttpErrors. A fresh request is built for every attempt.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return request_factory().execute()
+        except HttpError as e:
+            if attempt == retries or not is_retryable_http_error(e):
+                raise
+            time.sleep(base_delay * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def execute_drive_batch(service, request_factories, retries=5):
+    """
+    Run many Drive calls as HTTP batch requests (DRIVE_BATCH_LIMIT
+    calls per round-trip).
+
+    request_factories: {key: callable returning an HttpRequest}
+    Returns {key: (response, error)} with exactly one of the two set.
+    Sub-requests that fail with a retryable error are retried one by
+    one with backoff.
+    """
+    results = {}
+    retry_keys = []
+    items = list(request_factories.items())
+
+    for start in range(0, len(items), DRIVE_BATCH_LIMIT):
+        chunk = items[start:start + DRIVE_BATCH_LIMIT]
+
+        def callback(request_id, response, exception, chunk=chunk):
+            key = chunk[int(request_id)][0]
+            if exception is None:
+                results[key] = (response, None)
+            elif isinstance(exception, HttpError) and is_retryable_http_error(exception):
+                retry_keys.append(key)
+            else:
+                results[key] = (None, exception)
+
+        batch = service.new_batch_http_request(callback=callback)
+        for n, (_, factory) in enumerate(chunk):
+            batch.add(factory(), request_id=str(n))
+
+        try:
+            with metrics.track_call("drive", "batch"):
+                batch.execute()
+        except HttpError as e:
+            # Whole batch rejected: fall back to one call per item
+            print("⚠️ Drive batch failed, retrying calls one by one:", e)
+            retry_keys.extend(key for key, _ in chunk if key not in results)
+
+    for key in retry_keys:
+        try:
+            results[key] = (execute_with_backoff(request_factories[key], retries), None)
+        except HttpError as e:
+            results[key] = (None, e)
+
+    return results
+
+
 # ------------------------------------------------------
 # VALIDATION SHEET HELPERS
 # ------------------------------------------------------
@@ -255,13 +459,34 @@ def get_upload_folder_ids_from_validation_sheet(
 
     return folder_ids
 import requests
+from requests.adapters import HTTPAdapter
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session(pool_size=32):
+    """
+    Shared requests.Session for public URLs: keep-alive connections are
+    pooled across threads instead of a new TCP/TLS handshake per file.
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _http_session = metrics.instrument_requests_session(session, "http")
+        return _http_session
+
 
 def download_from_public_url(url, dest_path):
     """
     Downloads a file from a public HTTP/HTTPS URL.
     Used when Drive file ID is not available.
     """
-    response = requests.get(url, stream=True, timeout=30)
+    response = get_http_session().get(url, stream=True, timeout=30)
     response.raise_for_status()
 
     with open(dest_path, "wb") as f:
@@ -271,31 +496,164 @@ def download_from_public_url(url, dest_path):
 
     return dest_path
 
-def walk_drive_folder_recursive(service, folder_id):
+def get_thread_authorized_session():
+    """Return a requests session with Google auth, owned by the calling thread"""
+    return get_authorized_session()
+
+
+def download_drive_thumbnail(thumbnail_link, size_px, buffer=None):
     """
-    Recursively yield all files inside a Drive folder
-    (including nested subfolders).
+    Download Drive's pre-rendered thumbnail of a file, sized so its
+    long edge is size_px. Much cheaper than the original for photos.
     """
-    query = f"'{folder_id}' in parents and trashed=false"
+    if buffer is None:
+        buffer = DownloadBuffer()
+    else:
+        buffer.reset()
 
-    page_token = None
-    while True:
-        resp = service.files().list(
-            q=query,
-            fields="nextPageToken, files(id, name, mimeType)",
-            pageToken=page_token,
-            supportsAllDrives=True,
-            includeItemsFromAllDrives=True
-        ).execute()
+    # thumbnailLink ends in "=s220"; ask for the size we need instead
+    link = re.sub(r"=s\d+$", "", thumbnail_link) + f"=s{size_px}"
 
-        for item in resp.get("files", []):
-            if item["mimeType"] == "application/vnd.google-apps.folder":
-                # recurse into subfolder
-                yield from walk_drive_folder_recursive(service, item["id"])
-            else:
-                yield item
+    response = get_thread_authorized_session().get(link, stream=True, timeout=30)
+    response.raise_for_status()
 
-        page_token = resp.get("nextPageToken")
-        if not page_token:
-            break
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        if chunk:
+            buffer.write(chunk)
+
+    return buffer
+
+# ------------------------------------------------------
+# STREAMING (straight into another upload, no buffer)
+# ------------------------------------------------------
+
+DRIVE_MEDIA_URL = "https://www.googleapis.com/drive/v3/files/{file_id}?alt=media&supportsAllDrives=true"
+
+
+def _raw_stream(response):
+    try:
+        response.raise_for_status()
+    except requests.HTTPError:
+        response.close()
+        raise
+    response.raw.decode_content = True
+    return response.raw
+
+
+def open_drive_file_stream(file_id):
+    """
+    Readable file-like object over a Drive file's content (alt=media),
+    for handing straight to e.g. s3.upload_fileobj. Close it when done.
+    """
+    response = get_thread_authorized_session().get(
+        DRIVE_MEDIA_URL.format(file_id=file_id),
+        stream=True,
+        timeout=30
+    )
+    return _raw_stream(response)
+
+
+def open_public_url_stream(url):
+    """Same as open_drive_file_stream, for a public HTTP/HTTPS URL."""
+    return _raw_stream(get_http_session().get(url, stream=True, timeout=30))
 
+# ------------------------------------------------------
+# FOLDER WALKER (breadth-first, parallel, multi-parent)
+# ------------------------------------------------------
+
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+
+def _list_children_page(parent_ids, page_token, file_fields):
+    query = " or ".join(f"'{pid}' in parents" for pid in parent_ids)
+    return execute_with_backoff(lambda: get_thread_drive_service().files().list(
+        q=f"({query}) and trashed=false",
+        fields=f"nextPageToken, files({file_fields})",
+        pageToken=page_token,
+        pageSize=1000,
+        supportsAllDrives=True,
+        includeItemsFromAllDrives=True
+    ))
+
+
+def walk_drive_folders(
+    root_ids,
+    extra_fields=(),
+    include_folders=False,
+    workers=WALK_WORKERS,
+    parents_per_query=WALK_PARENTS_PER_QUERY
+):
+    """
+    Yield (root_id, item) for every file below the given folders.
+
+    Breadth-first: each level's folders are packed `parents_per_query`
+    at a time into one "'a' in parents or 'b' in parents ..." query, and
+    up to `workers` pages are fetched concurrently (thread-local Drive
+    services). Items stream out page by page, so callers can start
+    working before the walk is finished.
+
+    include_folders: also yield sub-folders (always before their contents).
+    """
+    file_fields = ", ".join(("id", "name", "mimeType", "parents") + tuple(extra_fields))
+
+    folder_root = {rid: rid for rid in root_ids}
+    frontier = list(folder_root)
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="drive-walk")
+    in_flight = {}
+
+    def submit(parent_ids, page_token=None):
+        future = pool.submit(_list_children_page, parent_ids, page_token, file_fields)
+        in_flight[future] = parent_ids
+
+    def submit_frontier():
+        # Full batches right away; a partial one only while workers idle
+        while len(frontier) >= parents_per_query or (frontier and len(in_flight) < workers):
+            batch = frontier[:parents_per_query]
+            del frontier[:parents_per_query]
+            submit(batch)
+
+    try:
+        submit_frontier()
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                parent_ids = in_flight.pop(future)
+                resp = future.result()
+
+                if resp.get("nextPageToken"):
+                    submit(parent_ids, resp["nextPageToken"])
+
+                for item in resp.get("files", []):
+                    parent = next(
+                        (p for p in item.get("parents", []) if p in parent_ids),
+                        parent_ids[0]
+                    )
+                    root_id = folder_root[parent]
+
+                    if item["mimeType"] == FOLDER_MIME:
+                        # Multi-parent folders are only walked once
+                        if item["id"] in folder_root:
+                            continue
+                        folder_root[item["id"]] = root_id
+                        frontier.append(item["id"])
+                        if not include_folders:
+                            continue
+
+                    yield root_id, item
+
+            submit_frontier()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def walk_drive_folder_recursive(service, folder_id, extra_fields=(), include_folders=False):
+    """
+    Yield all files inside a Drive folder (including nested subfolders).
+
+    Kept for existing callers: listing goes through walk_drive_folders,
+    which uses thread-local Drive services, so `service` is unused.
+    """
+    for _, item in walk_drive_folders([folder_id], extra_fields, include_folders):
+        yield item
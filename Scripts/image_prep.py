@@ -0,0 +1,80 @@
+# image_prep.py
+# Pillow helpers for the sorter: downscaling before Rekognition and
+# face crops for multi-face matching.
+#
+# Only Pillow is imported here so process-pool workers stay cheap to spawn.
+
+import io
+
+from PIL import Image, ImageOps
+
+# Rekognition rejects inline Image.Bytes above 5 MB
+REKOG_MAX_IMAGE_BYTES = 5 * 1024 * 1024
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def prepare_for_rekognition(image_bytes, max_edge_px=1920, quality=85):
+    """
+    Apply EXIF orientation, downscale so the long edge is at most
+    max_edge_px and re-encode as JPEG. Small, upright JPEGs are
+    returned untouched. Quality is lowered step by step if the result
+    would still exceed Rekognition's inline limit.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+        if (
+            img.format == "JPEG"
+            and orientation == 1
+            and max(img.size) <= max_edge_px
+            and len(image_bytes) <= REKOG_MAX_IMAGE_BYTES
+        ):
+            return image_bytes
+
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_edge_px, max_edge_px), Image.LANCZOS)
+        img = img.convert("RGB")
+
+        while True:
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=quality, optimize=True)
+            if out.tell() <= REKOG_MAX_IMAGE_BYTES or quality <= 40:
+                return out.getvalue()
+            quality -= 10
+
+
+def crop_faces(image_bytes, boxes, min_size_px=0, padding=0.25, quality=90):
+    """
+    Cut Rekognition BoundingBoxes (ratios of width/height) out of an
+    image and return one JPEG per box as (index, bytes).
+
+    Boxes smaller than min_size_px on either side are skipped. Each crop
+    is padded so Rekognition still sees a whole face in it.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        # Rekognition reports boxes for the EXIF-corrected image
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        width, height = img.size
+        crops = []
+
+        for idx, box in enumerate(boxes):
+            box_w = box["Width"] * width
+            box_h = box["Height"] * height
+            if box_w < min_size_px or box_h < min_size_px:
+                continue
+
+            pad_w = box_w * padding
+            pad_h = box_h * padding
+            left = max(0, int(box["Left"] * width - pad_w))
+            top = max(0, int(box["Top"] * height - pad_h))
+            right = min(width, int(box["Left"] * width + box_w + pad_w))
+            bottom = min(height, int(box["Top"] * height + box_h + pad_h))
+
+            if right <= left or bottom <= top:
+                continue
+
+            out = io.BytesIO()
+            img.crop((left, top, right, bottom)).save(out, format="JPEG", quality=quality)
+            crops.append((idx, out.getvalue()))
+
+        return crops
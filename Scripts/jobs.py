@@ -0,0 +1,170 @@
+# jobs.py
+# In-process job manager for the web app.
+#
+# Each trigger becomes a Job with an ID. Jobs run one at a time on a
+# single worker thread from a bounded queue, and a pipeline type
+# ("sort", "index") is single-flight: triggering it while a job of
+# that type is queued or running returns the existing job instead of
+# starting a second run over the same folders.
+
+import queue
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+
+from .config import JOB_QUEUE_SIZE, JOB_HISTORY
+from .pipeline import Progress
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    """
+    One pipeline run. runner(stop_event, progress) does the work;
+    cancel() sets stop_event, which the runner checks cooperatively.
+    """
+
+    def __init__(self, kind, runner):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.runner = runner
+        self.status = "queued"          # queued → running → succeeded / failed / cancelled
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.progress = Progress()
+        self.stop_event = threading.Event()
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def to_dict(self):
+        counters = self.progress.snapshot()
+        elapsed = 0.0
+        if self.started_at:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": round(elapsed, 1),
+            "cancel_requested": self.stop_event.is_set(),
+            "progress": counters,
+            "files_per_sec": round(counters.get("done", 0) / elapsed, 2) if elapsed else 0.0,
+        }
+
+
+class JobManager:
+    """
+    runners: {kind: callable(stop_event, progress)}
+    """
+
+    def __init__(self, runners, max_queued=JOB_QUEUE_SIZE, history=JOB_HISTORY):
+        self.runners = runners
+        self.history = history
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = OrderedDict()      # job ID → Job, oldest first
+        self._active = {}               # kind → queued / running Job
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def submit(self, kind):
+        """
+        Queue a run of `kind`. Returns (job, created); created is False
+        when a job of that kind was already queued or running.
+        Raises KeyError for an unknown kind, JobQueueFull when full.
+        """
+        runner = self.runners[kind]
+
+        with self._lock:
+            job = self._active.get(kind)
+            if job is not None and job.active:
+                return job, False
+
+            job = Job(kind, runner)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise JobQueueFull(f"{self._queue.maxsize} jobs already queued")
+
+            self._active[kind] = job
+            self._jobs[job.id] = job
+            self._trim_history()
+            print(f"📥 Job {job.id} ({kind}) queued")
+            self._ensure_worker()
+
+        return job, True
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Returns the job, or None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+
+            job.stop_event.set()
+            if job.status == "queued":
+                # The worker skips it when it comes up
+                job.status = "cancelled"
+                job.finished_at = time.time()
+
+        print(f"🛑 Job {job.id} ({job.kind}) cancel requested")
+        return job
+
+    # ---------- worker ----------
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._work, name="job-worker", daemon=True)
+            self._worker.start()
+
+    def _trim_history(self):
+        finished = [j for j in self._jobs.values() if not j.active]
+        for job in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job.id]
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+
+            with self._lock:
+                if job.status == "cancelled":
+                    continue
+                job.status = "running"
+                job.started_at = time.time()
+
+            print(f"🚀 Job {job.id} ({job.kind}) started")
+            try:
+                job.runner(job.stop_event, job.progress)
+                status = "cancelled" if job.stop_event.is_set() else "succeeded"
+                error = None
+            except Exception as e:
+                traceback.print_exc()
+                status, error = "failed", f"{type(e).__name__}: {e}"
+
+            with self._lock:
+                job.status = status
+                job.error = error
+                job.finished_at = time.time()
+
+            icon = {"succeeded": "✅", "cancelled": "🛑", "failed": "❌"}[status]
+            print(f"{icon} Job {job.id} ({job.kind}) {status}")
@@ -0,0 +1,146 @@
+# leases.py
+# Exclusive, expiring leases kept as small S3 objects.
+#
+# A lease object holds {"owner", "expires_at"}. It is taken with a
+# conditional write (If-None-Match: *), renewed and taken over with
+# If-Match on the ETag we last saw, so two workers can never both
+# believe they hold it. An expired lease (its owner died or stalled)
+# may be taken over by anyone. Expiry uses the workers' wall clocks:
+# keep SORT_LEASE_SECONDS well above any clock skew between nodes.
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+from .config import S3_BUCKET, SORT_LEASE_SECONDS, SORT_HEARTBEAT_SECONDS
+from .clients import get_s3
+
+
+# What S3 answers when a conditional write loses
+CONFLICT_CODES = ("PreconditionFailed", "ConditionalRequestConflict", "412", "409")
+
+
+def is_conflict(e):
+    """The ClientError of a conditional write that lost."""
+    return e.response["Error"]["Code"] in CONFLICT_CODES
+
+
+def _missing(e):
+    return e.response["Error"]["Code"] in ("NoSuchKey", "404", "NotFound")
+
+
+def worker_name():
+    """Unique per process: host, PID and a random suffix."""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class Lease:
+    """
+    A held lease. Use Lease.acquire(); renew() before expires_at
+    (Heartbeat does that), release() when done.
+    """
+
+    def __init__(self, key, owner, ttl, etag, expires_at):
+        self.key = key
+        self.owner = owner
+        self.ttl = ttl
+        self.etag = etag
+        self.expires_at = expires_at
+
+    @classmethod
+    def acquire(cls, key, owner, ttl=SORT_LEASE_SECONDS):
+        """The lease if we got it, None while someone else holds it."""
+        try:
+            return cls._write(key, owner, ttl, IfNoneMatch="*")
+        except ClientError as e:
+            if not is_conflict(e):
+                raise
+
+        # Taken: take it over only if its holder let it expire
+        try:
+            resp = get_s3().get_object(Bucket=S3_BUCKET, Key=key)
+        except ClientError as e:
+            if _missing(e):
+                return None     # released meanwhile; next round gets it
+            raise
+        current = json.loads(resp["Body"].read().decode("utf-8"))
+        if current.get("expires_at", 0) > time.time():
+            return None
+
+        try:
+            lease = cls._write(key, owner, ttl, IfMatch=resp["ETag"])
+        except ClientError as e:
+            if is_conflict(e) or _missing(e):
+                return None
+            raise
+        print(f"♻️ Lease {key} taken over from {current.get('owner')} (expired)")
+        return lease
+
+    @classmethod
+    def _write(cls, key, owner, ttl, **condition):
+        expires_at = time.time() + ttl
+        body = json.dumps({"owner": owner, "expires_at": expires_at}).encode("utf-8")
+        resp = get_s3().put_object(Bucket=S3_BUCKET, Key=key, Body=body, **condition)
+        return cls(key, owner, ttl, resp["ETag"], expires_at)
+
+    def renew(self):
+        """
+        Push expiry out by ttl. False once the lease is lost (taken over
+        or deleted); transient S3 errors count as lost only after expiry.
+        """
+        try:
+            renewed = self._write(self.key, self.owner, self.ttl, IfMatch=self.etag)
+        except ClientError as e:
+            if is_conflict(e) or _missing(e):
+                return False
+            print(f"⚠️ Lease {self.key} renewal failed, retrying:", e)
+            return time.time() < self.expires_at
+        self.etag = renewed.etag
+        self.expires_at = renewed.expires_at
+        return True
+
+    def release(self):
+        """Delete the lease if it is still ours."""
+        try:
+            get_s3().delete_object(Bucket=S3_BUCKET, Key=self.key, IfMatch=self.etag)
+        except ClientError as e:
+            if not (is_conflict(e) or _missing(e)):
+                raise
+
+
+class Heartbeat:
+    """
+    Renews a lease every `interval` seconds on a background thread.
+    on_lost() is called (once) if the lease is lost.
+    Use as a context manager around the leased work.
+    """
+
+    def __init__(self, lease, on_lost, interval=SORT_HEARTBEAT_SECONDS):
+        self.lease = lease
+        self.on_lost = on_lost
+        self.interval = interval
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease-heartbeat", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self.lease.renew():
+                print(f"⚠️ Lease {self.lease.key} lost")
+                self.lost = True
+                self.on_lost()
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
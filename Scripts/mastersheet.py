@@ -0,0 +1,208 @@
+# mastersheet.py
+# One cached read of the Mastersheet spreadsheet for every phase.
+#
+# All ranges the pipeline needs (Mastersheet A:G, Validation A:A) are
+# fetched with a single values.batchGet. The result is cached in memory
+# and in S3, keyed by the Drive file's version: while the spreadsheet
+# is unchanged, later phases and later runs only pay for one cheap
+# files.get instead of a Sheets read.
+
+import json
+import threading
+from dataclasses import dataclass
+
+from botocore.exceptions import ClientError
+
+from .config import (
+    S3_BUCKET,
+    MASTERSHEET_ID,
+    MASTERSHEET_NAME,
+    VALIDATION_SHEET_NAME,
+    EXTERNAL_ID_FORMAT,
+    MP_MASTERSHEET_CACHE_KEY,
+)
+from .clients import get_s3
+from .gdrive_helpers import get_drive_service, get_sheets_service
+
+
+MASTERSHEET_RANGE = f"{MASTERSHEET_NAME}!A:G"
+VALIDATION_RANGE = f"{VALIDATION_SHEET_NAME}!A:A"
+
+
+def clean_name(name):
+    """'Aaradhya Choudhary' → 'Aaradhya_Choudhary' (refs / folder naming)"""
+    return "_".join(name.strip().split())
+
+
+def _cell(row, idx):
+    return row[idx].strip() if len(row) > idx else ""
+
+
+@dataclass(frozen=True)
+class StudentRecord:
+    """One Mastersheet row (columns A–G)."""
+    row_number: int         # 1-based sheet row
+    srno: str
+    name: str
+    class_name: str
+    section: str
+    photo_link: str
+    face_id: str
+    external_id: str
+
+    @classmethod
+    def from_row(cls, row_number, row):
+        return cls(
+            row_number=row_number,
+            srno=_cell(row, 0),
+            name=_cell(row, 1),
+            class_name=_cell(row, 2),
+            section=_cell(row, 3),
+            photo_link=_cell(row, 4),
+            face_id=_cell(row, 5),
+            external_id=_cell(row, 6),
+        )
+
+    @property
+    def class_section(self):
+        return f"{self.class_name}-{self.section}"
+
+    @property
+    def folder_name(self):
+        """SrNo-Name-Class-Section (refs file stem and student folder name)"""
+        return f"{self.srno}-{clean_name(self.name)}-{self.class_name}-{self.section}"
+
+    @property
+    def expected_external_id(self):
+        return EXTERNAL_ID_FORMAT.format(
+            srno=self.srno,
+            name=clean_name(self.name),
+            class_name=self.class_name,
+            section=self.section
+        )
+
+
+class MastersheetSnapshot:
+    """
+    Parsed Mastersheet at one Drive file version.
+
+    rows              raw Mastersheet rows, header skipped
+    students          StudentRecord per row
+    validation_links  Validation column A, header skipped
+    """
+
+    def __init__(self, version, modified_time, mastersheet_values, validation_values):
+        self.version = version
+        self.modified_time = modified_time
+        self.mastersheet_values = mastersheet_values
+        self.validation_values = validation_values
+
+        self.rows = mastersheet_values[1:]
+        self.students = [
+            StudentRecord.from_row(idx + 2, row)
+            for idx, row in enumerate(self.rows)
+            if row
+        ]
+        self.validation_links = [
+            r[0].strip() for r in validation_values[1:] if r and r[0].strip()
+        ]
+
+    def by_srno(self):
+        """SrNo → StudentRecord (first row wins)"""
+        records = {}
+        for rec in self.students:
+            if rec.srno:
+                records.setdefault(rec.srno, rec)
+        return records
+
+    def to_json(self):
+        return json.dumps({
+            "version": self.version,
+            "modified_time": self.modified_time,
+            "mastersheet": self.mastersheet_values,
+            "validation": self.validation_values,
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, payload):
+        data = json.loads(payload)
+        return cls(
+            data["version"],
+            data.get("modified_time"),
+            data.get("mastersheet", []),
+            data.get("validation", []),
+        )
+
+
+# ------------------------------------------------------
+# CACHE
+# ------------------------------------------------------
+
+_cached = None
+_cache_lock = threading.Lock()
+
+
+def get_sheet_version():
+    """(version, modifiedTime) of the spreadsheet file in Drive."""
+    meta = get_drive_service().files().get(
+        fileId=MASTERSHEET_ID,
+        fields="version, modifiedTime",
+        supportsAllDrives=True
+    ).execute()
+    return str(meta["version"]), meta.get("modifiedTime")
+
+
+def _read_s3_snapshot():
+    try:
+        resp = get_s3().get_object(Bucket=S3_BUCKET, Key=MP_MASTERSHEET_CACHE_KEY)
+        return MastersheetSnapshot.from_json(resp["Body"].read().decode("utf-8"))
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        return None
+
+
+def _fetch_snapshot(version, modified_time):
+    resp = get_sheets_service().spreadsheets().values().batchGet(
+        spreadsheetId=MASTERSHEET_ID,
+        ranges=[MASTERSHEET_RANGE, VALIDATION_RANGE]
+    ).execute()
+
+    value_ranges = resp.get("valueRanges", [])
+    mastersheet = value_ranges[0].get("values", []) if len(value_ranges) > 0 else []
+    validation = value_ranges[1].get("values", []) if len(value_ranges) > 1 else []
+    return MastersheetSnapshot(version, modified_time, mastersheet, validation)
+
+
+def get_mastersheet_snapshot(force=False):
+    """
+    Current MastersheetSnapshot. Served from memory or S3 while the
+    spreadsheet's Drive version is unchanged, otherwise re-read with
+    one batchGet and cached again.
+    """
+    global _cached
+
+    with _cache_lock:
+        version, modified_time = get_sheet_version()
+
+        if not force and _cached is not None and _cached.version == version:
+            return _cached
+
+        snapshot = None if force else _read_s3_snapshot()
+        if snapshot is None or snapshot.version != version:
+            snapshot = _fetch_snapshot(version, modified_time)
+            get_s3().put_object(
+                Bucket=S3_BUCKET,
+                Key=MP_MASTERSHEET_CACHE_KEY,
+                Body=snapshot.to_json().encode("utf-8")
+            )
+
+        _cached = snapshot
+        return snapshot
+
+
+def invalidate_mastersheet_snapshot():
+    """Drop the in-memory copy (e.g. after writing to the sheet)."""
+    global _cached
+    with _cache_lock:
+        _cached = None
@@ -0,0 +1,310 @@
+# metrics.py
+# In-process metrics: API call counts, errors, bytes and latency
+# histograms per (service, operation), plus wall time per phase.
+#
+# boto3 clients are instrumented through botocore event hooks,
+# googleapiclient services through a request builder, and plain
+# requests sessions through a response hook (see clients.py).
+# render_prometheus() serves /metrics, summary() ends a CLI run.
+
+import threading
+import time
+from contextlib import contextmanager
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_calls = {}         # (service, operation) → count
+_errors = {}        # (service, operation, code) → count
+_bytes = {}         # (service, operation, direction) → bytes
+_latency = {}       # (service, operation) → [bucket counts..., +Inf count, sum]
+_phases = {}        # phase → {"runs", "seconds_total", "last_seconds"}
+
+
+# ------------------------------------------------------
+# RECORDING
+# ------------------------------------------------------
+
+def record_call(service, operation, seconds, error_code=None, bytes_out=0, bytes_in=0):
+    key = (service, operation)
+    with _lock:
+        _calls[key] = _calls.get(key, 0) + 1
+        if error_code is not None:
+            err_key = (service, operation, str(error_code))
+            _errors[err_key] = _errors.get(err_key, 0) + 1
+        if bytes_out:
+            out_key = (service, operation, "out")
+            _bytes[out_key] = _bytes.get(out_key, 0) + bytes_out
+        if bytes_in:
+            in_key = (service, operation, "in")
+            _bytes[in_key] = _bytes.get(in_key, 0) + bytes_in
+
+        hist = _latency.get(key)
+        if hist is None:
+            hist = _latency[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                hist[i] += 1
+        hist[-2] += 1
+        hist[-1] += seconds
+
+
+@contextmanager
+def track_call(service, operation):
+    """
+    Time a call that no hook sees (batches, media downloads). The
+    yielded dict may receive "bytes_in" / "bytes_out".
+    """
+    sizes = {}
+    start = time.perf_counter()
+    try:
+        yield sizes
+    except HttpError as e:
+        record_call(service, operation, time.perf_counter() - start, e.resp.status, **sizes)
+        raise
+    except Exception as e:
+        record_call(service, operation, time.perf_counter() - start, type(e).__name__, **sizes)
+        raise
+    record_call(service, operation, time.perf_counter() - start, **sizes)
+
+
+@contextmanager
+def phase_timer(phase):
+    """Wall time of one pipeline phase."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - start)
+
+
+def record_phase(phase, seconds):
+    """
+    One run of `phase` that took `seconds`, for phases that are not a
+    single block (phase 5 reporting is spread over the sort).
+    """
+    with _lock:
+        stats = _phases.setdefault(phase, {"runs": 0, "seconds_total": 0.0, "last_seconds": 0.0})
+        stats["runs"] += 1
+        stats["seconds_total"] += seconds
+        stats["last_seconds"] = seconds
+
+
+def reset():
+    with _lock:
+        for store in (_calls, _errors, _bytes, _latency, _phases):
+            store.clear()
+
+
+# ------------------------------------------------------
+# INSTRUMENTATION
+# ------------------------------------------------------
+
+def _content_length(headers):
+    try:
+        return int(headers.get("content-length") or headers.get("Content-Length") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _body_size(body):
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    try:
+        pos = body.tell()
+        end = body.seek(0, 2)
+        body.seek(pos)
+        return end - pos
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+def instrument_boto3_client(client):
+    """Record every call of a boto3 client (each retry attempt counts)."""
+    service = client.meta.service_model.service_name
+
+    def before_call(model, params, context, **kwargs):
+        bytes_out = _content_length(params.get("headers", {})) or _body_size(params.get("body"))
+        context["mp_metrics"] = (model.name, time.perf_counter(), bytes_out)
+
+    def after_call(http_response, parsed, model, context, **kwargs):
+        operation, start, bytes_out = context.pop("mp_metrics", (model.name, time.perf_counter(), 0))
+        error_code = None
+        if http_response.status_code >= 300:
+            error_code = parsed.get("Error", {}).get("Code") or http_response.status_code
+        record_call(
+            service, operation, time.perf_counter() - start, error_code,
+            bytes_out=bytes_out, bytes_in=_content_length(http_response.headers)
+        )
+
+    def after_call_error(exception, context, **kwargs):
+        operation, start, bytes_out = context.pop("mp_metrics", ("unknown", time.perf_counter(), 0))
+        record_call(service, operation, time.perf_counter() - start, type(exception).__name__, bytes_out=bytes_out)
+
+    client.meta.events.register("before-call", before_call)
+    client.meta.events.register("after-call", after_call)
+    client.meta.events.register("after-call-error", after_call_error)
+    return client
+
+
+class InstrumentedHttpRequest(HttpRequest):
+    """
+    googleapiclient request builder that records each execute().
+    Operation names come from the discovery methodId (drive.files.list).
+    """
+
+    def __init__(self, http, postproc, uri, *args, **kwargs):
+        def measured_postproc(resp, content):
+            self._response_bytes = len(content or b"")
+            return postproc(resp, content)
+
+        self._response_bytes = 0
+        super().__init__(http, measured_postproc, uri, *args, **kwargs)
+
+    def execute(self, http=None, num_retries=0):
+        service, _, operation = (self.methodId or "google.unknown").partition(".")
+        with track_call(service, operation) as sizes:
+            result = super().execute(http=http, num_retries=num_retries)
+            sizes["bytes_out"] = len(self.body or "")
+            sizes["bytes_in"] = self._response_bytes
+        return result
+
+
+def instrument_requests_session(session, service):
+    """Record every response of a requests session (time to headers)."""
+    def on_response(response, *args, **kwargs):
+        error_code = response.status_code if response.status_code >= 400 else None
+        record_call(
+            service,
+            response.request.method,
+            response.elapsed.total_seconds(),
+            error_code,
+            bytes_in=_content_length(response.headers)
+        )
+
+    session.hooks["response"].append(on_response)
+    return session
+
+
+# ------------------------------------------------------
+# OUTPUT
+# ------------------------------------------------------
+
+def _labels(**labels):
+    inner = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in labels.items()
+    )
+    return "{" + inner + "}"
+
+
+def render_prometheus():
+    """Prometheus text exposition format (version 0.0.4)."""
+    with _lock:
+        calls = dict(_calls)
+        errors = dict(_errors)
+        bytes_ = dict(_bytes)
+        latency = {k: list(v) for k, v in _latency.items()}
+        phases = {k: dict(v) for k, v in _phases.items()}
+
+    lines = [
+        "# HELP mp_api_calls_total API calls made, including retries.",
+        "# TYPE mp_api_calls_total counter",
+    ]
+    for (service, operation), n in sorted(calls.items()):
+        lines.append(f"mp_api_calls_total{_labels(service=service, operation=operation)} {n}")
+
+    lines += [
+        "# HELP mp_api_errors_total API calls that failed, by error code.",
+        "# TYPE mp_api_errors_total counter",
+    ]
+    for (service, operation, code), n in sorted(errors.items()):
+        lines.append(f"mp_api_errors_total{_labels(service=service, operation=operation, code=code)} {n}")
+
+    lines += [
+        "# HELP mp_api_bytes_total Bytes sent (out) and received (in).",
+        "# TYPE mp_api_bytes_total counter",
+    ]
+    for (service, operation, direction), n in sorted(bytes_.items()):
+        lines.append(f"mp_api_bytes_total{_labels(service=service, operation=operation, direction=direction)} {n}")
+
+    lines += [
+        "# HELP mp_api_latency_seconds API call latency.",
+        "# TYPE mp_api_latency_seconds histogram",
+    ]
+    for (service, operation), hist in sorted(latency.items()):
+        for bound, n in zip(LATENCY_BUCKETS, hist):
+            lines.append(f"mp_api_latency_seconds_bucket{_labels(service=service, operation=operation, le=bound)} {n}")
+        lines.append(f"mp_api_latency_seconds_bucket{_labels(service=service, operation=operation, le='+Inf')} {hist[-2]}")
+        lines.append(f"mp_api_latency_seconds_count{_labels(service=service, operation=operation)} {hist[-2]}")
+        lines.append(f"mp_api_latency_seconds_sum{_labels(service=service, operation=operation)} {hist[-1]:.6f}")
+
+    lines += [
+        "# HELP mp_phase_runs_total Pipeline phase runs.",
+        "# TYPE mp_phase_runs_total counter",
+    ]
+    for phase, stats in sorted(phases.items()):
+        lines.append(f"mp_phase_runs_total{_labels(phase=phase)} {stats['runs']}")
+
+    lines += [
+        "# HELP mp_phase_seconds_total Wall time spent in each pipeline phase.",
+        "# TYPE mp_phase_seconds_total counter",
+    ]
+    for phase, stats in sorted(phases.items()):
+        lines.append(f"mp_phase_seconds_total{_labels(phase=phase)} {stats['seconds_total']:.3f}")
+
+    lines += [
+        "# HELP mp_phase_last_seconds Wall time of the latest run of each phase.",
+        "# TYPE mp_phase_last_seconds gauge",
+    ]
+    for phase, stats in sorted(phases.items()):
+        lines.append(f"mp_phase_last_seconds{_labels(phase=phase)} {stats['last_seconds']:.3f}")
+
+    return "\n".join(lines) + "\n"
+
+
+def _quantile(hist, q):
+    total = hist[-2]
+    if not total:
+        return 0.0
+    target = q * total
+    for bound, n in zip(LATENCY_BUCKETS, hist):
+        if n >= target:
+            return bound
+    return float("inf")
+
+
+def summary():
+    """Human-readable table for the end of a CLI run."""
+    with _lock:
+        calls = dict(_calls)
+        errors = dict(_errors)
+        bytes_ = dict(_bytes)
+        latency = {k: list(v) for k, v in _latency.items()}
+        phases = {k: dict(v) for k, v in _phases.items()}
+
+    lines = ["📊 Run metrics"]
+
+    for phase, stats in phases.items():
+        lines.append(f"  ⏱  {phase:<28} {stats['last_seconds']:>9.1f}s")
+
+    if calls:
+        lines.append(f"  {'API call':<34} {'calls':>7} {'errors':>7} {'MB in':>8} {'MB out':>8} {'avg ms':>8} {'p95 ≤ms':>8}")
+
+    for key in sorted(calls):
+        service, operation = key
+        n = calls[key]
+        n_err = sum(c for (s, o, _), c in errors.items() if (s, o) == key)
+        mb_in = bytes_.get((service, operation, "in"), 0) / 1e6
+        mb_out = bytes_.get((service, operation, "out"), 0) / 1e6
+        hist = latency.get(key)
+        avg_ms = hist[-1] / hist[-2] * 1000 if hist and hist[-2] else 0.0
+        p95_ms = _quantile(hist, 0.95) * 1000 if hist else 0.0
+        lines.append(
+            f"  {service + '.' + operation:<34} {n:>7} {n_err:>7} {mb_in:>8.1f} {mb_out:>8.1f} {avg_ms:>8.0f} {p95_ms:>8.0f}"
+        )
+
+    return "\n".join(lines)
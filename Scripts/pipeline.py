@@ -0,0 +1,162 @@
+# pipeline.py
+# Bounded, multi-threaded stage pipeline (used by Phase 4 sorting)
+
+import queue
+import threading
+import time
+
+_DONE = object()
+_POLL_SECONDS = 0.2
+
+
+class Progress:
+    """
+    Thread-safe named counters (files listed, searched, copied, ...)
+    that a running phase updates and a status endpoint can read.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + n
+
+    def set(self, name, value):
+        with self._lock:
+            self._values[name] = value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class Stage:
+    """
+    One step of a pipeline.
+
+    func(item) returns the item for the next stage, or None to drop it.
+    With expand=True, func returns an iterable and every element is
+    passed on (e.g. listing, where one folder yields many files).
+    """
+
+    def __init__(self, name, func, workers=1, expand=False):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.expand = expand
+
+
+def run_pipeline(source, stages, queue_size=32, stop_event=None, halt_event=None):
+    """
+    Push every item of `source` through `stages` and yield the
+    output of the last stage in the calling thread.
+
+    Stages are connected by bounded queues, so a slow stage applies
+    back-pressure instead of buffering the whole run in memory.
+    Setting `stop_event` stops all workers early; an exception raised
+    by a stage stops the pipeline and is re-raised to the caller.
+    `halt_event` is set once the pipeline stops for any reason (before
+    it waits for its workers), for stage code that blocks on something
+    other than the pipeline's queues.
+    """
+    stop = halt_event if halt_event is not None else threading.Event()
+    errors = []
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+
+    def stopped():
+        return stop.is_set() or (stop_event is not None and stop_event.is_set())
+
+    def put(q, item):
+        while not stopped():
+            try:
+                q.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q):
+        while not stopped():
+            try:
+                return q.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def fail(exc):
+        errors.append(exc)
+        stop.set()
+
+    def downstream_workers(idx):
+        # The last queue is read by the caller only
+        return stages[idx + 1].workers if idx + 1 < len(stages) else 1
+
+    def feed():
+        try:
+            for item in source:
+                if not put(queues[0], item):
+                    return
+        except Exception as e:
+            fail(e)
+            return
+        for _ in range(stages[0].workers if stages else 1):
+            put(queues[0], _DONE)
+
+    def work(idx, stage, remaining):
+        q_in, q_out = queues[idx], queues[idx + 1]
+
+        while True:
+            item = get(q_in)
+            if item is _DONE:
+                break
+
+            try:
+                result = stage.func(item)
+                outputs = result if stage.expand else (result,)
+                for out in outputs:
+                    if out is not None and not put(q_out, out):
+                        return
+            except Exception as e:
+                print(f"❌ Pipeline stage '{stage.name}' failed:", e)
+                fail(e)
+                return
+
+        with remaining["lock"]:
+            remaining["count"] -= 1
+            last = remaining["count"] == 0
+
+        if last:
+            for _ in range(downstream_workers(idx)):
+                put(q_out, _DONE)
+
+    threads = [threading.Thread(target=feed, name="pipeline-source", daemon=True)]
+    for idx, stage in enumerate(stages):
+        remaining = {"count": stage.workers, "lock": threading.Lock()}
+        for n in range(stage.workers):
+            threads.append(threading.Thread(
+                target=work,
+                args=(idx, stage, remaining),
+                name=f"pipeline-{stage.name}-{n}",
+                daemon=True
+            ))
+
+    for t in threads:
+        t.start()
+
+    try:
+        while True:
+            item = get(queues[-1])
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        # Release any worker still blocked on a queue, then wait for all
+        stop.set()
+        for t in threads:
+            t.join()
+
+    if errors:
+        raise errors[0]
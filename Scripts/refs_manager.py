@@ -2,34 +2,41 @@
 # Phase 1 — Build reference images directly from Google Drive → S3
 
 import os
-import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+import urllib3.exceptions
+import google.auth.exceptions
 from tqdm import tqdm
-from googleapiclient.errors import HttpError
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import BotoCoreError, ClientError
 
+from .clients import get_s3
+from .mastersheet import get_mastersheet_snapshot
 from .gdrive_helpers import (
-    get_sheets_service,
-    get_drive_service,
     parse_drive_link,
-    download_file_from_drive,
-    download_from_public_url,
+    open_drive_file_stream,
+    open_public_url_stream,
+    TRANSPORT_ERRORS,
 )
 
 from .config import (
-    MASTERSHEET_ID,
-    MASTERSHEET_NAME,
     S3_BUCKET,
-    AWS_REGION,
+    REFS_SYNC_WORKERS,
 )
 
-import boto3
-
-SHEET_RANGE = f"{MASTERSHEET_NAME}!A:E"
-
-s3 = boto3.client("s3", region_name=AWS_REGION)
-
+# Each sync worker may run a couple of multipart part uploads at once
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 * 1024 * 1024, max_concurrency=2)
 
-def clean_name(name):
-    return "_".join(name.strip().split())
+# What one row's sync may raise: reported, and the other rows go on.
+# urllib3 errors come straight from response.raw while S3 reads the body
+SYNC_ERRORS = (
+    requests.RequestException,
+    urllib3.exceptions.HTTPError,
+    google.auth.exceptions.RefreshError,
+    ClientError,
+    BotoCoreError,
+) + TRANSPORT_ERRORS
 
 
 def ensure_ext_from_link(link):
@@ -39,56 +46,47 @@ def ensure_ext_from_link(link):
 
 
 def get_mastersheet_rows():
-    sheets = get_sheets_service()
-    resp = sheets.spreadsheets().values().get(
-        spreadsheetId=MASTERSHEET_ID,
-        range=SHEET_RANGE
-    ).execute()
-    values = resp.get("values", [])
-    return values[1:] if values else []
+    """Raw Mastersheet rows (header skipped), from the shared snapshot."""
+    return get_mastersheet_snapshot().rows
 
 
-def phase1_build_refs():
+def ref_s3_key(student):
     """
-    ONLINE-ONLY:
-    Google Drive → TEMP FILE → S3 (refs/)
+    StudentRecord → (refs/ S3 key, photo link), or None if incomplete.
     """
-    rows = get_mastersheet_rows()
-    drive = get_drive_service()
-
-    for row in tqdm(rows, desc="Processing mastersheet rows"):
-        srno = row[0].strip() if len(row) > 0 else ""
-        name = row[1].strip() if len(row) > 1 else ""
-        class_ = row[2].strip() if len(row) > 2 else ""
-        section = row[3].strip() if len(row) > 3 else ""
-        link = row[4].strip() if len(row) > 4 else ""
+    if not (student.srno and student.name and student.photo_link):
+        return None
 
-        if not (srno and name and link):
-            continue
+    ext = ensure_ext_from_link(student.photo_link)
+    return f"refs/{student.folder_name}{ext}", student.photo_link
 
-        clean = clean_name(name)
-        ext = ensure_ext_from_link(link)
-        filename = f"{srno}-{clean}-{class_}-{section}{ext}"
-        s3_key = f"refs/{filename}"
 
-        # TEMP FILE
-        with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
-            tmp_path = tmp.name
+def sync_ref(s3_key, link):
+    """
+    Stream one reference photo from Drive (or a public URL) into S3.
+    Large photos go up as a multipart upload while still downloading.
+    """
+    file_id = parse_drive_link(link)
+    stream = open_drive_file_stream(file_id) if file_id else open_public_url_stream(link)
 
-        try:
-            file_id = parse_drive_link(link)
+    try:
+        get_s3().upload_fileobj(stream, S3_BUCKET, s3_key, Config=TRANSFER_CONFIG)
+    finally:
+        stream.close()
 
-            if file_id:
-                download_file_from_drive(drive, file_id, tmp_path)
-            else:
-                download_from_public_url(link, tmp_path)
 
-            # Upload directly to S3
-            s3.upload_file(tmp_path, S3_BUCKET, s3_key)
+def phase1_build_refs():
+    """
+    ONLINE-ONLY:
+    Google Drive → S3 (refs/), streamed, REFS_SYNC_WORKERS at a time
+    """
+    refs = [ref for ref in map(ref_s3_key, get_mastersheet_snapshot().students) if ref]
 
-        except HttpError as e:
-            print("❌ Failed:", srno, name, e)
+    with ThreadPoolExecutor(max_workers=REFS_SYNC_WORKERS, thread_name_prefix="refs-sync") as pool:
+        futures = {pool.submit(sync_ref, s3_key, link): s3_key for s3_key, link in refs}
 
-        finally:
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
\ No newline at end of file
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing mastersheet rows"):
+            try:
+                future.result()
+            except SYNC_ERRORS as e:
+                print("❌ Failed:", futures[future], e)
@@ -0,0 +1,201 @@
+# rekog_client.py
+# Shared Rekognition client for indexing and sorting.
+#
+# Every call goes through a per-operation token bucket sized to the
+# account's TPS quota. The rate backs off multiplicatively when AWS
+# throttles us and creeps back up additively on success (AIMD), and
+# failed calls are retried with jittered exponential backoff, unless
+# the error is permanent (bad image, missing collection, ...).
+
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import (
+    BotoCoreError,
+    ClientError,
+    ConnectionError as BotoConnectionError,
+    ReadTimeoutError,
+)
+
+from .clients import get_boto3_client
+from .config import (
+    REKOG_TPS,
+    REKOG_MIN_TPS,
+    REKOG_MAX_RETRIES,
+    REKOG_RETRY_BASE_SECONDS,
+    REKOG_RETRY_MAX_SECONDS,
+)
+
+THROTTLING_CODES = {
+    "ThrottlingException",
+    "ProvisionedThroughputExceededException",
+    "LimitExceededException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+}
+
+TRANSIENT_CODES = {
+    "InternalServerError",
+    "InternalFailure",
+    "ServiceUnavailable",
+    "ServiceUnavailableException",
+    "RequestTimeout",
+    "RequestTimeoutException",
+}
+
+
+def classify_error(error):
+    """
+    'throttle'  - over quota, slow down and retry
+    'transient' - network / server hiccup, retry
+    'permanent' - retrying will not help (bad image, access, ...)
+    """
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code", "")
+        if code in THROTTLING_CODES:
+            return "throttle"
+        if code in TRANSIENT_CODES:
+            return "transient"
+        return "permanent"
+
+    if isinstance(error, (BotoConnectionError, ReadTimeoutError)):
+        return "transient"
+
+    return "permanent"
+
+
+class AdaptiveTokenBucket:
+    """
+    Token bucket whose rate follows AIMD: +1 TPS per second's worth of
+    successes, halved on throttling (at most once per second).
+    """
+
+    def __init__(self, rate, min_rate, max_rate):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        burst = max(1.0, self.rate)
+        self._tokens = min(burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + 1.0 / self.rate)
+
+    def on_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease < 1.0:
+                return
+            self._last_decrease = now
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+
+
+class RateLimitedRekognition:
+    """
+    Drop-in wrapper around a boto3 Rekognition client.
+    rekog.search_faces_by_image(...) etc. work as before, but are rate
+    limited and retried. Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        tps=REKOG_TPS,
+        min_tps=REKOG_MIN_TPS,
+        max_retries=REKOG_MAX_RETRIES,
+        retry_base=REKOG_RETRY_BASE_SECONDS,
+        retry_max=REKOG_RETRY_MAX_SECONDS
+    ):
+        # Retries happen here, where throttling also slows the bucket
+        self.client = client or get_boto3_client(
+            "rekognition",
+            retries={"mode": "standard", "total_max_attempts": 1}
+        )
+        self.tps = tps
+        self.min_tps = min_tps
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, operation):
+        # Rekognition quotas are per API operation
+        with self._lock:
+            bucket = self._buckets.get(operation)
+            if bucket is None:
+                bucket = AdaptiveTokenBucket(self.tps, self.min_tps, self.tps)
+                self._buckets[operation] = bucket
+            return bucket
+
+    def call(self, operation, **kwargs):
+        bucket = self._bucket(operation)
+        method = getattr(self.client, operation)
+
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            try:
+                resp = method(**kwargs)
+            except (ClientError, BotoCoreError) as e:
+                kind = classify_error(e)
+                if kind == "throttle":
+                    bucket.on_throttle()
+                if kind == "permanent" or attempt == self.max_retries:
+                    raise
+                # Full jitter keeps parallel workers from retrying in lockstep
+                time.sleep(random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt)))
+                continue
+
+            bucket.on_success()
+            return resp
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name in self.client.meta.method_to_api_mapping:
+            return lambda **kwargs: self.call(name, **kwargs)
+        return attr
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_rekognition():
+    """Process-wide RateLimitedRekognition, so all threads share one quota."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = RateLimitedRekognition()
+        return _shared
+
+
+def _reset_after_fork():
+    global _shared, _shared_lock
+    _shared = None
+    _shared_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,9 +1,9 @@
 # rekog_manager.py
 # Phase 2 — Rekognition indexing (ONLINE ONLY, S3-based)
 
-import time
-import boto3
-from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from botocore.exceptions import BotoCoreError, ClientError
 from tqdm import tqdm
 
 from .config import (
@@ -14,13 +14,16 @@ from .config import (
     EXTERNAL_ID_FORMAT,
     MASTERSHEET_ID,
     MASTERSHEET_NAME,
+    INDEX_WORKERS,
+    INDEX_CHECKPOINT_EVERY,
 )
 
-from .s3_face_map import read_face_map_from_s3, write_face_map_to_s3
+from .s3_face_map import FaceMapStore
 from .gdrive_helpers import get_sheets_service
+from .clients import get_s3
+from .rekog_client import get_rekognition, classify_error
+from .mastersheet import get_mastersheet_snapshot, invalidate_mastersheet_snapshot
 
-s3 = boto3.client("s3", region_name=AWS_REGION)
-rekog = boto3.client("rekognition", region_name=AWS_REGION)
 
 
 # ------------------------------------------------------
@@ -29,18 +32,18 @@ rekog = boto3.client("rekognition", region_name=AWS_REGION)
 
 def ensure_bucket_exists():
     try:
-        s3.head_bucket(Bucket=S3_BUCKET)
+        get_s3().head_bucket(Bucket=S3_BUCKET)
     except ClientError:
-        s3.create_bucket(
+        get_s3().create_bucket(
             Bucket=S3_BUCKET,
             CreateBucketConfiguration={"LocationConstraint": AWS_REGION}
         )
 
 
 def ensure_collection():
-    existing = rekog.list_collections().get("CollectionIds", [])
+    existing = get_rekognition().list_collections().get("CollectionIds", [])
     if REKOG_COLLECTION not in existing:
-        rekog.create_collection(CollectionId=REKOG_COLLECTION)
+        get_rekognition().create_collection(CollectionId=REKOG_COLLECTION)
 
 
 # ------------------------------------------------------
@@ -51,7 +54,7 @@ def list_ref_images_from_s3():
     """
     List all reference images under refs/ in S3.
     """
-    paginator = s3.get_paginator("list_objects_v2")
+    paginator = get_s3().get_paginator("list_objects_v2")
     pages = paginator.paginate(Bucket=S3_BUCKET, Prefix="refs/")
 
     files = []
@@ -63,66 +66,149 @@ def list_ref_images_from_s3():
     return files
 
 
-def index_faces_and_record(update_sheet=True):
+def external_id_from_ref_key(s3_key):
     """
-    Index faces directly from S3 and persist FaceId mapping.
+    refs/SrNo-Name-Class-Section.jpg → ExternalImageId (None if malformed).
     """
-    ensure_bucket_exists()
-    ensure_collection()
+    filename = s3_key.split("/")[-1]
+    base = filename.rsplit(".", 1)[0]
+    parts = base.split("-")
 
-    existing_map = read_face_map_from_s3() or {}
-    records = list(existing_map.values())
+    if len(parts) < 4:
+        return None
 
-    s3_keys = list_ref_images_from_s3()
+    srno, name, class_, section = parts[0], parts[1], parts[2], parts[3]
 
-    for s3_key in tqdm(s3_keys, desc="Indexing faces"):
-        filename = s3_key.split("/")[-1]
-        base = filename.rsplit(".", 1)[0]
-        parts = base.split("-")
+    return EXTERNAL_ID_FORMAT.format(
+        srno=srno,
+        name=name,
+        class_name=class_,
+        section=section
+    )
 
-        if len(parts) < 4:
-            continue
 
-        srno, name, class_, section = parts[0], parts[1], parts[2], parts[3]
+def list_collection_faces():
+    """
+    ExternalImageId → [FaceId...] for every face already in the collection.
+    """
+    faces = {}
+    next_token = None
+
+    while True:
+        kwargs = {"CollectionId": REKOG_COLLECTION, "MaxResults": 4096}
+        if next_token:
+            kwargs["NextToken"] = next_token
+        resp = get_rekognition().list_faces(**kwargs)
+
+        for face in resp.get("Faces", []):
+            external_id = face.get("ExternalImageId")
+            if external_id:
+                faces.setdefault(external_id, []).append(face["FaceId"])
+
+        next_token = resp.get("NextToken")
+        if not next_token:
+            return faces
+
+
+def _face_record(external_id, face_id, s3_key):
+    return {
+        "ExternalImageId": external_id,
+        "FaceId": face_id,
+        "S3Key": s3_key,
+        "FileName": s3_key.split("/")[-1]
+    }
+
 
-        external_id = EXTERNAL_ID_FORMAT.format(
-            srno=srno,
-            name=name,
-            class_name=class_,
-            section=section
+def _index_ref(s3_key, external_id):
+    try:
+        resp = get_rekognition().index_faces(
+            CollectionId=REKOG_COLLECTION,
+            Image={"S3Object": {"Bucket": S3_BUCKET, "Name": s3_key}},
+            ExternalImageId=external_id,
+            DetectionAttributes=["DEFAULT"],
+            # A ref photo is one student: keep only the largest face
+            MaxFaces=1
         )
+    except (ClientError, BotoCoreError) as e:
+        # Throttling / transient errors were already retried by get_rekognition()
+        print(f"❌ Indexing failed ({classify_error(e)}):", s3_key, e)
+        return None
 
-        if SKIP_ALREADY_INDEXED and external_id in existing_map:
-            continue
+    face_records = resp.get("FaceRecords", [])
+    if not face_records:
+        print("⚠️ No face detected in:", s3_key)
+        return None
 
-        try:
-            resp = rekog.index_faces(
-                CollectionId=REKOG_COLLECTION,
-                Image={"S3Object": {"Bucket": S3_BUCKET, "Name": s3_key}},
-                ExternalImageId=external_id,
-                DetectionAttributes=["DEFAULT"]
-            )
-        except Exception as e:
-            print("❌ Indexing failed:", s3_key, e)
-            continue
+    return _face_record(external_id, face_records[0]["Face"]["FaceId"], s3_key)
 
-        face_records = resp.get("FaceRecords", [])
-        if not face_records:
-            print("⚠️ No face detected in:", s3_key)
-            continue
 
-        face_id = face_records[0]["Face"]["FaceId"]
+def index_faces_and_record(update_sheet=True):
+    """
+    Index faces directly from S3 and persist FaceId mapping.
 
-        records.append({
-            "ExternalImageId": external_id,
-            "FaceId": face_id,
-            "S3Key": s3_key,
-            "FileName": filename
-        })
+    Refs are indexed INDEX_WORKERS at a time and new faces are
+    journaled to the face map every INDEX_CHECKPOINT_EVERY faces.
+    Faces already in the collection but missing from the face map
+    (an earlier run died before saving) are adopted instead of
+    indexed again.
+    """
+    ensure_bucket_exists()
+    ensure_collection()
 
-        time.sleep(0.05)
+    store = FaceMapStore(writer=True).load()
 
-    write_face_map_to_s3(records)
+    try:
+        ref_keys = {}
+        for s3_key in list_ref_images_from_s3():
+            external_id = external_id_from_ref_key(s3_key)
+            if external_id:
+                ref_keys[external_id] = s3_key
+
+        todo = []
+        if SKIP_ALREADY_INDEXED:
+            collection_faces = list_collection_faces()
+            recovered = 0
+
+            for external_id, s3_key in ref_keys.items():
+                if external_id in store:
+                    continue
+
+                face_ids = collection_faces.get(external_id)
+                if not face_ids:
+                    todo.append((s3_key, external_id))
+                    continue
+
+                if len(face_ids) > 1:
+                    print(f"⚠️ {len(face_ids)} faces in collection for {external_id}, keeping {face_ids[0]}")
+                store.upsert(_face_record(external_id, face_ids[0], s3_key))
+                recovered += 1
+
+            if recovered:
+                print(f"🔁 Recovered {recovered} face(s) indexed by an earlier run")
+                store.flush()
+        else:
+            todo = [(s3_key, external_id) for external_id, s3_key in ref_keys.items()]
+
+        since_checkpoint = 0
+        with ThreadPoolExecutor(max_workers=INDEX_WORKERS) as pool:
+            futures = [pool.submit(_index_ref, s3_key, external_id) for s3_key, external_id in todo]
+
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Indexing faces"):
+                rec = future.result()
+                if not rec:
+                    continue
+
+                store.upsert(rec)
+                since_checkpoint += 1
+
+                if since_checkpoint >= INDEX_CHECKPOINT_EVERY:
+                    store.flush()
+                    since_checkpoint = 0
+
+        records = store.records()
+    finally:
+        # Also on a crash: every face in the collection stays mapped
+        store.close()
 
     if update_sheet:
         update_mastersheet_faceids(records)
@@ -137,28 +223,16 @@ def index_faces_and_record(update_sheet=True):
 def update_mastersheet_faceids(records):
     """
     Writes FaceID (F) and ExternalFaceID (G) to Mastersheet.
+    Rows that already hold the same values are not rewritten.
     """
 
     if not records:
         return
 
-    sheets = get_sheets_service()
-
-    resp = sheets.spreadsheets().values().get(
-        spreadsheetId=MASTERSHEET_ID,
-        range=f"{MASTERSHEET_NAME}!A:A"
-    ).execute()
-
-    values = resp.get("values", [])
-    if not values:
+    students = get_mastersheet_snapshot().by_srno()
+    if not students:
         return
 
-    srno_to_row = {
-        row[0]: idx + 1
-        for idx, row in enumerate(values)
-        if idx > 0 and row
-    }
-
     updates = []
 
     for rec in records:
@@ -166,20 +240,24 @@ def update_mastersheet_faceids(records):
         face_id = rec["FaceId"]
         srno = external_id.split("_", 1)[0]
 
-        row_num = srno_to_row.get(srno)
-        if not row_num:
+        student = students.get(srno)
+        if not student:
+            continue
+        if (student.face_id, student.external_id) == (face_id, external_id):
             continue
 
+        row_num = student.row_number
         updates.append({
             "range": f"{MASTERSHEET_NAME}!F{row_num}:G{row_num}",
             "values": [[face_id, external_id]]
         })
 
     if updates:
-        sheets.spreadsheets().values().batchUpdate(
+        get_sheets_service().spreadsheets().values().batchUpdate(
             spreadsheetId=MASTERSHEET_ID,
             body={
                 "valueInputOption": "USER_ENTERED",
                 "data": updates
             }
         ).execute()
+        invalidate_mastersheet_snapshot()
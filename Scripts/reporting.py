@@ -1,10 +1,36 @@
 # reporting.py
 # Phase 5 — Reporting to Google Sheets (Uploaded Data)
+#
+# ReportSink buffers report rows and appends them to the sheet every
+# REPORT_FLUSH_EVERY rows / REPORT_FLUSH_SECONDS seconds (a background
+# timer flushes when rows stop arriving), so a crash loses at most one
+# window and a run costs a handful of Sheets calls.
+# Rows the sheet rejects even after retries are spooled to S3
+# (<MP_REPORT_LOG_PREFIX>pending/) and appended by the next run.
+# With REPORT_S3_MIRROR every flushed batch is also written as gzipped
+# JSONL under <MP_REPORT_LOG_PREFIX><date>/.
 
-from .gdrive_helpers import get_sheets_service
-from .config import MASTERSHEET_ID, UPLOADED_DATA_SHEET
+import gzip
+import json
+import threading
+import time
+import uuid
 import datetime
 
+from . import metrics
+from .gdrive_helpers import get_sheets_service, execute_with_backoff
+from .clients import get_s3
+from .config import (
+    S3_BUCKET,
+    MASTERSHEET_ID,
+    UPLOADED_DATA_SHEET,
+    SORT_DELIVERY_MODE,
+    REPORT_FLUSH_EVERY,
+    REPORT_FLUSH_SECONDS,
+    REPORT_S3_MIRROR,
+    MP_REPORT_LOG_PREFIX,
+)
+
 
 HEADERS = [
     "Timestamp",
@@ -12,63 +38,284 @@ HEADERS = [
     "Faces Detected",
     "Face IDs Matched",
     "External Face IDs",
-    "Copied to Folders"
+    "Copied to Folders",
+    "Delivery Mode"
 ]
 
+PENDING_PREFIX = MP_REPORT_LOG_PREFIX + "pending/"
+
 
 def ensure_headers_exist(sheets):
     """
     Ensure header row exists in Uploaded Data sheet.
     """
-    resp = sheets.spreadsheets().values().get(
+    resp = execute_with_backoff(lambda: sheets.spreadsheets().values().get(
         spreadsheetId=MASTERSHEET_ID,
-        range=f"{UPLOADED_DATA_SHEET}!A1:F1"
-    ).execute()
+        range=f"{UPLOADED_DATA_SHEET}!A1:G1"
+    ))
 
     values = resp.get("values", [])
     if not values or values[0] != HEADERS:
-        sheets.spreadsheets().values().update(
+        execute_with_backoff(lambda: sheets.spreadsheets().values().update(
             spreadsheetId=MASTERSHEET_ID,
-            range=f"{UPLOADED_DATA_SHEET}!A1:F1",
+            range=f"{UPLOADED_DATA_SHEET}!A1:G1",
             valueInputOption="USER_ENTERED",
             body={"values": [HEADERS]}
-        ).execute()
+        ))
+
+
+# ------------------------------------------------------
+# S3 LOGS
+# ------------------------------------------------------
+
+def _jsonl_gz(rows):
+    lines = (json.dumps(dict(zip(HEADERS, row)), ensure_ascii=False) for row in rows)
+    return gzip.compress(("\n".join(lines) + "\n").encode("utf-8"))
+
+
+def _read_jsonl_gz(body):
+    rows = []
+    for line in gzip.decompress(body).decode("utf-8").splitlines():
+        if line.strip():
+            record = json.loads(line)
+            rows.append([record.get(h, "") for h in HEADERS])
+    return rows
+
+
+def _segment_key(prefix, run_id, seq):
+    return f"{prefix}{int(time.time() * 1000):013d}-{run_id}-{seq:05d}.jsonl.gz"
+
+
+# ------------------------------------------------------
+# SINK
+# ------------------------------------------------------
+
+class ReportSink:
+    """
+    Buffered writer for Uploaded Data rows (HEADERS order).
+
+    add() buffers; a flush appends the buffer to the sheet in one call
+    (headers are checked once per sink) and, with `mirror`, logs it to
+    S3. A timer thread flushes rows older than flush_seconds even when
+    no more arrive. Network I/O runs outside the buffer lock, so add()
+    never waits for a flush. A row's on_written callback runs once the
+    row is in the sheet (or spooled to S3). Call close() at the end of
+    a run (also on failure); it records the time spent flushing as
+    metrics phase "phase5_report".
+    """
+
+    def __init__(
+        self,
+        flush_every=REPORT_FLUSH_EVERY,
+        flush_seconds=REPORT_FLUSH_SECONDS,
+        mirror=REPORT_S3_MIRROR
+    ):
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.mirror = mirror
+        self.rows_written = 0
+        self._run_id = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._buffer = []
+        self._callbacks = []    # (buffer position, on_written)
+        self._spooled = []      # pending/ keys whose rows are in the buffer
+        self._headers_checked = False
+        self._last_flush = time.monotonic()
+        self._retry_after = 0.0
+        self._lock = threading.Lock()          # buffer state
+        self._flush_lock = threading.Lock()    # one flush at a time, in order
+        self._closed = threading.Event()
+        self._timer = None
+        self._seconds = 0.0     # in flushes, for the phase5_report metric
+
+    def load(self):
+        """Pick up rows an earlier run could not write. Returns self."""
+        paginator = get_s3().get_paginator("list_objects_v2")
+        keys = []
+        for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=PENDING_PREFIX):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+
+        for key in sorted(keys):
+            body = get_s3().get_object(Bucket=S3_BUCKET, Key=key)["Body"].read()
+            self._buffer.extend(_read_jsonl_gz(body))
+            self._spooled.append(key)
+
+        if keys:
+            print(f"📝 Report: {len(self._buffer)} row(s) left over from an earlier run")
+        return self
+
+    def add(self, row, on_written=None):
+        with self._lock:
+            self._buffer.append(row)
+            if on_written is not None:
+                self._callbacks.append((len(self._buffer) - 1, on_written))
+            if self._timer is None:
+                self._timer = threading.Thread(target=self._run_timer, name="report-flush", daemon=True)
+                self._timer.start()
+            due = self._due(by_size=True)
+        if due:
+            self._flush_if_idle()
+
+    def _due(self, by_size):
+        """Call with the lock held."""
+        now = time.monotonic()
+        return bool(self._buffer) and now >= self._retry_after and (
+            (by_size and len(self._buffer) >= self.flush_every)
+            or now - self._last_flush >= self.flush_seconds
+        )
+
+    def _run_timer(self):
+        while not self._closed.wait(min(self.flush_seconds, 1.0)):
+            with self._lock:
+                due = self._due(by_size=False)
+            if due:
+                try:
+                    self._flush_if_idle()
+                except Exception as e:
+                    # The rows reached the sheet; only the S3 side failed
+                    print("⚠️ Report: background flush failed:", e)
+
+    def _flush_if_idle(self):
+        # A flush already running takes these rows next time round
+        if self._flush_lock.acquire(blocking=False):
+            start = time.perf_counter()
+            try:
+                self._flush()
+            finally:
+                self._seconds += time.perf_counter() - start
+                self._flush_lock.release()
+
+    def flush(self):
+        """
+        Append buffered rows to the sheet. On failure the rows go back
+        to the buffer for the next flush and False is returned.
+        """
+        with self._flush_lock:
+            start = time.perf_counter()
+            try:
+                return self._flush()
+            finally:
+                self._seconds += time.perf_counter() - start
+
+    def _flush(self):
+        # Take the rows out; add() keeps buffering while we write them
+        with self._lock:
+            self._last_flush = time.monotonic()
+            rows, self._buffer = self._buffer, []
+            callbacks, self._callbacks = self._callbacks, []
+            spooled, self._spooled = self._spooled, []
+            if not rows:
+                return True
+
+        try:
+            self._append(rows)
+        except Exception as e:
+            # Network errors surface as several exception types; keep the rows either way
+            print(f"⚠️ Report: could not write {len(rows)} row(s) to the sheet, keeping them:", e)
+            with self._lock:
+                self._callbacks = callbacks + [(pos + len(rows), cb) for pos, cb in self._callbacks]
+                self._buffer[:0] = rows
+                self._spooled[:0] = spooled
+                self._retry_after = time.monotonic() + self.flush_seconds
+            return False
+
+        with self._lock:
+            self.rows_written += len(rows)
+            self._seq += 1
+            seq = self._seq
+
+        if self.mirror:
+            day = datetime.datetime.utcnow().strftime("%Y-%m-%d")
+            get_s3().put_object(
+                Bucket=S3_BUCKET,
+                Key=_segment_key(f"{MP_REPORT_LOG_PREFIX}{day}/", self._run_id, seq),
+                Body=_jsonl_gz(rows)
+            )
+
+        if spooled:
+            get_s3().delete_objects(
+                Bucket=S3_BUCKET,
+                Delete={"Objects": [{"Key": k} for k in spooled], "Quiet": True}
+            )
+        for _, on_written in callbacks:
+            on_written()
+        return True
+
+    def _append(self, rows):
+        sheets = get_sheets_service()
+        if not self._headers_checked:
+            ensure_headers_exist(sheets)
+            self._headers_checked = True
+
+        execute_with_backoff(lambda: sheets.spreadsheets().values().append(
+            spreadsheetId=MASTERSHEET_ID,
+            range=f"{UPLOADED_DATA_SHEET}!A:G",
+            valueInputOption="USER_ENTERED",
+            insertDataOption="INSERT_ROWS",
+            body={"values": rows}
+        ))
+
+    def close(self):
+        """Final flush; rows the sheet still refuses are spooled to S3."""
+        self._closed.set()
+        if self._timer is not None:
+            self._timer.join()
+        start = time.perf_counter()
+        try:
+            self._close()
+        finally:
+            metrics.record_phase("phase5_report", self._seconds + time.perf_counter() - start)
+
+    def _close(self):
+        with self._flush_lock:
+            if self._flush():
+                return
+
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            callbacks, self._callbacks = self._callbacks, []
+            spooled, self._spooled = self._spooled, []
+            self._seq += 1
+            key = _segment_key(PENDING_PREFIX, self._run_id, self._seq)
+
+        get_s3().put_object(Bucket=S3_BUCKET, Key=key, Body=_jsonl_gz(rows))
+        if spooled:
+            # Their rows are in the new segment now
+            get_s3().delete_objects(
+                Bucket=S3_BUCKET,
+                Delete={"Objects": [{"Key": k} for k in spooled], "Quiet": True}
+            )
+        print(f"📝 Report: {len(rows)} row(s) saved to s3://{S3_BUCKET}/{key} for the next run")
+        for _, on_written in callbacks:
+            on_written()
 
 
 def append_uploaded_data(rows):
     """
-    rows format (from sorter):
+    rows format:
     [
         file_name,
         faces_detected,
         face_ids_csv,
         external_ids_csv,
-        copied_to_csv
+        copied_to_csv,
+        delivery_mode       (optional, "copy" / "shortcut")
     ]
     """
     if not rows:
         return
 
-    sheets = get_sheets_service()
-    ensure_headers_exist(sheets)
-
     now = datetime.datetime.utcnow().isoformat()
 
-    body_rows = []
+    sink = ReportSink(flush_every=len(rows) + 1)
     for r in rows:
-        body_rows.append([
+        sink.add([
             now,
             r[0],   # File Name
             r[1],   # Faces Detected
             r[2],   # Face IDs Matched
             r[3],   # External Face IDs
             r[4],   # Copied to Folders
+            r[5] if len(r) > 5 else SORT_DELIVERY_MODE,   # Delivery Mode
         ])
-
-    sheets.spreadsheets().values().append(
-        spreadsheetId=MASTERSHEET_ID,
-        range=f"{UPLOADED_DATA_SHEET}!A:F",
-        valueInputOption="USER_ENTERED",
-        insertDataOption="INSERT_ROWS",
-        body={"values": body_rows}
-    ).execute()
+    sink.close()
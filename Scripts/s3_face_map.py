@@ -1,44 +1,394 @@
 # s3_face_map.py
 # Persist face map to S3 so rekognition mapping is shared across runs.
+#
+# Layout:
+#   MP_FACE_MAP_DB_KEY                 SQLite database, table faces
+#                                      (ExternalImageId primary key, FaceId index)
+#   <db key base>/journal/<ts>-<n>.json  upserts / deletes since the database
+#
+# load() reuses a local copy of the database while its ETag is
+# unchanged (STATE_CACHE_DIR), then replays the journal. Lookups by
+# FaceId or ExternalImageId are indexed queries, so nothing is parsed
+# into a dict up front. Writes go to the local database and, on
+# flush(), to one small journal segment; compact() uploads the
+# database (conditional on the ETag it was loaded from, so a compaction
+# by another run is never overwritten) and drops the segments it
+# contains. Only writers (indexing) compact on close(); sort runs and
+# other readers leave the journal alone. revision() identifies
+# the map's content for results cached against it (checksum index,
+# sort work manifest).
+# The old CSV (MP_FACE_MAP_KEY) is imported once and no longer written.
 
-import boto3
 import csv
+import glob
+import hashlib
 import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
 from botocore.exceptions import ClientError
-from .config import S3_BUCKET, AWS_REGION, MP_FACE_MAP_KEY
+from .config import (
+    S3_BUCKET,
+    MP_FACE_MAP_KEY,
+    MP_FACE_MAP_DB_KEY,
+    STATE_CACHE_DIR,
+    FACE_MAP_COMPACT_SEGMENTS,
+)
+from .clients import get_s3
+from .leases import is_conflict
 
-_s3 = boto3.client("s3", region_name=AWS_REGION)
 
+FIELDNAMES = ["ExternalImageId", "FaceId", "S3Key", "FileName"]
+
+JOURNAL_PREFIX = MP_FACE_MAP_DB_KEY.rsplit(".", 1)[0] + "/journal/"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS faces (
+    external_id TEXT PRIMARY KEY,
+    face_id     TEXT NOT NULL,
+    s3_key      TEXT,
+    file_name   TEXT
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS faces_face_id ON faces (face_id);
+"""
+
+COLUMNS = "external_id, face_id, s3_key, file_name"
+
+UPSERT = f"""
+INSERT INTO faces ({COLUMNS}) VALUES (?, ?, ?, ?)
+ON CONFLICT (external_id) DO UPDATE SET
+    face_id = excluded.face_id,
+    s3_key = excluded.s3_key,
+    file_name = excluded.file_name
+"""
+
+
+def _missing(e):
+    return e.response["Error"]["Code"] in ("NoSuchKey", "404", "NotFound")
 
-def read_face_map_from_s3():
-    try:
-        resp = _s3.get_object(Bucket=S3_BUCKET, Key=MP_FACE_MAP_KEY)
-        body = resp["Body"].read().decode("utf-8")
-        f = io.StringIO(body)
-        reader = csv.DictReader(f)
-        return {row["ExternalImageId"]: row for row in reader}
 
+def _row_to_record(row):
+    return dict(zip(FIELDNAMES, row)) if row else None
+
+
+def _record_values(record):
+    return (
+        record["ExternalImageId"],
+        record["FaceId"],
+        record.get("S3Key", ""),
+        record.get("FileName", ""),
+    )
+
+
+def _read_legacy_csv():
+    try:
+        resp = get_s3().get_object(Bucket=S3_BUCKET, Key=MP_FACE_MAP_KEY)
     except ClientError as e:
-        code = e.response["Error"]["Code"]
-        if code in ("NoSuchKey", "404"):
-            return {}
+        if _missing(e):
+            return []
         raise  # real S3 error → surface it
+    return list(csv.DictReader(io.StringIO(resp["Body"].read().decode("utf-8"))))
+
+
+def _list_journal_segments():
+    paginator = get_s3().get_paginator("list_objects_v2")
+    keys = []
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=JOURNAL_PREFIX):
+        keys.extend(obj["Key"] for obj in page.get("Contents", []))
+    return sorted(keys)
+
+
+# ------------------------------------------------------
+# LOCAL CACHE
+# ------------------------------------------------------
+
+def _cache_path(etag):
+    etag = etag.strip('"')
+    return os.path.join(STATE_CACHE_DIR, f"faceid_map-{etag}.sqlite")
+
+
+def _fetch_database():
+    """
+    (local path, ETag) of the database as it is in S3 (downloaded only
+    when its ETag changed), or (None, None) if there is none yet.
+    """
+    try:
+        etag = get_s3().head_object(Bucket=S3_BUCKET, Key=MP_FACE_MAP_DB_KEY)["ETag"]
+    except ClientError as e:
+        if _missing(e):
+            return None, None
+        raise
+
+    path = _cache_path(etag)
+    if os.path.exists(path):
+        return path, etag
+
+    resp = get_s3().get_object(Bucket=S3_BUCKET, Key=MP_FACE_MAP_DB_KEY)
+    etag = resp.get("ETag", etag)
+    return _store_in_cache(etag, lambda f: shutil.copyfileobj(resp["Body"], f)), etag
+
+
+def _store_in_cache(etag, write):
+    """Replace the cached copy with the file write(f) produces."""
+    os.makedirs(STATE_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=STATE_CACHE_DIR, suffix=".part")
+    with os.fdopen(fd, "wb") as f:
+        write(f)
+
+    # Keep only the newest copy (another process may be cleaning up too)
+    for old in glob.glob(os.path.join(STATE_CACHE_DIR, "faceid_map-*.sqlite")):
+        try:
+            os.remove(old)
+        except FileNotFoundError:
+            pass
+    path = _cache_path(etag)
+    os.replace(tmp_path, path)
+    return path
+
+
+# ------------------------------------------------------
+# STORE
+# ------------------------------------------------------
+
+class FaceMapStore:
+    """
+    Face map records {ExternalImageId, FaceId, S3Key, FileName} in a
+    local SQLite copy, indexed both ways. Thread-safe.
+    writer=True for the indexing run that owns compaction; readers
+    never compact on close(). Call close() when done (also on failure).
+    """
+
+    def __init__(self, compact_segments=FACE_MAP_COMPACT_SEGMENTS, writer=False):
+        self.compact_segments = compact_segments
+        self.writer = writer
+        self._path = None
+        self._etag = None
+        self._conn = None
+        self._pending = []
+        self._segments = []
+        self._migrate = False
+        self._revision = None
+        self._lock = threading.Lock()
+
+    # ---------- persistence ----------
+
+    def load(self):
+        """Open the database and replay the journal. Returns self."""
+        fd, self._path = tempfile.mkstemp(prefix="mp_facemap_", suffix=".sqlite")
+        os.close(fd)
+
+        cached, self._etag = _fetch_database()
+        if cached:
+            # A private working copy: the cached file stays pristine for the next run
+            shutil.copyfile(cached, self._path)
+
+        self._conn = sqlite3.connect(self._path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+
+        if not cached:
+            legacy = _read_legacy_csv()
+            if legacy:
+                self._conn.executemany(UPSERT, [_record_values(r) for r in legacy])
+                self._migrate = True
+
+        self._segments = _list_journal_segments()
+        for key in list(self._segments):
+            try:
+                resp = get_s3().get_object(Bucket=S3_BUCKET, Key=key)
+            except ClientError as e:
+                if not _missing(e):
+                    raise
+                # Folded into the database by a compaction since we listed
+                self._segments.remove(key)
+                continue
+            self._apply(json.loads(resp["Body"].read().decode("utf-8")))
+
+        self._conn.commit()
+        return self
+
+    def _apply(self, ops):
+        self._revision = None
+        for op in ops:
+            if op["op"] == "upsert":
+                self._conn.execute(UPSERT, _record_values(op["record"]))
+            elif op["op"] == "delete":
+                self._conn.execute("DELETE FROM faces WHERE external_id = ?", (op["external_id"],))
+
+    def flush(self):
+        """Write buffered changes as one journal segment."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if not pending:
+                return
+            key = f"{JOURNAL_PREFIX}{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}.json"
+            get_s3().put_object(
+                Bucket=S3_BUCKET,
+                Key=key,
+                Body=json.dumps(pending, ensure_ascii=False).encode("utf-8")
+            )
+            self._segments.append(key)
+
+    def compact(self):
+        """
+        Upload the database and delete the segments folded into it.
+        The upload only replaces the database we loaded: if another run
+        compacted meanwhile, reload (our changes are in the journal by
+        then) and try again. Segments written meanwhile by another run
+        are left alone and replayed by the next load().
+        """
+        while True:
+            self.flush()
+            with self._lock:
+                segments = list(self._segments)
+                self._conn.commit()
+                condition = {"IfMatch": self._etag} if self._etag else {"IfNoneMatch": "*"}
+                with open(self._path, "rb") as f:
+                    try:
+                        resp = get_s3().put_object(
+                            Bucket=S3_BUCKET, Key=MP_FACE_MAP_DB_KEY, Body=f, **condition
+                        )
+                    except ClientError as e:
+                        if not (is_conflict(e) or _missing(e)):
+                            raise
+                        resp = None
+                    else:
+                        self._segments = [k for k in self._segments if k not in segments]
+                        self._etag = resp.get("ETag")
+                        self._migrate = False
+                        if self._etag:
+                            # What we uploaded is what the next run would download
+                            f.seek(0)
+                            _store_in_cache(self._etag, lambda out: shutil.copyfileobj(f, out))
+
+            if resp is not None:
+                break
+            print("🔁 Face map compacted by another run meanwhile, reloading")
+            self._reload()
+
+        for i in range(0, len(segments), 1000):
+            get_s3().delete_objects(
+                Bucket=S3_BUCKET,
+                Delete={"Objects": [{"Key": k} for k in segments[i:i + 1000]], "Quiet": True}
+            )
+
+    def _reload(self):
+        """Start over from the database and journal now in S3."""
+        with self._lock:
+            self._conn.close()
+            os.remove(self._path)
+        self.load()
+
+    def close(self):
+        """
+        Flush, compact (writers only) once enough segments piled up,
+        drop the working copy.
+        """
+        if self._conn is None:
+            return
+        try:
+            self.flush()
+            if self.writer and (self._migrate or len(self._segments) >= self.compact_segments):
+                self.compact()
+        finally:
+            self._conn.close()
+            self._conn = None
+            os.remove(self._path)
+
+    # ---------- reads ----------
+
+    def by_face_id(self, face_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {COLUMNS} FROM faces WHERE face_id = ?", (face_id,)
+            ).fetchone()
+        return _row_to_record(row)
+
+    def by_external_id(self, external_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {COLUMNS} FROM faces WHERE external_id = ?", (external_id,)
+            ).fetchone()
+        return _row_to_record(row)
+
+    def __contains__(self, external_id):
+        return self.by_external_id(external_id) is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM faces").fetchone()[0]
+
+    def revision(self):
+        """
+        Digest of every ExternalImageId → FaceId pair. It changes with
+        any face added, removed or re-indexed (a new FaceId), and is the
+        same for the same content whichever run compacted the database:
+        results cached against it stay valid exactly while it does.
+        """
+        with self._lock:
+            if self._revision is None:
+                digest = hashlib.sha1()
+                for external_id, face_id in self._conn.execute(
+                    "SELECT external_id, face_id FROM faces ORDER BY external_id"
+                ):
+                    digest.update(f"{external_id}\t{face_id}\n".encode("utf-8"))
+                self._revision = digest.hexdigest()[:16]
+            return self._revision
+
+    def records(self):
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {COLUMNS} FROM faces ORDER BY external_id").fetchall()
+        return [_row_to_record(row) for row in rows]
+
+    # ---------- writes ----------
+
+    def upsert(self, record):
+        record = dict(zip(FIELDNAMES, _record_values(record)))
+        op = {"op": "upsert", "record": record}
+        with self._lock:
+            self._apply([op])
+            self._conn.commit()
+            self._pending.append(op)
+
+    def delete(self, external_id):
+        op = {"op": "delete", "external_id": external_id}
+        with self._lock:
+            self._apply([op])
+            self._conn.commit()
+            self._pending.append(op)
+
+
+# ------------------------------------------------------
+# WHOLE-MAP HELPERS
+# ------------------------------------------------------
+
+def read_face_map_from_s3():
+    """ExternalImageId → record (prefer FaceMapStore lookups)."""
+    store = FaceMapStore().load()
+    try:
+        return {r["ExternalImageId"]: r for r in store.records()}
+    finally:
+        store.close()
 
 
 def write_face_map_to_s3(records):
+    """Replace the whole face map with `records` (prefer FaceMapStore.upsert)."""
     if not records:
         return
 
-    f = io.StringIO()
-    fieldnames = ["ExternalImageId", "FaceId", "S3Key", "FileName"]
-    writer = csv.DictWriter(f, fieldnames=fieldnames)
-    writer.writeheader()
-
-    for r in records:
-        writer.writerow(r)
-
-    _s3.put_object(
-        Bucket=S3_BUCKET,
-        Key=MP_FACE_MAP_KEY,
-        Body=f.getvalue().encode("utf-8")
-    )
+    store = FaceMapStore(writer=True).load()
+    try:
+        keep = {r["ExternalImageId"] for r in records}
+        for rec in store.records():
+            if rec["ExternalImageId"] not in keep:
+                store.delete(rec["ExternalImageId"])
+        for r in records:
+            store.upsert(r)
+        store.compact()
+    finally:
+        store.close()
@@ -1,24 +1,517 @@
 # s3_tracker.py
 # Persist processed Drive file IDs to S3 so every scheduled run shares state.
+#
+# Layout (<base> is MP_PROCESSED_TRACKER_KEY without its extension):
+#   <base>/manifest.json               shard bits, ID count, current Bloom filter
+#   <base>/bloom-<n>.bin               Bloom filter over every stored ID
+#   <base>/shards/<bits>/<prefix>.gz   gzipped sorted IDs whose hash starts with <prefix>
+#   <base>/journal/<ts>-<n>.json       small append segments
+#
+# load() reads the manifest, the Bloom filter and the journal only, so
+# startup time and memory stay flat as the history grows. A lookup the
+# Bloom filter cannot rule out reads that one shard (shards are kept in
+# an LRU cache of bounded size). Compaction folds the journal into the shards it
+# touches and splits shards 16 ways once they grow too large.
+# The old single JSON array at MP_PROCESSED_TRACKER_KEY is migrated by
+# the first compaction.
+import gzip
+import hashlib
 import json
-import boto3
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
-from .config import S3_BUCKET, AWS_REGION, MP_PROCESSED_TRACKER_KEY
+from .config import (
+    S3_BUCKET,
+    MP_PROCESSED_TRACKER_KEY,
+    TRACKER_FLUSH_EVERY,
+    TRACKER_FLUSH_SECONDS,
+    TRACKER_COMPACT_SEGMENTS,
+    TRACKER_SHARD_MAX_IDS,
+    TRACKER_SHARD_CACHE_IDS,
+    TRACKER_BLOOM_FP_RATE,
+)
+from .clients import get_s3
+from .leases import is_conflict
 
-_s3 = boto3.client("s3", region_name=AWS_REGION)
 
-def load_processed_ids_from_s3():
+STORE_PREFIX = MP_PROCESSED_TRACKER_KEY.rsplit(".", 1)[0] + "/"
+JOURNAL_PREFIX = STORE_PREFIX + "journal/"
+MANIFEST_KEY = STORE_PREFIX + "manifest.json"
+
+# Shards are split one hex digit at a time
+INITIAL_SHARD_BITS = 4
+SHARD_SPLIT_BITS = 4
+
+# The Bloom filter is sized for twice the stored IDs (at least this many)
+BLOOM_MIN_CAPACITY = 100_000
+
+# Concurrent shard reads / writes during compaction
+COMPACT_WORKERS = 8
+
+
+def _read_json_ids(key):
     try:
-        resp = _s3.get_object(Bucket=S3_BUCKET, Key=MP_PROCESSED_TRACKER_KEY)
+        resp = get_s3().get_object(Bucket=S3_BUCKET, Key=key)
         body = resp['Body'].read().decode('utf-8')
-        data = json.loads(body)
-        return set(data)
+        return json.loads(body)
     except ClientError as e:
         code = e.response['Error']['Code']
         if code in ("NoSuchKey","404","NoSuchBucket"):
-            return set()
+            return []
+        raise
+
+
+def _write_json_ids(key, ids):
+    payload = json.dumps(list(ids), ensure_ascii=False)
+    get_s3().put_object(Bucket=S3_BUCKET, Key=key, Body=payload.encode('utf-8'))
+
+
+def _read_object(key):
+    """Object bytes, or None if it does not exist."""
+    return _read_object_with_etag(key)[0]
+
+
+def _read_object_with_etag(key):
+    """(bytes, ETag), or (None, None) if it does not exist."""
+    try:
+        resp = get_s3().get_object(Bucket=S3_BUCKET, Key=key)
+        return resp["Body"].read(), resp.get("ETag")
+    except ClientError as e:
+        if e.response['Error']['Code'] in ("NoSuchKey", "404", "NoSuchBucket"):
+            return None, None
+        raise
+
+
+def _write_condition(etag):
+    """Overwrite only the version we read (or create only if there was none)."""
+    return {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+
+
+def _delete_keys(keys):
+    keys = list(keys)
+    for i in range(0, len(keys), 1000):
+        get_s3().delete_objects(
+            Bucket=S3_BUCKET,
+            Delete={"Objects": [{"Key": k} for k in keys[i:i + 1000]], "Quiet": True}
+        )
+
+
+def _list_journal_segments():
+    try:
+        paginator = get_s3().get_paginator("list_objects_v2")
+        keys = []
+        for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=JOURNAL_PREFIX):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+        return sorted(keys)
+    except ClientError as e:
+        if e.response['Error']['Code'] == "NoSuchBucket":
+            return []
         raise
 
+
+# ------------------------------------------------------
+# HASHING / BLOOM FILTER
+# ------------------------------------------------------
+
+def id_hash(file_id):
+    """128-bit hash of a Drive ID; its top bits pick the shard."""
+    return int.from_bytes(hashlib.blake2b(file_id.encode("utf-8"), digest_size=16).digest(), "big")
+
+
+def shard_of(h, bits):
+    return h >> (128 - bits)
+
+
+class BloomFilter:
+    """
+    Bit array answering "definitely not added" / "maybe added".
+    Sized from capacity and false-positive rate; positions come from
+    double hashing the two 64-bit halves of id_hash().
+    """
+
+    def __init__(self, num_bits, num_hashes, data=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray(data) if data is not None else bytearray((num_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity, fp_rate=TRACKER_BLOOM_FP_RATE):
+        capacity = max(1, capacity)
+        num_bits = max(64, int(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return cls(num_bits, num_hashes)
+
+    def _positions(self, h):
+        h1 = h & 0xFFFFFFFFFFFFFFFF
+        h2 = (h >> 64) | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, h):
+        for pos in self._positions(h):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, h):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(h))
+
+
+# ------------------------------------------------------
+# SHARDS
+# ------------------------------------------------------
+
+def _shard_key(bits, idx):
+    return f"{STORE_PREFIX}shards/{bits}/{idx:0{bits // 4}x}.gz"
+
+
+def _read_shard(bits, idx):
+    return _read_shard_with_etag(bits, idx)[0]
+
+
+def _read_shard_with_etag(bits, idx):
+    body, etag = _read_object_with_etag(_shard_key(bits, idx))
+    if not body:
+        return set(), etag
+    return set(filter(None, gzip.decompress(body).decode("utf-8").split("\n"))), etag
+
+
+def _write_shard(bits, idx, ids, **condition):
+    payload = gzip.compress("\n".join(sorted(ids)).encode("utf-8"), compresslevel=6)
+    get_s3().put_object(Bucket=S3_BUCKET, Key=_shard_key(bits, idx), Body=payload, **condition)
+
+
+def _merge_shard(bits, idx, ids):
+    """
+    Add ids to a shard with a conditional write, merging again on top
+    of whatever another compaction wrote meanwhile. Returns the IDs
+    that were not in it yet.
+    """
+    while True:
+        current, etag = _read_shard_with_etag(bits, idx)
+        new = ids - current
+        if not new:
+            return new
+        try:
+            _write_shard(bits, idx, current | new, **_write_condition(etag))
+            return new
+        except ClientError as e:
+            if not is_conflict(e):
+                raise
+
+
+def _new_manifest():
+    return {"format": 2, "shard_bits": INITIAL_SHARD_BITS, "count": 0, "bloom": None}
+
+
+def _read_store():
+    """
+    (manifest, BloomFilter, manifest ETag) as last published, or
+    (None, empty filter, None) for a new store.
+    """
+    while True:
+        body, etag = _read_object_with_etag(MANIFEST_KEY)
+        if body is None:
+            return None, BloomFilter.for_capacity(BLOOM_MIN_CAPACITY), None
+
+        manifest = json.loads(body.decode("utf-8"))
+        bloom_info = manifest["bloom"]
+        data = _read_object(bloom_info["key"])
+        if data is not None:
+            return manifest, BloomFilter(bloom_info["bits"], bloom_info["hashes"], data), etag
+
+        # A compaction published a new manifest and deleted this filter
+        # between our two reads: read the new one
+        if _read_object_with_etag(MANIFEST_KEY)[1] == etag:
+            raise RuntimeError(f"Processed-ID Bloom filter {bloom_info['key']} is missing")
+
+
+def _publish(manifest, bloom, capacity, etag):
+    """
+    Write the Bloom filter under a new key, then the manifest pointing
+    at it, only if the manifest is still the version `etag` we merged
+    on top of. Raises the conflict ClientError otherwise.
+    """
+    bloom_key = f"{STORE_PREFIX}bloom-{uuid.uuid4().hex[:12]}.bin"
+    get_s3().put_object(Bucket=S3_BUCKET, Key=bloom_key, Body=bytes(bloom.bits))
+
+    manifest = dict(manifest, bloom={
+        "key": bloom_key,
+        "bits": bloom.num_bits,
+        "hashes": bloom.num_hashes,
+        "capacity": capacity,
+    })
+    try:
+        get_s3().put_object(
+            Bucket=S3_BUCKET,
+            Key=MANIFEST_KEY,
+            Body=json.dumps(manifest).encode("utf-8"),
+            **_write_condition(etag)
+        )
+    except ClientError:
+        _delete_keys([bloom_key])
+        raise
+    return manifest
+
+
+def _split_shards(pool, old_bits, new_bits):
+    """Rewrite every shard as 16 (or more) shards with a longer prefix."""
+    def split(idx):
+        children = {}
+        for file_id in _read_shard(old_bits, idx):
+            children.setdefault(shard_of(id_hash(file_id), new_bits), set()).add(file_id)
+        for child, ids in children.items():
+            _write_shard(new_bits, child, ids)
+
+    list(pool.map(split, range(1 << old_bits)))
+
+
+def _build_bloom(pool, bits, capacity):
+    """Bloom filter over every stored ID, one shard in memory per worker."""
+    bloom = BloomFilter.for_capacity(capacity)
+    lock = threading.Lock()
+
+    def add_shard(idx):
+        hashes = [id_hash(file_id) for file_id in _read_shard(bits, idx)]
+        with lock:
+            for h in hashes:
+                bloom.add(h)
+
+    list(pool.map(add_shard, range(1 << bits)))
+    return bloom
+
+
+class ProcessedTracker:
+    """
+    Processed-ID set backed by hash-sharded segments plus an append-only journal.
+
+    add() only buffers the ID; a segment holding the buffered IDs is
+    written every `flush_every` IDs or `flush_seconds` seconds, so a
+    run uploads O(new IDs) bytes instead of the whole set per match.
+    `file_id in tracker` is answered by the journal, then the Bloom
+    filter, and only then by reading the ID's shard.
+    Call close() at the end of a run (also on failure).
+    """
+
+    def __init__(
+        self,
+        flush_every=TRACKER_FLUSH_EVERY,
+        flush_seconds=TRACKER_FLUSH_SECONDS,
+        compact_segments=TRACKER_COMPACT_SEGMENTS,
+        shard_cache_ids=TRACKER_SHARD_CACHE_IDS
+    ):
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.compact_segments = compact_segments
+        self.shard_cache_ids = shard_cache_ids
+        self.manifest = _new_manifest()
+        self.bloom = BloomFilter.for_capacity(BLOOM_MIN_CAPACITY)
+        self.recent = set()             # IDs not yet folded into a shard
+        self._legacy = False
+        self._shards = OrderedDict()    # shard index → frozenset, LRU order
+        self._cached_ids = 0
+        self._pending = []
+        self._segments = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Read manifest, Bloom filter and journal (not the shards). Returns self."""
+        manifest, self.bloom, _ = _read_store()
+        if manifest is None:
+            # Nothing migrated yet: the old snapshot, if any, is folded in on compaction
+            legacy = _read_json_ids(MP_PROCESSED_TRACKER_KEY)
+            self.recent.update(legacy)
+            self._legacy = bool(legacy)
+            manifest = _new_manifest()
+        self.manifest = manifest
+
+        self._segments = _list_journal_segments()
+        for key in self._segments:
+            self.recent.update(_read_json_ids(key))
+        return self
+
+    def _shard(self, idx):
+        with self._lock:
+            ids = self._shards.get(idx)
+            if ids is not None:
+                self._shards.move_to_end(idx)
+                return ids
+
+        ids = frozenset(_read_shard(self.manifest["shard_bits"], idx))
+
+        with self._lock:
+            if idx not in self._shards:
+                self._shards[idx] = ids
+                self._cached_ids += len(ids)
+            # Evict least recently used shards, but keep the newest one
+            while self._cached_ids > self.shard_cache_ids and len(self._shards) > 1:
+                _, evicted = self._shards.popitem(last=False)
+                self._cached_ids -= len(evicted)
+        return ids
+
+    def __contains__(self, file_id):
+        if file_id in self.recent:
+            return True
+        h = id_hash(file_id)
+        if h not in self.bloom:
+            return False
+        return file_id in self._shard(shard_of(h, self.manifest["shard_bits"]))
+
+    def __len__(self):
+        """Stored IDs plus IDs not compacted yet (may count a few twice)."""
+        return self.manifest["count"] + len(self.recent)
+
+    def iter_ids(self):
+        """Every processed ID, reading one shard at a time."""
+        bits = self.manifest["shard_bits"]
+        seen_recent = set(self.recent)
+        yield from seen_recent
+        for idx in range(1 << bits):
+            for file_id in _read_shard(bits, idx):
+                if file_id not in seen_recent:
+                    yield file_id
+
+    def add(self, file_id):
+        with self._lock:
+            if file_id in self.recent:
+                return
+            self.recent.add(file_id)
+            self._pending.append(file_id)
+            due = (
+                len(self._pending) >= self.flush_every
+                or time.monotonic() - self._last_flush >= self.flush_seconds
+            )
+        if due:
+            self.flush()
+
+    def add_many(self, file_ids):
+        """add() for a batch; journaled as one segment right away."""
+        with self._lock:
+            for file_id in file_ids:
+                if file_id not in self.recent:
+                    self.recent.add(file_id)
+                    self._pending.append(file_id)
+        self.flush()
+
+    def flush(self):
+        """Write buffered IDs as one new journal segment."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+            if not pending:
+                return
+            key = f"{JOURNAL_PREFIX}{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}.json"
+            _write_json_ids(key, pending)
+            self._segments.append(key)
+
+    def compact(self):
+        """
+        Fold every segment this tracker knows about (and the old JSON
+        snapshot, if not migrated yet) into the shards, then delete
+        them. Segments written meanwhile by another run are left alone
+        and picked up by the next load().
+
+        Shards and the manifest are written with If-Match on the
+        version read, so two compactions at once (e.g. two finishing
+        coordinators) cannot drop each other's IDs: the loser merges
+        again on top of what the winner published.
+        """
+        self.flush()
+        with self._lock:
+            segments, self._segments = self._segments, []
+            new_ids = set(self.recent)
+            legacy = self._legacy
+
+        hashes = {file_id: id_hash(file_id) for file_id in new_ids}
+        added = set()
+
+        while True:
+            # Merge on top of the latest published store
+            manifest, bloom, manifest_etag = _read_store()
+            manifest = manifest or _new_manifest()
+            old_bloom_key = (manifest.get("bloom") or {}).get("key")
+            bits = manifest["shard_bits"]
+
+            by_shard = {}
+            for file_id, h in hashes.items():
+                by_shard.setdefault(shard_of(h, bits), set()).add(file_id)
+
+            with ThreadPoolExecutor(max_workers=COMPACT_WORKERS) as pool:
+                # IDs merged by an earlier attempt count as added then;
+                # a set, as a concurrent split may make us merge them twice
+                for new in pool.map(lambda item: _merge_shard(bits, *item), by_shard.items()):
+                    added |= new
+                count = manifest["count"] + len(added)
+
+                new_bits = bits
+                while count > (1 << new_bits) * TRACKER_SHARD_MAX_IDS:
+                    new_bits += SHARD_SPLIT_BITS
+                if new_bits != bits:
+                    print(f"🗂️ Splitting processed-ID shards: {1 << bits} → {1 << new_bits}")
+                    _split_shards(pool, bits, new_bits)
+
+                capacity = (manifest.get("bloom") or {}).get("capacity", BLOOM_MIN_CAPACITY)
+                if count > capacity:
+                    capacity = max(BLOOM_MIN_CAPACITY, 2 * count)
+                    bloom = _build_bloom(pool, new_bits, capacity)
+                else:
+                    for h in hashes.values():
+                        bloom.add(h)
+
+            try:
+                manifest = _publish(
+                    dict(manifest, shard_bits=new_bits, count=count),
+                    bloom, capacity, manifest_etag
+                )
+                break
+            except ClientError as e:
+                if not is_conflict(e):
+                    raise
+                print("🔁 Processed-ID store changed during compaction, merging again")
+
+        stale = list(segments)
+        if old_bloom_key:
+            stale.append(old_bloom_key)
+        if new_bits != bits:
+            stale.extend(_shard_key(bits, idx) for idx in range(1 << bits))
+        if legacy:
+            stale.append(MP_PROCESSED_TRACKER_KEY)
+        _delete_keys(stale)
+
+        with self._lock:
+            self.manifest = manifest
+            self.bloom = bloom
+            self.recent -= new_ids
+            self._legacy = False
+            if new_bits != bits:
+                self._shards.clear()
+                self._cached_ids = 0
+            else:
+                for idx, ids in by_shard.items():
+                    if idx in self._shards:
+                        merged = self._shards[idx] | ids
+                        self._cached_ids += len(merged) - len(self._shards[idx])
+                        self._shards[idx] = merged
+
+    def close(self):
+        """Flush the tail and compact once enough segments piled up."""
+        self.flush()
+        if self._legacy or len(self._segments) >= self.compact_segments:
+            self.compact()
+
+
+def load_processed_ids_from_s3():
+    """Every processed ID as a set (reads all shards; prefer ProcessedTracker)."""
+    return set(ProcessedTracker().load().iter_ids())
+
 def save_processed_ids_to_s3(id_set):
-    payload = json.dumps(list(id_set), ensure_ascii=False)
-    _s3.put_object(Bucket=S3_BUCKET, Key=MP_PROCESSED_TRACKER_KEY, Body=payload.encode('utf-8'))
+    """
+    Add id_set to the store (prefer ProcessedTracker.add).
+    IDs are only ever added: the store keeps IDs id_set lacks.
+    """
+    tracker = ProcessedTracker().load()
+    tracker.add_many(id_set)
+    tracker.close()
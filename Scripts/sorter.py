@@ -1,35 +1,69 @@
 # sorter.py
 # Phase 4 — ONLINE-ONLY photo sorting (Drive → Rekognition → Drive)
 
-import os
-import tempfile
-import boto3
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+import requests
+from botocore.exceptions import BotoCoreError, ClientError
 from tqdm import tqdm
-from .s3_tracker import load_processed_ids_from_s3, save_processed_ids_to_s3
+from googleapiclient.errors import HttpError
+from .s3_tracker import ProcessedTracker
+from .pipeline import Progress, Stage, run_pipeline
+from .drive_changes import UploadDiscovery, FOLDER_MIME
+from .checksum_index import ChecksumIndex, CLAIM_BUSY
+from .mastersheet import get_mastersheet_snapshot
+from .rekog_client import get_rekognition, classify_error
+from .folder_index import (
+    StudentFolderIndex,
+    find_folder_by_name,
+    folder_names_for_external_id,
+)
 
 
 from .config import (
     REKOG_COLLECTION,
-    AWS_REGION,
-    MASTERSHEET_ID,
-    VALIDATION_SHEET_NAME,
-    UPLOADED_DATA_SHEET,
     MIN_FACE_MATCH_CONFIDENCE,
+    SORT_DOWNLOAD_WORKERS,
+    SORT_SEARCH_WORKERS,
+    SORT_COPY_WORKERS,
+    SORT_QUEUE_SIZE,
+    SORT_MULTI_FACE,
+    MULTI_FACE_MIN_SIZE_PX,
+    MULTI_FACE_MIN_CONFIDENCE,
+    MULTI_FACE_MIN_SHARPNESS,
+    MULTI_FACE_MAX_FACES,
+    MULTI_FACE_SEARCH_WORKERS,
+    SORT_MAX_EDGE_PX,
+    SORT_JPEG_QUALITY,
+    SORT_PREP_PROCESSES,
+    SORT_USE_DRIVE_THUMBNAIL,
+    SORT_DISCOVERY_MODE,
+    SORT_DELIVERY_MODE,
+    MP_WORK_MANIFEST_PREFIX,
 )
 
-from .s3_face_map import read_face_map_from_s3
+from .s3_face_map import FaceMapStore
+from .reporting import ReportSink
+from .work_manifest import WorkManifest
+from .unmatched_files import UnmatchedFiles
+from .image_prep import crop_faces, prepare_for_rekognition
 from .gdrive_helpers import (
     get_drive_service,
-    get_sheets_service,
+    get_thread_drive_service,
     parse_drive_folder_link,
-    download_file_from_drive,
-    walk_drive_folder_recursive,
+    download_file_to_buffer,
+    get_thread_download_buffer,
+    download_drive_thumbnail,
+    execute_drive_batch,
+    walk_drive_folders,
+    TRANSPORT_ERRORS,
 )
 
 
-rekog = boto3.client("rekognition", region_name=AWS_REGION)
-
-
 # ------------------------------------------------------
 # FACE MAP
 # ------------------------------------------------------
@@ -37,12 +71,13 @@ rekog = boto3.client("rekognition", region_name=AWS_REGION)
 def load_face_map_dict():
     """
     Build FaceId → record mapping from S3.
+    Sort runs look faces up in FaceMapStore instead.
     """
-    raw = read_face_map_from_s3() or {}
-    face_map = {}
-    for _, row in raw.items():
-        face_map[row["FaceId"]] = row
-    return face_map
+    store = FaceMapStore().load()
+    try:
+        return {rec["FaceId"]: rec for rec in store.records()}
+    finally:
+        store.close()
 
 
 # ------------------------------------------------------
@@ -53,7 +88,7 @@ def detect_and_match_faces_bytes(image_bytes):
     """
     Send image bytes directly to Rekognition.
     """
-    resp = rekog.search_faces_by_image(
+    resp = get_rekognition().search_faces_by_image(
         CollectionId=REKOG_COLLECTION,
         Image={"Bytes": image_bytes},
         FaceMatchThreshold=MIN_FACE_MATCH_CONFIDENCE,
@@ -62,32 +97,102 @@ def detect_and_match_faces_bytes(image_bytes):
     return resp.get("FaceMatches", [])
 
 
+_crop_search_pool = None
+_crop_search_pool_lock = threading.Lock()
+
+
+def _get_crop_search_pool():
+    global _crop_search_pool
+    with _crop_search_pool_lock:
+        if _crop_search_pool is None:
+            _crop_search_pool = ThreadPoolExecutor(
+                max_workers=MULTI_FACE_SEARCH_WORKERS,
+                thread_name_prefix="face-search"
+            )
+        return _crop_search_pool
+
+
+def _is_searchable(face):
+    quality = face.get("Quality", {})
+    return (
+        face.get("Confidence", 0) >= MULTI_FACE_MIN_CONFIDENCE
+        and quality.get("Sharpness", 100) >= MULTI_FACE_MIN_SHARPNESS
+    )
+
+
+def detect_and_match_all_faces_bytes(image_bytes):
+    """
+    Multi-face matching for group photos.
+
+    search_faces_by_image only looks at the largest face, so instead:
+    one detect_faces call, a crop per usable face, and a concurrent
+    search per crop. Returns (faces_detected, matches) with matches
+    de-duplicated per FaceId (highest similarity wins). A photo with
+    faces but no usable crop falls back to the whole-image search, so
+    nothing it would have matched is lost.
+    """
+    faces = get_rekognition().detect_faces(
+        Image={"Bytes": image_bytes},
+        Attributes=["DEFAULT"]
+    ).get("FaceDetails", [])
+
+    usable = [f for f in faces if _is_searchable(f)]
+    usable.sort(
+        key=lambda f: f["BoundingBox"]["Width"] * f["BoundingBox"]["Height"],
+        reverse=True
+    )
+    usable = usable[:MULTI_FACE_MAX_FACES]
+
+    crops = crop_faces(
+        image_bytes,
+        [f["BoundingBox"] for f in usable],
+        min_size_px=MULTI_FACE_MIN_SIZE_PX
+    )
+
+    if not crops:
+        return len(faces), (detect_and_match_faces_bytes(image_bytes) if faces else [])
+
+    pool = _get_crop_search_pool()
+    futures = [pool.submit(detect_and_match_faces_bytes, crop) for _, crop in crops]
+
+    best = {}
+    for future in futures:
+        try:
+            crop_matches = future.result()
+        except ClientError as e:
+            # Rekognition found no face in the crop after all
+            if e.response["Error"]["Code"] == "InvalidParameterException":
+                continue
+            raise
+
+        for m in crop_matches:
+            face_id = m["Face"]["FaceId"]
+            if face_id not in best or m["Similarity"] > best[face_id]["Similarity"]:
+                best[face_id] = m
+
+    matches = sorted(best.values(), key=lambda m: m["Similarity"], reverse=True)
+    return len(faces), matches
+
+
 # ------------------------------------------------------
 # DRIVE HELPERS
 # ------------------------------------------------------
 
 def get_student_folder_id(service, external_id):
     """
-    Find student folder ID based on ExternalImageId.
-    Folder name format: SrNo-Name-Class-Section
-    """
-    folder_name = external_id.replace("_", "-")
+    Find student folder ID based on ExternalImageId by searching
+    all of Drive. Folder name format: SrNo-Name-Class-Section
 
-    query = (
-        f"name='{folder_name}' and "
-        f"mimeType='application/vnd.google-apps.folder' and "
-        f"trashed=false"
-    )
+    Sort runs use StudentFolderIndex instead; this is the uncached
+    lookup for one-off callers.
+    """
+    _, folder_name = folder_names_for_external_id(external_id)
+    if not folder_name:
+        return None
+    return find_folder_by_name(service, folder_name)
 
-    resp = service.files().list(
-        q=query,
-        fields="files(id)",
-        supportsAllDrives=True,
-        includeItemsFromAllDrives=True
-    ).execute()
 
-    files = resp.get("files", [])
-    return files[0]["id"] if files else None
+SHORTCUT_MIME = "application/vnd.google-apps.shortcut"
 
 
 def copy_drive_file(service, file_id, dest_folder_id):
@@ -98,140 +203,540 @@ def copy_drive_file(service, file_id, dest_folder_id):
     ).execute()
 
 
+def _delivery_request(service, file_id, name, folder_id, mode):
+    if mode == "shortcut":
+        return service.files().create(
+            body={
+                "name": name,
+                "mimeType": SHORTCUT_MIME,
+                "parents": [folder_id],
+                "shortcutDetails": {"targetId": file_id}
+            },
+            fields="id",
+            supportsAllDrives=True
+        )
+    return service.files().copy(
+        fileId=file_id,
+        body={"parents": [folder_id]},
+        fields="id",
+        supportsAllDrives=True
+    )
 
-# ------------------------------------------------------
-# MAIN SORTING LOGIC
-# ------------------------------------------------------
 
-def phase4_sort_uploads():
-    """
-    Reads Validation sheet folders, processes images,
-    matches faces, copies images into student folders,
-    and logs results in Uploaded Data sheet.
+def deliver_drive_file(service, file_id, name, dest_folder_id, mode=SORT_DELIVERY_MODE):
+    """Copy the file into dest_folder_id, or place a shortcut to it there."""
+    _delivery_request(service, file_id, name, dest_folder_id, mode).execute()
+
+
+def copy_drive_file_batch(service, file_id, dest_folder_ids, name=None, mode="copy"):
     """
+    Copy one file into many folders (or, with mode="shortcut", place a
+    shortcut named `name` in each) using Drive batch requests.
 
-    drive = get_drive_service()
-    sheets = get_sheets_service()
-    face_map = load_face_map_dict()
-    processed_ids = load_processed_ids_from_s3()
-    new_processed_ids = set(processed_ids)
+    dest_folder_ids: {key: folder_id}
+    Returns {key: HttpError or None}.
+    """
+    factories = {
+        key: (lambda folder_id=folder_id: _delivery_request(service, file_id, name, folder_id, mode))
+        for key, folder_id in dest_folder_ids.items()
+    }
 
+    results = execute_drive_batch(service, factories)
+    return {key: error for key, (_, error) in results.items()}
 
-    # -------------------------------
-    # Read Validation Sheet (Column A)
-    # -------------------------------
-    resp = sheets.spreadsheets().values().get(
-        spreadsheetId=MASTERSHEET_ID,
-        range=f"{VALIDATION_SHEET_NAME}!A:A"
-    ).execute()
 
-    values = resp.get("values", [])
 
-    # Skip header row
-    folder_links = [r[0] for r in values[1:] if r]
+# ------------------------------------------------------
+# PIPELINE STAGES
+# ------------------------------------------------------
+# Each file travels through the stages as a task dict. A stage that
+# fails sets task["error"]; later stages pass such tasks through
+# untouched so the main thread still sees (and counts) every file.
 
-    upload_folder_ids = []
-    for link in folder_links:
-        fid = parse_drive_folder_link(link)
-        if not fid:
-            print(f"⚠️ Skipping invalid folder entry: {link}")
+def iter_new_files(unit, tracker, unmatched, seen, seen_lock, discovery):
+    """
+    Expand one discovery unit into (root_id, file) per new image:
+    ("walk", [folder_id...]) walks the folders, ("files", [...])
+    passes through files the Changes API already reported, and
+    ("recheck", None) looks up files that matched nobody before the
+    face map last changed. Images that matched nobody against the
+    current face map are left out.
+    """
+    kind, payload = unit
+
+    if kind == "walk":
+        entries = walk_drive_folders(
+            payload,
+            discovery.extra_fields,
+            include_folders=True
+        )
+    elif kind == "recheck":
+        entries, gone = discovery.revisit(
+            get_thread_drive_service(),
+            unmatched.stale(discovery.root_ids)
+        )
+        for file_id in gone:
+            unmatched.discard(file_id)
+        if entries:
+            print(f"🔁 Face map changed: searching {len(entries)} unmatched file(s) again")
+    else:
+        entries = payload
+
+    for root_id, file in entries:
+        mime = file.get("mimeType", "")
+
+        if mime == FOLDER_MIME:
+            discovery.add_folder(file["id"], root_id)
             continue
-        upload_folder_ids.append(fid)
 
-    report_rows = []
+        # Skip Google Docs / Sheets / shortcuts
+        if mime.startswith("application/vnd.google-apps"):
+            continue
 
-    # -------------------------------
-    # Process each upload folder
-    # -------------------------------
-    for folder_id in upload_folder_ids:
-        files_iter = walk_drive_folder_recursive(drive, folder_id)
+        file_id = file["id"]
 
-        for file in tqdm(list(files_iter), desc="Processing uploads"):
-            mime = file.get("mimeType", "")
+        # Skip already processed images, and those that matched nobody
+        if file_id in tracker or file_id in unmatched:
+            continue
 
-            # Skip folders / Google Docs
-            if mime.startswith("application/vnd.google-apps"):
+        # Same file listed under two upload folders
+        with seen_lock:
+            if file_id in seen:
                 continue
+            seen.add(file_id)
+
+        discovery.add_discovered(file, root_id)
+        yield root_id, file
 
-            file_id = file["id"]
-            file_name = file["name"]
-            # Skip already processed images
-            if file_id in processed_ids:
-                continue
 
+def list_stage(unit, tracker, unmatched, manifest, seen, seen_lock, discovery, progress):
+    """
+    A task per new image of the unit (see iter_new_files). Files an
+    interrupted run got halfway through resume from the manifest.
+    """
+    for root_id, file in iter_new_files(unit, tracker, unmatched, seen, seen_lock, discovery):
+        task = manifest.start(file)
+        task["root"] = root_id
+        progress.incr("listed")
+        if task.get("resumed"):
+            progress.incr("resumed")
+        yield task
+
+
+def download_stage(task, checksum_index, manifest, halt):
+    # Searched by an earlier, interrupted run
+    if task.get("resumed"):
+        return task
+
+    md5 = task["file"].get("md5Checksum")
+
+    # Byte-identical to a photo searched before: reuse its result
+    if md5:
+        cached = checksum_index.claim(md5, stop_event=halt)
+        if cached is CLAIM_BUSY:
+            if not halt.is_set():
+                print(f"⏳ Identical photo still being searched, will retry next run: {task['file']['name']}")
+            task["error"] = "duplicate busy"
+            return task
+        if cached:
+            task["cached"] = True
+            task["faces_detected"] = cached["faces_detected"]
+            task["matches"] = cached["matches"]
+            return task
+        task["md5_owner"] = md5
+
+    try:
+        return _fetch_image(task, manifest)
+    except Exception:
+        # This error stops the run: wake duplicates waiting on our result
+        if md5:
+            checksum_index.release(md5)
+        raise
+
+
+def _fetch_image(task, manifest):
+    file_id = task["file"]["id"]
+    file_name = task["file"]["name"]
+    thumbnail_link = task["file"].get("thumbnailLink")
+
+    if SORT_USE_DRIVE_THUMBNAIL and thumbnail_link:
+        try:
+            buffer = download_drive_thumbnail(
+                thumbnail_link,
+                SORT_MAX_EDGE_PX,
+                get_thread_download_buffer()
+            )
+            task["img_bytes"] = buffer.getvalue()
+            manifest.fetched(file_id)
+            return task
+        except requests.RequestException as e:
+            print("⚠️ Thumbnail unavailable, downloading original:", file_name, e)
+
+    try:
+        buffer = download_file_to_buffer(
+            get_thread_drive_service(),
+            file_id,
+            get_thread_download_buffer()
+        )
+        task["img_bytes"] = buffer.getvalue()
+        manifest.fetched(file_id)
+
+    except HttpError as e:
+        print("❌ Failed to download:", file_name, e)
+        # A deleted file will never download; stop retrying it
+        task["error"] = "missing" if e.resp.status == 404 else "download failed"
+    except TRANSPORT_ERRORS as e:
+        # Connection still failing after retries: retried next run
+        print("❌ Failed to download:", file_name, e)
+        task["error"] = "download failed"
+
+    return task
+
+
+_prep_pool = None
+_prep_pool_lock = threading.Lock()
+
+
+def _get_prep_pool():
+    global _prep_pool
+    with _prep_pool_lock:
+        if _prep_pool is None:
+            # spawn, not fork: forking while pipeline threads hold locks can deadlock
+            _prep_pool = ProcessPoolExecutor(
+                max_workers=SORT_PREP_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _prep_pool
+
+
+def _reset_prep_pool():
+    global _prep_pool
+    with _prep_pool_lock:
+        if _prep_pool is not None:
+            _prep_pool.shutdown(wait=False)
+            _prep_pool = None
+
+
+def prepare_stage(task):
+    """
+    Downscale / re-encode the image for Rekognition (CPU-bound, so it
+    runs in a process pool). If Pillow cannot read the file the original
+    bytes go through and Rekognition gets the final say.
+    """
+    if task.get("error") or task.get("cached") or task.get("resumed"):
+        return task
 
-            # -------------------------------
-            # Temp download
-            # -------------------------------
-            with tempfile.NamedTemporaryFile(delete=False) as tmp:
-                tmp_path = tmp.name
+    args = (task["img_bytes"], SORT_MAX_EDGE_PX, SORT_JPEG_QUALITY)
 
+    try:
+        if SORT_PREP_PROCESSES > 0:
             try:
-                download_file_from_drive(drive, file_id, tmp_path)
+                task["img_bytes"] = _get_prep_pool().submit(prepare_for_rekognition, *args).result()
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM on a huge image): start a fresh pool next time
+                _reset_prep_pool()
+                task["img_bytes"] = prepare_for_rekognition(*args)
+        else:
+            task["img_bytes"] = prepare_for_rekognition(*args)
+    except Exception as e:
+        print(f"⚠️ Could not prepare image, sending original: {task['file']['name']}", e)
+
+    return task
+
+
+def search_stage(task, checksum_index, manifest, progress):
+    if task.get("resumed"):
+        return task
+    if task.get("cached"):
+        manifest.searched(task["file"]["id"], task["faces_detected"], task["matches"])
+        return task
+
+    md5 = task.get("md5_owner")
+
+    if not task.get("error"):
+        try:
+            img_bytes = task.pop("img_bytes")
+            if SORT_MULTI_FACE:
+                task["faces_detected"], task["matches"] = detect_and_match_all_faces_bytes(img_bytes)
+            else:
+                task["matches"] = detect_and_match_faces_bytes(img_bytes)
+                task["faces_detected"] = len(task["matches"])
+            progress.incr("searched")
+            manifest.searched(task["file"]["id"], task["faces_detected"], task["matches"])
+        except (ClientError, BotoCoreError) as e:
+            if classify_error(e) == "permanent":
+                print(f"⚠️ Unsupported or corrupted image: {task['file']['name']}")
+            else:
+                # Throttled / unavailable even after retries: not the image's fault
+                print(f"⚠️ Rekognition unavailable, will retry next run: {task['file']['name']} ({e})")
+            task["error"] = "search failed"
+        except Exception:
+            print(f"⚠️ Unsupported or corrupted image: {task['file']['name']}")
+            task["error"] = "search failed"
+
+    if md5:
+        if task.get("error"):
+            # Let a duplicate of this file try instead
+            checksum_index.release(md5)
+        else:
+            checksum_index.record(md5, task["faces_detected"], task["matches"])
+
+    return task
+
+
+def copy_stage(task, face_map, folder_index, manifest):
+    # Delivered by an earlier, interrupted run: only the report is left
+    if task.get("error") or task.get("resumed") == "delivered":
+        return task
+
+    drive = get_thread_drive_service()
+    file_id = task["file"]["id"]
+
+    matched_faceids = []
+    matched_external = []
+    # Folders an interrupted delivery already reached
+    copied_to = manifest.delivered_to(file_id)
+
+    destinations = {}
+
+    for m in task["matches"]:
+        face_id = m["Face"]["FaceId"]
+        matched_faceids.append(face_id)
+
+        rec = face_map.by_face_id(face_id)
+        if not rec:
+            continue
 
-                with open(tmp_path, "rb") as fh:
-                    img_bytes = fh.read()
+        external = rec["ExternalImageId"]
+        matched_external.append(external)
 
+        if external in copied_to:
+            continue
+        student_folder_id = folder_index.get(drive, external)
+        if student_folder_id:
+            destinations[external] = student_folder_id
+
+    errors = copy_drive_file_batch(drive, file_id, destinations, task["file"]["name"], SORT_DELIVERY_MODE)
+
+    for external, error in errors.items():
+        if isinstance(error, HttpError) and error.resp.status == 404:
+            # Indexed folder was deleted or moved: look it up again once
+            folder_index.invalidate(external)
+            student_folder_id = folder_index.get(drive, external)
+            if student_folder_id:
                 try:
-                    matches = detect_and_match_faces_bytes(img_bytes)
-                except Exception:
-                    print(f"⚠️ Unsupported or corrupted image: {file_name}")
-                    continue
-
-                matched_faceids = []
-                matched_external = []
-                copied_to = []
+                    deliver_drive_file(drive, file_id, task["file"]["name"], student_folder_id)
+                    error = None
+                except HttpError as e:
+                    error = e
+            errors[external] = error
+
+    for external in destinations:
+        if errors.get(external) is None:
+            copied_to.append(external)
+        else:
+            print(f"❌ Delivery ({SORT_DELIVERY_MODE}) failed: {task['file']['name']} → {external}:", errors[external])
+            # Not marked processed, so the file is retried next run
+            task["error"] = "copy failed"
+
+    if matched_faceids and not copied_to and not task.get("error"):
+        # Matched, but the face is not mapped or the student folder is
+        # missing: retried next run rather than recorded as unmatched
+        print(f"⚠️ No destination for {task['file']['name']} ({len(matched_faceids)} match(es))")
+        task["error"] = "no destination"
+
+    task["matched_faceids"] = matched_faceids
+    task["matched_external"] = matched_external
+    task["copied_to"] = copied_to
+
+    if task.get("error"):
+        manifest.partly_delivered(file_id, copied_to)
+    else:
+        manifest.delivered(file_id, matched_faceids, matched_external, copied_to)
+    return task
 
-                # -------------------------------
-                # Handle matches
-                # -------------------------------
-                for m in matches:
-                    face_id = m["Face"]["FaceId"]
-                    matched_faceids.append(face_id)
 
-                    rec = face_map.get(face_id)
-                    if not rec:
-                        continue
+# ------------------------------------------------------
+# MAIN SORTING LOGIC
+# ------------------------------------------------------
 
-                    external = rec["ExternalImageId"]
-                    matched_external.append(external)
+def plan_uploads():
+    """
+    UploadDiscovery over the Validation sheet's upload folders, and the
+    discovery units a run works through (see iter_new_files).
+    """
+    # -------------------------------
+    # Read Validation Sheet (Column A)
+    # -------------------------------
+    folder_links = get_mastersheet_snapshot().validation_links
 
-                    student_folder_id = get_student_folder_id(drive, external)
-                    if not student_folder_id:
-                        continue
+    upload_folder_ids = []
+    for link in folder_links:
+        fid = parse_drive_folder_link(link)
+        if not fid:
+            print(f"⚠️ Skipping invalid folder entry: {link}")
+            continue
+        upload_folder_ids.append(fid)
 
-                    copy_drive_file(drive, file_id, student_folder_id)
-                    copied_to.append(external)
+    extra_fields = ("md5Checksum", "size")
+    if SORT_USE_DRIVE_THUMBNAIL:
+        extra_fields += ("thumbnailLink",)
+    discovery = UploadDiscovery(upload_folder_ids, extra_fields)
+
+    if SORT_DISCOVERY_MODE == "changes":
+        units = discovery.load().plan(get_drive_service())
+        # Walks list unmatched files anyway; otherwise look them up
+        units.append(("recheck", None))
+    else:
+        units = [("walk", discovery.root_ids)]
+    return discovery, units
+
+
+def sort_units(
+    units,
+    discovery,
+    stop_event=None,
+    progress=None,
+    manifest_prefix=MP_WORK_MANIFEST_PREFIX,
+    shared=False
+):
+    """
+    Run the staged pipeline over discovery units. Returns True once
+    every file went through, False if the run was cancelled.
 
-                    from datetime import datetime
+    shared: this is one worker of a distributed run (cluster.py);
+    report rows spooled by earlier runs and tracker / unmatched-file
+    compaction are left to the coordinator.
+    """
+    progress = progress or Progress()
+
+    report = ReportSink() if shared else ReportSink().load()
+    face_map = FaceMapStore().load()
+    tracker = ProcessedTracker().load()
+    folder_index = StudentFolderIndex().load(get_drive_service())
+    checksum_index = ChecksumIndex(revision=face_map.revision()).load()
+    unmatched = UnmatchedFiles(revision=face_map.revision()).load()
+    manifest = WorkManifest(revision=face_map.revision(), prefix=manifest_prefix).load()
+
+    seen = set()
+    seen_lock = threading.Lock()
+    # Set when the pipeline stops (cancel or failure): duplicates stop waiting
+    halt = threading.Event()
+
+    stages = [
+        Stage(
+            "list",
+            lambda unit: list_stage(unit, tracker, unmatched, manifest, seen, seen_lock, discovery, progress),
+            workers=len(units) or 1,
+            expand=True
+        ),
+        Stage(
+            "download",
+            lambda task: download_stage(task, checksum_index, manifest, halt),
+            workers=SORT_DOWNLOAD_WORKERS
+        ),
+        Stage("prepare", prepare_stage, workers=max(1, SORT_PREP_PROCESSES)),
+        Stage(
+            "search",
+            lambda task: search_stage(task, checksum_index, manifest, progress),
+            workers=SORT_SEARCH_WORKERS
+        ),
+        Stage(
+            "copy",
+            lambda task: copy_stage(task, face_map, folder_index, manifest),
+            workers=SORT_COPY_WORKERS
+        ),
+    ]
+
+    results = run_pipeline(
+        units, stages,
+        queue_size=SORT_QUEUE_SIZE,
+        stop_event=stop_event,
+        halt_event=halt
+    )
 
-                    report_rows.append([
-                        datetime.now().isoformat(),          # Timestamp
-                        file_name,                           # File Name
-                        len(matches),                        # Faces Detected
-                    
-                        "\n".join(matched_faceids),          # Face IDs Matched (new line)
-                        "\n".join(matched_external),         # External Face IDs (new line)
-                        "\n".join(copied_to),                # Copied to Folders (new line)
-                    ])
-                    new_processed_ids.add(file_id)
-                    save_processed_ids_to_s3(new_processed_ids)
+    def finish(file_id):
+        # Report row written: only now is the file done for good
+        tracker.add(file_id)
+        unmatched.discard(file_id)
+        manifest.reported(file_id)
+
+    completed = False
+    try:
+        for task in tqdm(results, desc="Processing uploads", unit="file"):
+            progress.incr("done")
+            file_id = task["file"]["id"]
+
+            if task.get("error") == "missing":
+                discovery.mark_done(file_id)
+                unmatched.discard(file_id)
+                manifest.forget(file_id)
+
+            if task.get("error"):
+                progress.incr("failed")
+                continue
+            if not task["copied_to"]:
+                # Matched nobody: not searched again until the face map changes
+                unmatched.add(file_id, task["root"])
+                discovery.mark_done(file_id)
+                manifest.reported(file_id)
+                progress.incr("unmatched")
+                continue
 
+            report.add([
+                datetime.now().isoformat(),                 # Timestamp
+                task["file"]["name"],                       # File Name
+                task["faces_detected"],                     # Faces Detected
+                "\n".join(task["matched_faceids"]),         # Face IDs Matched (new line)
+                "\n".join(task["matched_external"]),        # External Face IDs (new line)
+                "\n".join(task["copied_to"]),               # Copied to Folders (new line)
+                SORT_DELIVERY_MODE,                         # Delivery Mode (copy / shortcut)
+            ], on_written=lambda file_id=file_id: finish(file_id))
+            discovery.mark_done(file_id)
+            progress.incr("copied")
+
+        if stop_event is not None and stop_event.is_set():
+            print("🛑 Sorting cancelled")
+        else:
+            completed = True
+    finally:
+        # Report rows first (to the sheet, or to S3 for the next run),
+        # then persist the journal tail even if the run dies midway
+        report.close()
+        if shared:
+            tracker.flush()
+            unmatched.flush()
+        else:
+            unmatched.close(tracker)
+            tracker.close()
+        manifest.close(completed)
+        folder_index.save()
+        checksum_index.save()
+        face_map.close()
+
+    return completed
+
+
+def phase4_sort_uploads(stop_event=None, progress=None):
+    """
+    Reads Validation sheet folders, processes images,
+    matches faces, copies images into student folders,
+    and logs results in Uploaded Data sheet
+    (buffered through ReportSink, flushed as the run goes).
 
+    Files flow through a staged pipeline
+    (list → download → prepare → search → copy) with SORT_*_WORKERS
+    threads per stage; setting every worker count to 1
+    gives the plain sequential behaviour.
 
+    stop_event: set it to cancel the run; finished files are still
+    recorded, the rest are picked up next run.
+    progress: Progress to count listed / searched / copied / failed files.
+    """
+    discovery, units = plan_uploads()
 
-            finally:
-                if os.path.exists(tmp_path):
-                    os.remove(tmp_path)
+    completed = sort_units(units, discovery, stop_event=stop_event, progress=progress)
 
-    # -------------------------------
-    # Write report to Uploaded Data
-    # -------------------------------
-    if report_rows:
-        sheets.spreadsheets().values().append(
-            spreadsheetId=MASTERSHEET_ID,
-            range=f"{UPLOADED_DATA_SHEET}!A1",
-            valueInputOption="USER_ENTERED",
-            insertDataOption="INSERT_ROWS",
-            body={"values": report_rows},
-        ).execute()
+    # A cancelled run keeps the old changes token so the rest is found again
+    if completed and SORT_DISCOVERY_MODE == "changes":
+        discovery.save()
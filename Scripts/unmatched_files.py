@@ -0,0 +1,205 @@
+# unmatched_files.py
+# Uploads that matched nobody, persisted in S3 so sort runs skip them
+# until the face map changes.
+#
+# A photo of nobody enrolled (a teacher, a crowd, a blurry shot) must
+# not be searched on every run, but it has to be searched again once
+# an indexing run changes the face map: the student may have been
+# added since. Each entry remembers the face map revision the file was
+# searched against:
+#   file ID → [revision, upload root ID, day first unmatched]
+#
+# Layout (<prefix> is MP_UNMATCHED_PREFIX):
+#   <prefix>files.json                 entries as of the last compaction
+#   <prefix>journal/<ts>-<n>.json      additions / removals since
+#
+# Entries unmatched for more than UNMATCHED_RETRY_DAYS are retired into
+# ProcessedTracker (they are not retried any more), so the store only
+# holds the uploads of that window.
+
+import json
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+from .config import (
+    S3_BUCKET,
+    MP_UNMATCHED_PREFIX,
+    UNMATCHED_RETRY_DAYS,
+    TRACKER_FLUSH_EVERY,
+    TRACKER_FLUSH_SECONDS,
+    TRACKER_COMPACT_SEGMENTS,
+)
+from .clients import get_s3
+
+
+SNAPSHOT_KEY = MP_UNMATCHED_PREFIX + "files.json"
+JOURNAL_PREFIX = MP_UNMATCHED_PREFIX + "journal/"
+
+
+def _read_json(key):
+    try:
+        resp = get_s3().get_object(Bucket=S3_BUCKET, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return json.loads(resp["Body"].read().decode("utf-8"))
+
+
+def _list_journal_segments():
+    paginator = get_s3().get_paginator("list_objects_v2")
+    keys = []
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=JOURNAL_PREFIX):
+        keys.extend(obj["Key"] for obj in page.get("Contents", []))
+    return sorted(keys)
+
+
+def _today():
+    return int(time.time() // 86400)
+
+
+class UnmatchedFiles:
+    """
+    file ID → [revision, root ID, day] of uploads that matched nobody.
+
+    `file_id in store` is True while the file was searched against
+    `revision` (the current FaceMapStore.revision()); stale() lists the
+    ones searched against an older face map. add() / discard() are
+    journaled every `flush_every` changes / `flush_seconds` seconds.
+    close() retires old entries and compacts; like ProcessedTracker,
+    workers sharing a run only flush() and leave close() to the
+    coordinator. Thread-safe.
+    """
+
+    def __init__(
+        self,
+        revision,
+        retry_days=UNMATCHED_RETRY_DAYS,
+        flush_every=TRACKER_FLUSH_EVERY,
+        flush_seconds=TRACKER_FLUSH_SECONDS,
+        compact_segments=TRACKER_COMPACT_SEGMENTS
+    ):
+        self.revision = revision
+        self.retry_days = retry_days
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.compact_segments = compact_segments
+        self.entries = {}
+        self._pending = []
+        self._segments = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    # ---------- persistence ----------
+
+    def load(self):
+        """Read the snapshot and replay the journal. Returns self."""
+        self.entries = (_read_json(SNAPSHOT_KEY) or {}).get("entries", {})
+        self._segments = _list_journal_segments()
+        for key in self._segments:
+            for file_id, entry in _read_json(key) or []:
+                self._apply(file_id, entry)
+        return self
+
+    def _apply(self, file_id, entry):
+        if entry is None:
+            self.entries.pop(file_id, None)
+        else:
+            self.entries[file_id] = entry
+
+    def _record(self, file_id, entry):
+        with self._lock:
+            self._apply(file_id, entry)
+            self._pending.append([file_id, entry])
+            due = (
+                len(self._pending) >= self.flush_every
+                or time.monotonic() - self._last_flush >= self.flush_seconds
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write buffered changes as one journal segment."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+            if not pending:
+                return
+            key = f"{JOURNAL_PREFIX}{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}.json"
+            get_s3().put_object(Bucket=S3_BUCKET, Key=key, Body=json.dumps(pending).encode("utf-8"))
+            self._segments.append(key)
+
+    def close(self, tracker=None):
+        """
+        Retire entries older than retry_days (into `tracker`, so walks
+        skip them too), then flush, and compact once enough segments
+        piled up or something was retired.
+        """
+        retired = []
+        if tracker is not None:
+            oldest = _today() - self.retry_days
+            with self._lock:
+                retired = [fid for fid, (_, _, day) in self.entries.items() if day < oldest]
+            for file_id in retired:
+                tracker.add(file_id)
+                self._record(file_id, None)
+            if retired:
+                print(f"🗃️ {len(retired)} file(s) unmatched for {self.retry_days}+ days, not retried any more")
+
+        self.flush()
+        if retired or len(self._segments) >= self.compact_segments:
+            self.compact()
+
+    def compact(self):
+        """Fold the journal into the snapshot and delete its segments."""
+        self.flush()
+        with self._lock:
+            payload = json.dumps({"entries": self.entries}, separators=(",", ":"))
+            segments, self._segments = self._segments, []
+
+        get_s3().put_object(Bucket=S3_BUCKET, Key=SNAPSHOT_KEY, Body=payload.encode("utf-8"))
+        for i in range(0, len(segments), 1000):
+            get_s3().delete_objects(
+                Bucket=S3_BUCKET,
+                Delete={"Objects": [{"Key": k} for k in segments[i:i + 1000]], "Quiet": True}
+            )
+
+    # ---------- lookups / changes ----------
+
+    def __contains__(self, file_id):
+        """Matched nobody against the current face map: nothing to do."""
+        with self._lock:
+            entry = self.entries.get(file_id)
+        return entry is not None and entry[0] == self.revision
+
+    def __len__(self):
+        with self._lock:
+            return len(self.entries)
+
+    def stale(self, root_ids):
+        """(file ID, root ID) of entries under root_ids searched against an older face map."""
+        root_ids = set(root_ids)
+        with self._lock:
+            return [
+                (file_id, root_id)
+                for file_id, (revision, root_id, _) in self.entries.items()
+                if revision != self.revision and root_id in root_ids
+            ]
+
+    def add(self, file_id, root_id):
+        """The file matched nobody against the current face map."""
+        with self._lock:
+            entry = self.entries.get(file_id)
+        # Age counts from the first time it matched nobody
+        day = entry[2] if entry else _today()
+        self._record(file_id, [self.revision, root_id, day])
+
+    def discard(self, file_id):
+        """The file matched someone after all, or is gone."""
+        with self._lock:
+            present = file_id in self.entries
+        if present:
+            self._record(file_id, None)
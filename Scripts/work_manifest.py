@@ -0,0 +1,277 @@
+# work_manifest.py
+# Per-file progress of sort runs, persisted in S3 so a run that dies
+# halfway (OOM, deploy, timeout) is resumed instead of redone.
+#
+# Each new upload moves through:
+#   discovered  listed as not processed yet
+#   fetched     image downloaded (bytes are not kept: a file that
+#               stopped here is downloaded again)
+#   searched    Rekognition result known, plus the student folders it
+#               already reached if delivery was cut short
+#   delivered   in every matched student folder
+#   reported    row in Uploaded Data (or the photo matched nobody)
+#
+# Layout (<prefix> is MP_WORK_MANIFEST_PREFIX):
+#   <prefix>manifest.json               entries as of the last close()
+#   <prefix>journal/<ts>-<n>.json       transitions since, per run
+#
+# A resumed file skips every stage it finished: no second download or
+# Rekognition search once it is "searched", no second copy once
+# "delivered". Reported files are dropped from the manifest once the
+# run closes: delivered ones live on in ProcessedTracker, unmatched
+# ones in UnmatchedFiles.
+
+import json
+import time
+import uuid
+import threading
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+from .config import (
+    S3_BUCKET,
+    MP_WORK_MANIFEST_PREFIX,
+    WORK_MANIFEST_FLUSH_EVERY,
+    WORK_MANIFEST_FLUSH_SECONDS,
+)
+from .clients import get_s3
+
+
+STATES = ("discovered", "fetched", "searched", "delivered", "reported")
+
+def _read_json(key):
+    try:
+        resp = get_s3().get_object(Bucket=S3_BUCKET, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return json.loads(resp["Body"].read().decode("utf-8"))
+
+
+def _list_journal_segments(journal_prefix):
+    paginator = get_s3().get_paginator("list_objects_v2")
+    keys = []
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=journal_prefix):
+        keys.extend(obj["Key"] for obj in page.get("Contents", []))
+    return sorted(keys)
+
+
+def write_snapshot(prefix, entries, run_id, completed=False):
+    """Manifest snapshot at `prefix` (seeds a unit of a distributed run)."""
+    body = json.dumps(
+        {"run_id": run_id, "completed": completed, "entries": entries},
+        separators=(",", ":")
+    )
+    get_s3().put_object(Bucket=S3_BUCKET, Key=prefix + "manifest.json", Body=body.encode("utf-8"))
+
+
+def _slim_matches(matches):
+    # Only what the copy stage reads
+    return [
+        {"Face": {"FaceId": m["Face"]["FaceId"]}, "Similarity": m["Similarity"]}
+        for m in matches
+    ]
+
+
+class WorkManifest:
+    """
+    file ID → {"state", "name", "revision", ...stage results}.
+
+    Transitions update the entry in memory and are written as journal
+    segments every `flush_every` transitions / `flush_seconds` seconds;
+    close() folds them into the snapshot. Search results are only
+    reused while the face map is at the revision they were searched
+    against (FaceMapStore.revision(), as ChecksumIndex). Thread-safe.
+    Call close() at the end of a run (also on failure).
+
+    prefix: where the manifest lives (each unit of a distributed run
+    has its own, see cluster.py).
+    """
+
+    def __init__(
+        self,
+        revision,
+        prefix=MP_WORK_MANIFEST_PREFIX,
+        flush_every=WORK_MANIFEST_FLUSH_EVERY,
+        flush_seconds=WORK_MANIFEST_FLUSH_SECONDS
+    ):
+        self.revision = revision
+        self.prefix = prefix
+        self.snapshot_key = prefix + "manifest.json"
+        self.journal_prefix = prefix + "journal/"
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.entries = {}
+        self.run_id = uuid.uuid4().hex[:8]
+        self.resumed = False
+        self._seen = set()
+        self._pending = []
+        self._segments = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    # ---------- persistence ----------
+
+    def load(self):
+        """Read the snapshot and replay the journal. Returns self."""
+        snapshot = _read_json(self.snapshot_key) or {}
+        self.entries = snapshot.get("entries", {})
+
+        self._segments = _list_journal_segments(self.journal_prefix)
+        run_id = None
+        for key in self._segments:
+            segment = _read_json(key) or {}
+            run_id = segment.get("run_id", run_id)
+            for file_id, changes in segment.get("changes", []):
+                self._apply(file_id, changes)
+
+        # Journal left behind, or the last run closed without finishing
+        if run_id or snapshot.get("completed") is False:
+            self.resumed = True
+            self.run_id = run_id or snapshot.get("run_id") or self.run_id
+            counts = Counter(e["state"] for e in self.entries.values())
+            print(
+                f"↩️ Resuming sort run {self.run_id}: "
+                + ", ".join(f"{counts[s]} {s}" for s in STATES if counts[s])
+            )
+        return self
+
+    def _apply(self, file_id, changes):
+        if changes is None:
+            self.entries.pop(file_id, None)
+        elif changes.get("state") == "discovered":
+            # Starting over: earlier results are stale, but folders the
+            # file already reached must not get a second copy
+            delivered_to = self.entries.get(file_id, {}).get("delivered_to")
+            self.entries[file_id] = dict(changes)
+            if delivered_to:
+                self.entries[file_id]["delivered_to"] = delivered_to
+        else:
+            self.entries.setdefault(file_id, {}).update(changes)
+
+    def _record(self, file_id, changes):
+        with self._lock:
+            self._apply(file_id, changes)
+            self._pending.append([file_id, changes])
+            due = (
+                len(self._pending) >= self.flush_every
+                or time.monotonic() - self._last_flush >= self.flush_seconds
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write buffered transitions as one journal segment."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+            if not pending:
+                return
+            key = f"{self.journal_prefix}{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}.json"
+            body = json.dumps({"run_id": self.run_id, "changes": pending}, separators=(",", ":"))
+            get_s3().put_object(Bucket=S3_BUCKET, Key=key, Body=body.encode("utf-8"))
+            self._segments.append(key)
+
+    def close(self, completed=False):
+        """
+        Fold the journal into the snapshot. After a completed run only
+        entries this run listed are kept (the rest were processed or
+        deleted elsewhere); otherwise everything is kept for the resume.
+        """
+        self.flush()
+        with self._lock:
+            entries = {}
+            for file_id, entry in self.entries.items():
+                if entry["state"] == "reported":
+                    continue    # ProcessedTracker / UnmatchedFiles has it now
+                if completed and file_id not in self._seen:
+                    continue
+                entries[file_id] = entry
+            segments, self._segments = self._segments, []
+
+        write_snapshot(self.prefix, entries, self.run_id, completed)
+
+        for i in range(0, len(segments), 1000):
+            get_s3().delete_objects(
+                Bucket=S3_BUCKET,
+                Delete={"Objects": [{"Key": k} for k in segments[i:i + 1000]], "Quiet": True}
+            )
+
+    # ---------- transitions ----------
+
+    def start(self, file):
+        """
+        Task dict for a listed file. A resumed task carries the results
+        of the stages it finished and task["resumed"] = the last
+        finished state.
+        """
+        file_id = file["id"]
+        with self._lock:
+            self._seen.add(file_id)
+            entry = dict(self.entries.get(file_id, {}))
+
+        state = entry.get("state")
+        current = entry.get("revision") == self.revision
+        task = {"file": file}
+
+        if state == "delivered" or (state == "searched" and current):
+            task["resumed"] = state
+            task["faces_detected"] = entry["faces_detected"]
+            task["matches"] = entry["matches"]
+            if state == "delivered":
+                task["matched_faceids"] = entry["matched_faceids"]
+                task["matched_external"] = entry["matched_external"]
+                task["copied_to"] = entry["copied_to"]
+            return task
+
+        self._record(file_id, {"state": "discovered", "name": file.get("name", "")})
+        return task
+
+    def absorb(self, file_ids, entries):
+        """
+        Take over what another manifest (a unit of a distributed run)
+        knows about file_ids: its entry, or nothing if it dropped the file.
+        """
+        with self._lock:
+            self._seen.update(file_ids)
+        for file_id in file_ids:
+            self._record(file_id, None)
+            if file_id in entries:
+                self._record(file_id, entries[file_id])
+
+    def delivered_to(self, file_id):
+        """Student folders (external IDs) the file already reached."""
+        with self._lock:
+            return list(self.entries.get(file_id, {}).get("delivered_to", []))
+
+    def fetched(self, file_id):
+        self._record(file_id, {"state": "fetched"})
+
+    def searched(self, file_id, faces_detected, matches):
+        self._record(file_id, {
+            "state": "searched",
+            "revision": self.revision,
+            "faces_detected": faces_detected,
+            "matches": _slim_matches(matches),
+        })
+
+    def partly_delivered(self, file_id, delivered_to):
+        """Delivery stopped short: remember which folders already have it."""
+        self._record(file_id, {"delivered_to": list(delivered_to)})
+
+    def delivered(self, file_id, matched_faceids, matched_external, copied_to):
+        self._record(file_id, {
+            "state": "delivered",
+            "matched_faceids": list(matched_faceids),
+            "matched_external": list(matched_external),
+            "copied_to": list(copied_to),
+        })
+
+    def reported(self, file_id):
+        self._record(file_id, {"state": "reported"})
+
+    def forget(self, file_id):
+        """The file is gone (e.g. deleted from Drive)."""
+        self._record(file_id, None)
@@ -1,23 +1,33 @@
-from flask import Flask, jsonify
-import threading
-import traceback
+
+from flask import Flask, Response, jsonify
+
+from Scripts import metrics
+from Scripts.jobs import JobManager, JobQueueFull
 
 app = Flask(__name__)
 
-def run_pipeline():
-    print("🚀 PIPELINE STARTED")
 
-    try:
-        from Scripts.cli import download_and_process_uploads
-        print("📦 Imported pipeline function")
+def run_sort(stop_event, progress):
+    from Scripts.cli import download_and_process_uploads
+    download_and_process_uploads(stop_event=stop_event, progress=progress)
+
+
+def run_index(stop_event, progress):
+    from Scripts.cli import run_full_indexing
+    run_full_indexing(stop_event=stop_event, progress=progress)
+
+
+jobs = JobManager({"sort": run_sort, "index": run_index})
 
-        result = download_and_process_uploads()
-        print("✅ PIPELINE FINISHED")
-        print("RESULT:", result)
 
-    except Exception as e:
-        print("❌ PIPELINE ERROR")
-        traceback.print_exc()
+def start_job(kind):
+    try:
+        job, created = jobs.submit(kind)
+    except JobQueueFull as e:
+        return jsonify({"status": "busy", "error": str(e)}), 503
+
+    status = "started" if created else "already running"
+    return jsonify({"status": status, "job_id": job.id, "job": job.to_dict()}), 202 if created else 200
 
 @app.route("/", methods=["GET"])
 def home():
@@ -26,8 +36,36 @@ def home():
 @app.route("/run", methods=["POST"])
 def run():
     print("🔥 /run triggered")
-    threading.Thread(target=run_pipeline).start()
-    return jsonify({"status": "started"}), 200
+    return start_job("sort")
+
+@app.route("/run/<kind>", methods=["POST"])
+def run_kind(kind):
+    if kind not in jobs.runners:
+        return jsonify({"error": f"unknown pipeline: {kind}"}), 404
+    print(f"🔥 /run/{kind} triggered")
+    return start_job(kind)
+
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    return jsonify([job.to_dict() for job in jobs.list()]), 200
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job.to_dict()), 202
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     import os
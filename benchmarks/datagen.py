@@ -0,0 +1,145 @@
+# datagen.py
+# Synthetic school for the benchmarks: Mastersheet + Validation rows,
+# refs/ photos, an indexed collection and face map, the Output_Folders
+# tree and upload folders full of photos, all written into the fakes.
+
+import hashlib
+import io
+import random
+
+from PIL import Image, ImageDraw
+
+from Scripts.config import (
+    MASTERSHEET_ID,
+    MASTERSHEET_NAME,
+    VALIDATION_SHEET_NAME,
+    PROJECT_ROOT_FOLDER_ID,
+    OUTPUT_ROOT_FOLDER_ID,
+    REKOG_COLLECTION,
+)
+from Scripts.mastersheet import StudentRecord
+from Scripts.s3_face_map import write_face_map_to_s3
+
+SPREADSHEET_MIME = "application/vnd.google-apps.spreadsheet"
+
+MASTERSHEET_HEADER = ["SrNo", "Name", "Class", "Section", "Photo", "FaceID", "ExternalFaceID"]
+
+# Photos share a few encoded templates; each file still gets its own md5
+PHOTO_TEMPLATES = 4
+
+
+def make_jpeg(width, height, seed):
+    """A noisy JPEG of roughly camera-photo entropy."""
+    rng = random.Random(seed)
+    img = Image.effect_noise((width, height), 64).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randrange(20, max(21, width // 6))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(256) for _ in range(3)))
+
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def make_students(n, classes=10, sections=2):
+    return [
+        StudentRecord(
+            row_number=i + 2,
+            srno=str(i + 1),
+            name=f"Student {i + 1}",
+            class_name=str(i % classes + 1),
+            section="AB"[:sections][(i // classes) % sections],
+            photo_link="",
+            face_id="",
+            external_id="",
+        )
+        for i in range(n)
+    ]
+
+
+def write_mastersheet(drive_store, sheet_store, students, upload_folder_ids=()):
+    drive_store.add("Mastersheet", [PROJECT_ROOT_FOLDER_ID], SPREADSHEET_MIME, file_id=MASTERSHEET_ID)
+
+    sheet_store.sheets[MASTERSHEET_NAME] = [MASTERSHEET_HEADER] + [
+        [s.srno, s.name, s.class_name, s.section, s.photo_link, s.face_id, s.external_id]
+        for s in students
+    ]
+    sheet_store.sheets[VALIDATION_SHEET_NAME] = [["Folder Link"]] + [
+        [f"https://drive.google.com/drive/folders/{fid}"] for fid in upload_folder_ids
+    ]
+
+
+def write_refs(s3, students, photo):
+    for s in students:
+        s3.objects[f"refs/{s.folder_name}.jpg"] = photo
+
+
+def write_index(s3, rekognition, students):
+    """Collection + face map as a finished Phase 2 leaves them."""
+    records = []
+    for s in students:
+        face = rekognition.add_face(REKOG_COLLECTION, s.expected_external_id)
+        records.append({
+            "ExternalImageId": s.expected_external_id,
+            "FaceId": face["FaceId"],
+            "S3Key": f"refs/{s.folder_name}.jpg",
+            "FileName": f"{s.folder_name}.jpg",
+        })
+
+    # The bucket behind the fake is a dict; write through the real helper
+    write_face_map_to_s3(records)
+    return records
+
+
+def write_output_root(drive_store):
+    drive_store.add_folder("Project Folders", file_id=PROJECT_ROOT_FOLDER_ID)
+    drive_store.add_folder("Output_Folders", PROJECT_ROOT_FOLDER_ID, file_id=OUTPUT_ROOT_FOLDER_ID)
+
+
+def write_output_tree(drive_store, students, share=1.0, seed=0):
+    """Class-Section / student folders for `share` of the students."""
+    rng = random.Random(seed)
+    class_ids = {}
+    for s in students:
+        if rng.random() >= share:
+            continue
+        if s.class_section not in class_ids:
+            class_ids[s.class_section] = drive_store.add_folder(s.class_section, OUTPUT_ROOT_FOLDER_ID)["id"]
+        drive_store.add_folder(s.folder_name, class_ids[s.class_section])
+
+
+def write_uploads(drive_store, folders, subfolders, photos, photo_px, duplicate_rate=0.0, seed=0):
+    """
+    `photos` JPEGs spread over `folders` upload folders with
+    `subfolders` sub-folders each. duplicate_rate of the files are
+    byte-identical re-uploads of an earlier one (same md5).
+    Returns the upload folder IDs for the Validation sheet.
+    """
+    rng = random.Random(seed)
+    width, height = photo_px, photo_px * 3 // 4
+    templates = [make_jpeg(width, height, seed + i) for i in range(PHOTO_TEMPLATES)]
+
+    uploads = drive_store.add_folder("Uploads", PROJECT_ROOT_FOLDER_ID)["id"]
+    root_ids = []
+    targets = []
+    for f in range(folders):
+        root_id = drive_store.add_folder(f"Upload {f + 1}", uploads)["id"]
+        root_ids.append(root_id)
+        targets.append(root_id)
+        for s in range(subfolders):
+            targets.append(drive_store.add_folder(f"Event {s + 1}", root_id)["id"])
+
+    earlier = []
+    for i in range(photos):
+        if earlier and rng.random() < duplicate_rate:
+            content, md5 = rng.choice(earlier)
+        else:
+            content = templates[i % PHOTO_TEMPLATES]
+            md5 = hashlib.md5(f"photo-{seed}-{i}".encode()).hexdigest()
+            earlier.append((content, md5))
+
+        drive_store.add(f"IMG_{i + 1:05d}.jpg", [targets[i % len(targets)]], "image/jpeg", content=content, md5=md5)
+
+    return root_ids
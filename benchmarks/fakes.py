@@ -0,0 +1,709 @@
+# fakes.py
+# In-process stand-ins for Drive, Sheets, S3 and Rekognition.
+#
+# Each fake implements just the calls the pipeline makes, with the
+# same request / response shapes, and routes every call through a
+# ServiceSim that adds latency, injects transient errors and enforces
+# a calls-per-second quota (answering with the service's own
+# throttling error), so retry and rate-limit paths are exercised too.
+
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import httplib2
+from botocore.exceptions import ClientError
+from googleapiclient.errors import HttpError
+
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+
+# ------------------------------------------------------
+# SIMULATION
+# ------------------------------------------------------
+
+class CallStats:
+    """Thread-safe call / error counters shared by all fakes."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.errors = Counter()
+        self._lock = threading.Lock()
+
+    def call(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def error(self, name, kind):
+        with self._lock:
+            self.errors[f"{name} {kind}"] += 1
+
+
+class ServiceSim:
+    """
+    latency_ms  mean added latency per call (±jitter)
+    error_rate  share of calls failing with a transient error
+    fail_ops    operations errors are injected into (None = all)
+    tps         calls per second per operation before throttling (0 = no quota)
+    """
+
+    def __init__(
+        self, service, stats, latency_ms=0.0, jitter=0.25,
+        error_rate=0.0, fail_ops=None, tps=0.0, seed=0
+    ):
+        self.service = service
+        self.stats = stats
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.fail_ops = fail_ops
+        self.tps = tps
+        self._rng = random.Random(seed)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _throttled(self, operation):
+        if not self.tps:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(operation, (self.tps, now))
+            tokens = min(self.tps, tokens + (now - updated) * self.tps)
+            if tokens < 1:
+                self._buckets[operation] = (tokens, now)
+                return True
+            self._buckets[operation] = (tokens - 1, now)
+            return False
+
+    def enter(self, operation, extra_seconds=0.0):
+        """
+        Account for one call. Returns None, "throttle" or "transient";
+        the caller raises its service's matching error.
+        """
+        name = f"{self.service}.{operation}"
+        self.stats.call(name)
+
+        if self._throttled(operation):
+            self.stats.error(name, "throttle")
+            return "throttle"
+
+        with self._lock:
+            delay = self.latency_ms / 1000 * self._rng.uniform(1 - self.jitter, 1 + self.jitter)
+            failed = self._rng.random() < self.error_rate
+        if self.fail_ops is not None and operation not in self.fail_ops:
+            failed = False
+        time.sleep(delay + extra_seconds)
+
+        if failed:
+            self.stats.error(name, "transient")
+            return "transient"
+        return None
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def new_id():
+    return uuid.uuid4().hex
+
+
+# ------------------------------------------------------
+# DRIVE
+# ------------------------------------------------------
+
+def _http_error(status, reason=None):
+    content = json.dumps({"error": {"code": status, "errors": [{"reason": reason or "backendError"}]}})
+    return HttpError(httplib2.Response({"status": str(status)}), content.encode("utf-8"))
+
+
+class DriveStore:
+    """Files, folders and the change log behind FakeDrive."""
+
+    def __init__(self):
+        self.files = {}
+        self.content = {}
+        self.children = {}
+        self.changes = []
+        self._lock = threading.Lock()
+
+    def add(self, name, parents, mime_type, content=None, md5=None, file_id=None):
+        meta = {
+            "id": file_id or new_id(),
+            "name": name,
+            "mimeType": mime_type,
+            "parents": list(parents),
+            "modifiedTime": _now(),
+            "version": "1",
+        }
+        if content is not None:
+            meta["md5Checksum"] = md5 or new_id()
+            meta["size"] = str(len(content))
+
+        with self._lock:
+            self.files[meta["id"]] = meta
+            if content is not None:
+                self.content[meta["id"]] = content
+            for parent in parents:
+                self.children.setdefault(parent, []).append(meta["id"])
+            self.changes.append(meta["id"])
+        return meta
+
+    def add_folder(self, name, parent=None, file_id=None):
+        return self.add(name, [parent] if parent else [], FOLDER_MIME, file_id=file_id)
+
+    def touch(self, file_id):
+        with self._lock:
+            meta = self.files[file_id]
+            meta["version"] = str(int(meta["version"]) + 1)
+            meta["modifiedTime"] = _now()
+            self.changes.append(file_id)
+
+
+def _unescape(value):
+    return re.sub(r"\\(.)", r"\1", value)
+
+
+class _DriveQuery:
+    """The subset of Drive's q= syntax the pipeline uses."""
+
+    def __init__(self, q):
+        q = q or ""
+        self.parents = re.findall(r"'([^']+)' in parents", q)
+        name = re.search(r"name='((?:[^'\\]|\\.)*)'", q)
+        self.name = _unescape(name.group(1)) if name else None
+        mime = re.search(r"mimeType='([^']+)'", q)
+        self.mime = mime.group(1) if mime else None
+        modified = re.search(r"modifiedTime > '([^']+)'", q)
+        self.modified_after = modified.group(1) if modified else None
+
+    def matches(self, meta):
+        if self.name is not None and meta["name"] != self.name:
+            return False
+        if self.mime is not None and meta["mimeType"] != self.mime:
+            return False
+        if self.modified_after is not None and meta["modifiedTime"] <= self.modified_after:
+            return False
+        return True
+
+
+class FakeRequest:
+    """Lazy call like googleapiclient's HttpRequest: nothing happens before execute()."""
+
+    def __init__(self, sim, operation, func, throttle_reason="rateLimitExceeded"):
+        self.sim = sim
+        self.operation = operation
+        self.func = func
+        self.throttle_reason = throttle_reason
+
+    def execute(self, http=None, num_retries=0):
+        outcome = self.sim.enter(self.operation)
+        if outcome == "throttle":
+            raise _http_error(403, self.throttle_reason)
+        if outcome == "transient":
+            raise _http_error(503)
+        return self.func()
+
+    def execute_in_batch(self):
+        # Batched calls share the batch's latency but can still fail alone
+        return self.func()
+
+
+class _FakeMediaHttp:
+    def __init__(self, drive, file_id):
+        self.drive = drive
+        self.file_id = file_id
+
+    def request(self, uri, method="GET", **kwargs):
+        content = self.drive.store.content.get(self.file_id)
+        extra = 0.0
+        if content is not None and self.drive.bandwidth_mbps:
+            extra = len(content) * 8 / (self.drive.bandwidth_mbps * 1e6)
+
+        outcome = self.drive.sim.enter("files.get_media", extra)
+        if outcome == "throttle":
+            return httplib2.Response({"status": "429"}), b""
+        if outcome == "transient":
+            return httplib2.Response({"status": "503"}), b""
+        if content is None:
+            return httplib2.Response({"status": "404"}), b""
+        return httplib2.Response({"status": "200", "content-length": str(len(content))}), content
+
+
+class _FakeMediaRequest:
+    """Enough of an HttpRequest for MediaIoBaseDownload."""
+
+    def __init__(self, drive, file_id):
+        self.http = _FakeMediaHttp(drive, file_id)
+        self.uri = f"https://fake.drive/files/{file_id}?alt=media"
+        self.headers = {}
+
+
+class _FakeFiles:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def _request(self, operation, func):
+        return FakeRequest(self.drive.sim, operation, func)
+
+    def list(self, q=None, pageToken=None, pageSize=100, **kwargs):
+        def run():
+            store = self.drive.store
+            query = _DriveQuery(q)
+            with store._lock:
+                if query.parents:
+                    ids = [fid for p in query.parents for fid in store.children.get(p, [])]
+                else:
+                    ids = list(store.files)
+                items = [dict(store.files[fid]) for fid in ids if query.matches(store.files[fid])]
+
+            start = int(pageToken or 0)
+            resp = {"files": items[start:start + pageSize]}
+            if start + pageSize < len(items):
+                resp["nextPageToken"] = str(start + pageSize)
+            return resp
+        return self._request("files.list", run)
+
+    def get(self, fileId, **kwargs):
+        def run():
+            meta = self.drive.store.files.get(fileId)
+            if meta is None:
+                raise _http_error(404, "notFound")
+            return dict(meta)
+        return self._request("files.get", run)
+
+    def get_media(self, fileId, **kwargs):
+        return _FakeMediaRequest(self.drive, fileId)
+
+    def create(self, body, **kwargs):
+        def run():
+            return dict(self.drive.store.add(body["name"], body.get("parents", []), body["mimeType"]))
+        return self._request("files.create", run)
+
+    def copy(self, fileId, body, **kwargs):
+        def run():
+            store = self.drive.store
+            src = store.files.get(fileId)
+            if src is None:
+                raise _http_error(404, "notFound")
+            copied = store.add(
+                body.get("name", src["name"]),
+                body["parents"],
+                src["mimeType"],
+                content=store.content.get(fileId),
+                md5=src.get("md5Checksum")
+            )
+            return dict(copied)
+        return self._request("files.copy", run)
+
+
+class _FakeChanges:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def getStartPageToken(self, **kwargs):
+        return FakeRequest(
+            self.drive.sim, "changes.getStartPageToken",
+            lambda: {"startPageToken": str(len(self.drive.store.changes))}
+        )
+
+    def list(self, pageToken, pageSize=100, **kwargs):
+        def run():
+            store = self.drive.store
+            with store._lock:
+                log = store.changes[int(pageToken):]
+                end = int(pageToken) + len(log)
+                page = log[:pageSize]
+                changes = [
+                    {"fileId": fid, "removed": False, "file": dict(store.files[fid])}
+                    for fid in page
+                ]
+            resp = {"changes": changes}
+            if len(log) > pageSize:
+                resp["nextPageToken"] = str(int(pageToken) + pageSize)
+            else:
+                resp["newStartPageToken"] = str(end)
+            return resp
+        return FakeRequest(self.drive.sim, "changes.list", run)
+
+
+class _FakeBatch:
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        outcome = self.drive.sim.enter("batch")
+        if outcome:
+            raise _http_error(503)
+
+        for request_id, request in self.requests:
+            self.drive.sim.stats.call(f"drive.batch:{request.operation}")
+            try:
+                self.callback(request_id, request.execute_in_batch(), None)
+            except HttpError as e:
+                self.callback(request_id, None, e)
+
+
+class FakeDrive:
+    """Stand-in for build('drive', 'v3')."""
+
+    def __init__(self, store, sim, bandwidth_mbps=0.0):
+        self.store = store
+        self.sim = sim
+        self.bandwidth_mbps = bandwidth_mbps
+
+    def files(self):
+        return _FakeFiles(self)
+
+    def changes(self):
+        return _FakeChanges(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _FakeBatch(self, callback)
+
+
+# ------------------------------------------------------
+# SHEETS
+# ------------------------------------------------------
+
+def _col_index(letters):
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch.upper()) - 64
+    return n - 1
+
+
+def _parse_range(range_name):
+    """'Sheet!A1:F1' → (sheet, first col, first row, last col, last row); open ends are None."""
+    sheet, _, cells = range_name.partition("!")
+    start, _, end = cells.partition(":")
+
+    def split(ref):
+        m = re.fullmatch(r"([A-Za-z]+)(\d*)", ref)
+        col, row = m.group(1), m.group(2)
+        return _col_index(col), int(row) - 1 if row else None
+
+    c1, r1 = split(start)
+    c2, r2 = split(end) if end else (c1, r1)
+    return sheet.strip("'"), c1, r1 or 0, c2, r2
+
+
+class SheetStore:
+    """Cell values per sheet, plus the Drive file whose version bumps on writes."""
+
+    def __init__(self, drive_store=None, file_id=None):
+        self.sheets = {}
+        self.drive_store = drive_store
+        self.file_id = file_id
+        self._lock = threading.Lock()
+
+    def read(self, range_name):
+        sheet, c1, r1, c2, r2 = _parse_range(range_name)
+        with self._lock:
+            rows = self.sheets.get(sheet, [])
+            rows = rows[r1:] if r2 is None else rows[r1:r2 + 1]
+            values = [list(row[c1:c2 + 1]) for row in rows]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def write(self, range_name, values):
+        sheet, c1, r1, _, _ = _parse_range(range_name)
+        with self._lock:
+            rows = self.sheets.setdefault(sheet, [])
+            for i, new_row in enumerate(values):
+                while len(rows) <= r1 + i:
+                    rows.append([])
+                row = rows[r1 + i]
+                while len(row) < c1 + len(new_row):
+                    row.append("")
+                row[c1:c1 + len(new_row)] = [str(v) for v in new_row]
+        self._touch()
+
+    def append(self, range_name, values):
+        sheet = _parse_range(range_name)[0]
+        with self._lock:
+            self.sheets.setdefault(sheet, []).extend([str(v) for v in row] for row in values)
+        self._touch()
+
+    def _touch(self):
+        if self.drive_store is not None and self.file_id:
+            self.drive_store.touch(self.file_id)
+
+
+class _FakeValues:
+    def __init__(self, sheets):
+        self.sheets = sheets
+
+    def _request(self, operation, func):
+        return FakeRequest(self.sheets.sim, operation, func, throttle_reason="rateLimitExceeded")
+
+    def get(self, spreadsheetId, range, **kwargs):
+        return self._request("values.get", lambda: {"range": range, "values": self.sheets.store.read(range)})
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        return self._request("values.batchGet", lambda: {
+            "valueRanges": [{"range": r, "values": self.sheets.store.read(r)} for r in ranges]
+        })
+
+    def update(self, spreadsheetId, range, body, **kwargs):
+        return self._request("values.update", lambda: self.sheets.store.write(range, body["values"]) or {})
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        def run():
+            for entry in body["data"]:
+                self.sheets.store.write(entry["range"], entry["values"])
+            return {"totalUpdatedRanges": len(body["data"])}
+        return self._request("values.batchUpdate", run)
+
+    def append(self, spreadsheetId, range, body, **kwargs):
+        return self._request("values.append", lambda: self.sheets.store.append(range, body["values"]) or {})
+
+
+class FakeSheets:
+    """Stand-in for build('sheets', 'v4')."""
+
+    def __init__(self, store, sim):
+        self.store = store
+        self.sim = sim
+
+    def spreadsheets(self):
+        return SimpleNamespace(values=lambda: _FakeValues(self))
+
+
+# ------------------------------------------------------
+# AWS
+# ------------------------------------------------------
+
+def _client_error(code, operation, status=400):
+    return ClientError(
+        {"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": status}},
+        operation
+    )
+
+
+class _AwsFake:
+    throttle_code = "ThrottlingException"
+
+    def __init__(self, sim):
+        self.sim = sim
+
+    def _enter(self, operation, extra_seconds=0.0):
+        outcome = self.sim.enter(operation, extra_seconds)
+        if outcome == "throttle":
+            raise _client_error(self.throttle_code, operation)
+        if outcome == "transient":
+            raise _client_error("InternalServerError", operation, 500)
+
+
+def _etag(body):
+    return '"%s"' % hashlib.md5(body).hexdigest()
+
+
+class _FakePaginator:
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def paginate(self, Bucket, Prefix="", **kwargs):
+        token = None
+        while True:
+            kwargs = {"Bucket": Bucket, "Prefix": Prefix}
+            if token:
+                kwargs["ContinuationToken"] = token
+            page = self.s3.list_objects_v2(**kwargs)
+            yield page
+            token = page.get("NextContinuationToken")
+            if not token:
+                return
+
+
+class FakeS3(_AwsFake):
+    """Stand-in for boto3.client('s3'), objects kept in memory."""
+
+    throttle_code = "SlowDown"
+
+    def __init__(self, sim):
+        super().__init__(sim)
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def head_bucket(self, Bucket):
+        self._enter("HeadBucket")
+        return {}
+
+    def create_bucket(self, Bucket, **kwargs):
+        self._enter("CreateBucket")
+        return {}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._enter("HeadObject")
+        with self._lock:
+            body = self.objects.get(Key)
+        if body is None:
+            raise _client_error("404", "HeadObject", 404)
+        return {"ContentLength": len(body), "ETag": _etag(body)}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._enter("GetObject")
+        with self._lock:
+            body = self.objects.get(Key)
+        if body is None:
+            raise _client_error("NoSuchKey", "GetObject", 404)
+        return {"Body": io.BytesIO(body), "ContentLength": len(body), "ETag": _etag(body)}
+
+    def _check_condition(self, operation, Key, IfMatch=None, IfNoneMatch=None):
+        """Conditional request semantics (call with the lock held)."""
+        body = self.objects.get(Key)
+        if IfNoneMatch == "*" and body is not None:
+            raise _client_error("PreconditionFailed", operation, 412)
+        if IfMatch is not None:
+            if body is None:
+                raise _client_error("NoSuchKey", operation, 404)
+            if _etag(body) != IfMatch:
+                raise _client_error("PreconditionFailed", operation, 412)
+
+    def put_object(self, Bucket, Key, Body=b"", IfMatch=None, IfNoneMatch=None, **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        elif hasattr(Body, "read"):
+            Body = Body.read()
+        self._enter("PutObject")
+        with self._lock:
+            self._check_condition("PutObject", Key, IfMatch, IfNoneMatch)
+            self.objects[Key] = bytes(Body)
+        return {"ETag": _etag(Body)}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, **kwargs):
+        self.put_object(Bucket=Bucket, Key=Key, Body=Fileobj.read())
+
+    def delete_object(self, Bucket, Key, IfMatch=None, **kwargs):
+        self._enter("DeleteObject")
+        with self._lock:
+            if IfMatch is not None:
+                self._check_condition("DeleteObject", Key, IfMatch)
+            self.objects.pop(Key, None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete):
+        self._enter("DeleteObjects")
+        with self._lock:
+            for obj in Delete["Objects"]:
+                self.objects.pop(obj["Key"], None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None, MaxKeys=1000, **kwargs):
+        self._enter("ListObjectsV2")
+        with self._lock:
+            keys = sorted(k for k in self.objects if k.startswith(Prefix))
+            sizes = {k: len(self.objects[k]) for k in keys}
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + MaxKeys]
+        resp = {"Contents": [{"Key": k, "Size": sizes[k]} for k in page], "KeyCount": len(page)}
+        if start + MaxKeys < len(keys):
+            resp["NextContinuationToken"] = str(start + MaxKeys)
+        return resp
+
+    def get_paginator(self, name):
+        assert name == "list_objects_v2", name
+        return _FakePaginator(self)
+
+
+class FakeRekognition(_AwsFake):
+    """
+    Stand-in for boto3.client('rekognition').
+
+    detect_faces reports faces_per_photo faces on a grid; a search
+    matches a random indexed face (match_rate of searches find someone).
+    """
+
+    def __init__(self, sim, s3=None, faces_per_photo=1, match_rate=0.9, seed=0):
+        super().__init__(sim)
+        self.s3 = s3
+        self.faces_per_photo = faces_per_photo
+        self.match_rate = match_rate
+        self.collections = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.meta = SimpleNamespace(method_to_api_mapping={
+            name: name for name in (
+                "list_collections", "create_collection", "index_faces",
+                "list_faces", "search_faces_by_image", "detect_faces",
+            )
+        })
+
+    def add_face(self, collection_id, external_id, face_id=None):
+        face = {"FaceId": face_id or str(uuid.uuid4()), "ExternalImageId": external_id}
+        with self._lock:
+            self.collections.setdefault(collection_id, []).append(face)
+        return face
+
+    def list_collections(self, **kwargs):
+        self._enter("ListCollections")
+        return {"CollectionIds": list(self.collections)}
+
+    def create_collection(self, CollectionId, **kwargs):
+        self._enter("CreateCollection")
+        with self._lock:
+            self.collections.setdefault(CollectionId, [])
+        return {"StatusCode": 200}
+
+    def index_faces(self, CollectionId, Image, ExternalImageId, **kwargs):
+        self._enter("IndexFaces")
+        key = Image.get("S3Object", {}).get("Name")
+        if key is not None and self.s3 is not None and key not in self.s3.objects:
+            raise _client_error("InvalidS3ObjectException", "IndexFaces")
+        face = self.add_face(CollectionId, ExternalImageId)
+        return {"FaceRecords": [{"Face": dict(face)}]}
+
+    def list_faces(self, CollectionId, MaxResults=1000, NextToken=None, **kwargs):
+        self._enter("ListFaces")
+        with self._lock:
+            faces = list(self.collections.get(CollectionId, []))
+        start = int(NextToken or 0)
+        resp = {"Faces": faces[start:start + MaxResults]}
+        if start + MaxResults < len(faces):
+            resp["NextToken"] = str(start + MaxResults)
+        return resp
+
+    def detect_faces(self, Image, **kwargs):
+        self._enter("DetectFaces")
+        n = self.faces_per_photo
+        cols = max(1, int(n ** 0.5 + 0.999))
+        rows = max(1, -(-n // cols))
+        details = []
+        for i in range(n):
+            details.append({
+                "BoundingBox": {
+                    "Left": (i % cols + 0.25) / cols,
+                    "Top": (i // cols + 0.25) / rows,
+                    "Width": 0.5 / cols,
+                    "Height": 0.5 / rows,
+                },
+                "Confidence": 99.5,
+                "Quality": {"Sharpness": 80.0, "Brightness": 70.0},
+            })
+        return {"FaceDetails": details}
+
+    def search_faces_by_image(self, CollectionId, Image, **kwargs):
+        self._enter("SearchFacesByImage")
+        with self._lock:
+            faces = self.collections.get(CollectionId, [])
+            if not faces:
+                return {"FaceMatches": []}
+            if self._rng.random() >= self.match_rate:
+                return {"FaceMatches": []}
+            face = self._rng.choice(faces)
+        return {"FaceMatches": [{"Face": dict(face), "Similarity": 99.0}]}
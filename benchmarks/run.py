@@ -0,0 +1,248 @@
+# run.py
+# Offline benchmarks for the pipeline's hot entry points.
+#
+#   python -m benchmarks.run sort --students 200 --photos 2000 --rekog-ms 120
+#   python -m benchmarks.run all --json
+#
+# Scenarios:
+#   sort     phase4_sort_uploads over fresh upload folders (with
+#            --cluster-workers: a distributed run, workers as threads)
+#   index    index_faces_and_record over refs/ in S3
+#   folders  create_output_structure for a new school year
+#
+# Drive, Sheets, S3 and Rekognition are in-process fakes (fakes.py),
+# so runs need no accounts and no network. Pipeline settings are read
+# from the environment as usual (SORT_*_WORKERS, REKOG_TPS, ...).
+# Each run reports wall time, items/sec, calls per API operation,
+# injected errors / throttles and the process's peak RSS.
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+SCENARIOS = ("sort", "index", "folders")
+
+# Calls the pipeline retries; errors are only injected into these
+# (S3 retries happen inside botocore, which the fakes replace)
+DRIVE_FAIL_OPS = {"files.get_media", "batch"}
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Offline pipeline benchmarks")
+    p.add_argument("scenario", choices=SCENARIOS + ("all",))
+
+    data = p.add_argument_group("data")
+    data.add_argument("--students", type=int, default=200)
+    data.add_argument("--classes", type=int, default=10)
+    data.add_argument("--folders", type=int, default=4, help="upload folders in the Validation sheet")
+    data.add_argument("--subfolders", type=int, default=2, help="sub-folders per upload folder")
+    data.add_argument("--photos", type=int, default=500, help="photos across all upload folders")
+    data.add_argument("--faces", type=int, default=1, help="faces per photo")
+    data.add_argument("--photo-px", type=int, default=1600, help="long edge of generated photos")
+    data.add_argument("--duplicates", type=float, default=0.0, help="share of byte-identical re-uploads")
+    data.add_argument("--match-rate", type=float, default=0.9, help="share of face searches that match")
+    data.add_argument("--existing", type=float, default=0.0, help="folders: share of student folders already there")
+    data.add_argument("--seed", type=int, default=1)
+
+    sim = p.add_argument_group("simulation")
+    sim.add_argument("--drive-ms", type=float, default=40.0)
+    sim.add_argument("--sheets-ms", type=float, default=150.0)
+    sim.add_argument("--s3-ms", type=float, default=20.0)
+    sim.add_argument("--rekog-ms", type=float, default=150.0)
+    sim.add_argument("--bandwidth-mbps", type=float, default=200.0, help="Drive download bandwidth (0 = unlimited)")
+    sim.add_argument("--error-rate", type=float, default=0.0, help="transient errors on downloads, batches and Rekognition")
+    sim.add_argument("--rekog-quota", type=float, default=None, help="Rekognition TPS per operation before throttling (default: REKOG_TPS)")
+
+    p.add_argument("--cluster-workers", type=int, default=0, help="sort: coordinator + N-1 workers (cluster.py) instead of one process")
+    p.add_argument("--json", action="store_true", help="print the result as JSON")
+    return p.parse_args(argv)
+
+
+def peak_rss_mb():
+    """Peak RSS of this process and of its (prep pool) children, Linux KB units."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(own / 1024, 1), round(children / 1024, 1)
+
+
+# ------------------------------------------------------
+# SETUP
+# ------------------------------------------------------
+
+def build_world(args):
+    """Fakes wired into Scripts.clients; returns them as a namespace dict."""
+    from Scripts.clients import override_clients
+    from Scripts.config import REKOG_TPS, MASTERSHEET_ID
+    from . import fakes
+
+    stats = fakes.CallStats()
+    drive_store = fakes.DriveStore()
+    sheet_store = fakes.SheetStore(drive_store, MASTERSHEET_ID)
+
+    drive_sim = fakes.ServiceSim("drive", stats, args.drive_ms, error_rate=args.error_rate, fail_ops=DRIVE_FAIL_OPS, seed=args.seed)
+    sheets_sim = fakes.ServiceSim("sheets", stats, args.sheets_ms, seed=args.seed)
+    s3_sim = fakes.ServiceSim("s3", stats, args.s3_ms, seed=args.seed)
+    rekog_sim = fakes.ServiceSim(
+        "rekognition", stats, args.rekog_ms,
+        error_rate=args.error_rate,
+        tps=REKOG_TPS if args.rekog_quota is None else args.rekog_quota,
+        seed=args.seed
+    )
+
+    s3 = fakes.FakeS3(s3_sim)
+    rekognition = fakes.FakeRekognition(rekog_sim, s3, args.faces, args.match_rate, seed=args.seed)
+
+    override_clients(
+        drive=lambda: fakes.FakeDrive(drive_store, drive_sim, args.bandwidth_mbps),
+        sheets=lambda: fakes.FakeSheets(sheet_store, sheets_sim),
+        s3=lambda: s3,
+        rekognition=lambda: rekognition,
+    )
+
+    return {
+        "stats": stats,
+        "drive_store": drive_store,
+        "sheet_store": sheet_store,
+        "s3": s3,
+        "rekognition": rekognition,
+    }
+
+
+def prepare(scenario, args, world):
+    """Generate the data a scenario starts from; returns the item count."""
+    from . import datagen
+
+    students = datagen.make_students(args.students, args.classes)
+    drive_store, sheet_store = world["drive_store"], world["sheet_store"]
+    datagen.write_output_root(drive_store)
+
+    if scenario == "sort":
+        upload_ids = datagen.write_uploads(
+            drive_store, args.folders, args.subfolders, args.photos,
+            args.photo_px, args.duplicates, args.seed
+        )
+        datagen.write_mastersheet(drive_store, sheet_store, students, upload_ids)
+        datagen.write_output_tree(drive_store, students)
+        datagen.write_index(world["s3"], world["rekognition"], students)
+        return args.photos
+
+    datagen.write_mastersheet(drive_store, sheet_store, students)
+
+    if scenario == "index":
+        datagen.write_refs(world["s3"], students, datagen.make_jpeg(400, 400, args.seed))
+    else:
+        datagen.write_output_tree(drive_store, students, args.existing, args.seed)
+    return args.students
+
+
+# ------------------------------------------------------
+# RUN
+# ------------------------------------------------------
+
+def run_scenario(scenario, args):
+    from Scripts.pipeline import Progress
+
+    world = build_world(args)
+    items = prepare(scenario, args, world)
+    world["stats"].calls.clear()
+    world["stats"].errors.clear()
+
+    progress = Progress()
+    start = time.perf_counter()
+
+    if scenario == "sort" and args.cluster_workers:
+        from Scripts import sorter, cluster
+        workers = [
+            threading.Thread(target=cluster.work, kwargs={"progress": progress})
+            for _ in range(args.cluster_workers - 1)
+        ]
+        for t in workers:
+            t.start()
+        cluster.coordinate(progress=progress)
+        for t in workers:
+            t.join()
+        if sorter._prep_pool is not None:
+            sorter._prep_pool.shutdown(wait=True)
+    elif scenario == "sort":
+        from Scripts import sorter
+        sorter.phase4_sort_uploads(progress=progress)
+        # Children only show up in RUSAGE_CHILDREN once they have exited
+        if sorter._prep_pool is not None:
+            sorter._prep_pool.shutdown(wait=True)
+    elif scenario == "index":
+        from Scripts.rekog_manager import index_faces_and_record
+        index_faces_and_record()
+    else:
+        from Scripts.folders_manager import create_output_structure
+        create_output_structure()
+
+    seconds = time.perf_counter() - start
+    own_mb, children_mb = peak_rss_mb()
+    calls = world["stats"].calls
+
+    return {
+        "scenario": scenario,
+        "items": items,
+        "seconds": round(seconds, 3),
+        "items_per_sec": round(items / seconds, 2) if seconds else 0.0,
+        "api_calls": sum(calls.values()),
+        "calls": dict(sorted(calls.items())),
+        "errors": dict(sorted(world["stats"].errors.items())),
+        "progress": progress.snapshot(),
+        "peak_rss_mb": own_mb,
+        "peak_rss_children_mb": children_mb,
+    }
+
+
+def run_all(argv):
+    """Each scenario in its own process, so peak RSS is per scenario."""
+    results = []
+    rest = [a for a in argv if a not in ("all", "--json")]
+    for scenario in SCENARIOS:
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.run", scenario, "--json"] + rest,
+            check=True, stdout=subprocess.PIPE, text=True
+        ).stdout
+        # Progress bars / prints come first; the JSON is the last line
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    return results
+
+
+def format_result(result):
+    lines = [
+        f"📊 {result['scenario']}: {result['items']} items in {result['seconds']:.1f}s "
+        f"→ {result['items_per_sec']:.1f}/s, {result['api_calls']} API calls, "
+        f"peak RSS {result['peak_rss_mb']:.0f} MB (+{result['peak_rss_children_mb']:.0f} MB children)"
+    ]
+    if result["progress"]:
+        lines.append("  progress: " + ", ".join(f"{k}={v}" for k, v in result["progress"].items()))
+    for name, n in result["calls"].items():
+        lines.append(f"  {name:<44} {n:>7}")
+    for name, n in result["errors"].items():
+        lines.append(f"  ⚠️ {name:<41} {n:>7}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv)
+
+    if args.scenario == "all":
+        results = run_all(argv)
+    else:
+        results = [run_scenario(args.scenario, args)]
+
+    if args.json:
+        print(json.dumps(results if args.scenario == "all" else results[0]))
+    else:
+        for result in results:
+            print(format_result(result))
+
+
+if __name__ == "__main__":
+    # The sorter's prep pool uses spawn, which re-imports this module
+    main()